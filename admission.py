@@ -0,0 +1,188 @@
+"""Upload admission: preflight probing, load shedding and ETA estimates.
+
+Uploads are probed with ffprobe before any work is queued; files without
+an audio stream or longer than MAX_VIDEO_SECONDS are refused. When the
+queue is full the upload is refused with 429 and a Retry-After hint, so
+jobs already accepted keep their latency. Completion times are estimated
+from per-stage realtime factors (stage seconds per second of video)
+learned from recently finished jobs.
+"""
+import os
+import json
+import logging
+import statistics
+import subprocess
+import threading
+import time
+from collections import deque, namedtuple
+
+from models import TranslationJob
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Admission limits, overridable through the environment
+MAX_VIDEO_SECONDS = float(os.environ.get('MAX_VIDEO_SECONDS', '3600'))
+# Jobs allowed to wait for a worker before uploads are refused; 0 means no limit
+MAX_QUEUED_JOBS = int(os.environ.get('MAX_QUEUED_JOBS', '50'))
+PROBE_TIMEOUT = 30
+# Finished jobs the ETA model learns from, and how often it re-reads them
+ETA_WINDOW = int(os.environ.get('ETA_WINDOW_JOBS', '50'))
+ETA_REFRESH_SECONDS = 300
+# Bounds for Retry-After, in seconds
+MIN_RETRY_AFTER = 5
+MAX_RETRY_AFTER = 900
+
+# Stages timed by each pipeline mode, in order
+PIPELINE_STAGES = {
+    'batch': ('extract_audio', 'transcribe_audio', 'translate_text', 'text_to_speech', 'merge_audio_video'),
+    'streaming': ('extract_audio', 'stream_segments', 'merge_audio_video'),
+}
+# Realtime factors assumed until jobs have finished
+DEFAULT_FACTORS = {
+    'extract_audio': 0.02,
+    'transcribe_audio': 0.4,
+    'translate_text': 0.05,
+    'text_to_speech': 0.15,
+    'merge_audio_video': 0.05,
+    'stream_segments': 0.6,
+}
+DEFAULT_VIDEO_SECONDS = 120
+
+UPLOADS_REFUSED = metrics.REGISTRY.register(metrics.Counter(
+    'videoverse_uploads_refused_total', 'Uploads refused at admission', ['reason']))
+UPLOAD_DURATION = metrics.REGISTRY.register(metrics.Histogram(
+    'videoverse_upload_video_seconds', 'Duration of admitted uploads', buckets=metrics.DURATION_BUCKETS))
+
+ProbeResult = namedtuple('ProbeResult', 'duration has_audio has_video')
+
+
+class PreflightError(ValueError):
+    """The upload cannot be processed; the message is shown to the user"""
+
+    def __init__(self, message, reason):
+        super().__init__(message)
+        self.reason = reason
+
+
+def probe_video(path):
+    """Duration and streams of a video, or None if ffprobe is not installed"""
+    command = [
+        'ffprobe', '-v', 'error', '-print_format', 'json',
+        '-show_entries', 'format=duration:stream=codec_type', path
+    ]
+    try:
+        result = subprocess.run(command, capture_output=True, check=True, timeout=PROBE_TIMEOUT)
+        info = json.loads(result.stdout or b'{}')
+    except FileNotFoundError:
+        return None
+    except (subprocess.SubprocessError, ValueError) as e:
+        raise PreflightError('The file could not be read as a video', 'unreadable') from e
+    types = {stream.get('codec_type') for stream in info.get('streams', [])}
+    try:
+        duration = float(info.get('format', {}).get('duration'))
+    except (TypeError, ValueError):
+        duration = None
+    return ProbeResult(duration, 'audio' in types, 'video' in types)
+
+
+def preflight(path, max_seconds=MAX_VIDEO_SECONDS):
+    """Probe an upload and refuse it if it can't or shouldn't be processed"""
+    probe = probe_video(path)
+    if probe is None:
+        logger.warning("ffprobe is not installed; uploads are admitted without preflight checks")
+        return ProbeResult(None, True, True)
+    if not probe.has_audio:
+        raise PreflightError('The video has no audio track to dub', 'no_audio')
+    if probe.duration and max_seconds and probe.duration > max_seconds:
+        raise PreflightError(f'Videos can be at most {max_seconds / 60:.0f} minutes long '
+                             f'(this one is {probe.duration / 60:.0f} minutes)', 'too_long')
+    if probe.duration:
+        UPLOAD_DURATION.observe(probe.duration)
+    return probe
+
+
+def refuse(reason):
+    UPLOADS_REFUSED.inc(reason=reason)
+
+
+def retry_after(seconds):
+    """Retry-After value clamped to sensible bounds"""
+    return int(min(MAX_RETRY_AFTER, max(MIN_RETRY_AFTER, seconds)))
+
+
+class EtaModel:
+    """Rolling per-stage realtime factors learned from finished jobs"""
+
+    def __init__(self, window=ETA_WINDOW, mode='batch'):
+        self.window = window
+        self.stages = PIPELINE_STAGES.get(mode, PIPELINE_STAGES['batch'])
+        self._factors = {}
+        self._durations = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self.loaded_at = None
+
+    def observe(self, timings, audio_seconds):
+        """Learn from one finished job's stage timings"""
+        if not audio_seconds or not timings:
+            return
+        with self._lock:
+            for stage, seconds in timings.items():
+                if stage in DEFAULT_FACTORS:
+                    self._factors.setdefault(stage, deque(maxlen=self.window)).append(seconds / audio_seconds)
+            self._durations.append(audio_seconds)
+
+    def load(self, extras):
+        """Replace what was learned with the metadata of recent jobs, newest first"""
+        with self._lock:
+            self._factors = {}
+            self._durations.clear()
+        for extra in reversed(extras):
+            self.observe(extra.get('timings'), extra.get('audio_seconds'))
+        self.loaded_at = time.time()
+
+    def refresh(self, max_age=ETA_REFRESH_SECONDS):
+        """Re-read recent jobs from the database when stale; needs an app context"""
+        if self.loaded_at is not None and time.time() - self.loaded_at < max_age:
+            return
+        try:
+            self.load(TranslationJob.recent_metrics(self.window))
+        except Exception as e:
+            self.loaded_at = time.time()
+            logger.warning(f"Could not load job timings for ETA estimates: {e}")
+
+    def factor(self, stage):
+        with self._lock:
+            samples = list(self._factors.get(stage, ()))
+        # The median ignores the odd job stuck behind a slow service
+        return statistics.median(samples) if samples else DEFAULT_FACTORS.get(stage, 0.0)
+
+    def typical_duration(self):
+        with self._lock:
+            durations = list(self._durations)
+        return statistics.median(durations) if durations else DEFAULT_VIDEO_SECONDS
+
+    def processing_seconds(self, duration=None, done=()):
+        """Expected processing time of a video, skipping stages in ``done``"""
+        duration = duration or self.typical_duration()
+        return duration * sum(self.factor(stage) for stage in self.stages if stage not in done)
+
+    def estimate(self, duration=None, jobs_ahead=0, workers=1, done=()):
+        """Seconds until a job finishes: its queue wait plus its remaining stages"""
+        wait = jobs_ahead * self.processing_seconds() / max(1, workers)
+        return round(wait + self.processing_seconds(duration, done))
+
+
+_model = None
+_model_lock = threading.Lock()
+
+
+def get_eta_model():
+    """Return the process-wide ETA model"""
+    global _model
+    with _model_lock:
+        if _model is None:
+            # Same setting as video_processor.PIPELINE_MODE, read here so the
+            # web tier doesn't import the pipeline
+            _model = EtaModel(mode=os.environ.get('PIPELINE_MODE', 'batch'))
+        return _model
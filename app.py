@@ -1,16 +1,26 @@
 import os
+import base64
+import json
 import logging
+import mimetypes
+import unicodedata
 import uuid
 import time
 from datetime import datetime
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, send_file, session
+from flask import Flask, Response, render_template, request, redirect, url_for, flash, jsonify, send_file, send_from_directory, session, stream_with_context, abort
 from werkzeug.utils import secure_filename
-import threading
+from sqlalchemy.exc import IntegrityError
+from urllib.parse import quote
 import shutil
-import random
-from sqlalchemy import desc
 from models import db, TranslationJob, UserPreference
-from video_processor import VideoProcessor
+from scheduler import get_scheduler
+from content_store import get_content_store, save_and_hash, PIPELINE_VERSION
+from events import get_hub
+from job_registry import JobRegistry
+from janitor import StorageJanitor
+from admission import get_eta_model, preflight, refuse, retry_after, PreflightError, MAX_QUEUED_JOBS
+from profiling import ARTIFACTS as PROFILE_ARTIFACTS, profile_dir
+import metrics
 
 # Configure logging
 logging.basicConfig(level=logging.DEBUG)
@@ -37,12 +47,44 @@ PROCESSED_FOLDER = 'processed'
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 os.makedirs(PROCESSED_FOLDER, exist_ok=True)
 
+# 'local' runs jobs on this process's worker pool; 'database' leaves them
+# queued in translation_jobs for worker.py processes to claim
+JOB_QUEUE_BACKEND = os.environ.get('JOB_QUEUE_BACKEND', 'local')
+
+# Status push: SSE keepalive interval and the longest a long-poll may wait
+SSE_KEEPALIVE_SECONDS = 15
+LONG_POLL_MAX_SECONDS = 30
+
+# How downloads are served: 'flask' streams them from this process (with
+# Range and conditional request support), 'x-sendfile' (Apache, lighttpd)
+# or 'x-accel' (nginx) hand the file to the front proxy
+DOWNLOAD_OFFLOAD = os.environ.get('DOWNLOAD_OFFLOAD', 'flask')
+# nginx internal location that maps to the processed folder, for 'x-accel'
+DOWNLOAD_ACCEL_PREFIX = os.environ.get('DOWNLOAD_ACCEL_PREFIX', '/protected-downloads/')
+# Outputs never change once written, so clients may cache them
+DOWNLOAD_MAX_AGE = 3600
+if DOWNLOAD_OFFLOAD == 'x-sendfile':
+    app.config['USE_X_SENDFILE'] = True
+
+# Job history page sizes
+JOBS_PAGE_SIZE = 10
+MAX_JOBS_PAGE_SIZE = 100
+
 # Define allowed file extensions
 ALLOWED_EXTENSIONS = {'mp4', 'avi', 'mov', 'mkv', 'webm'}
 
-# Store in-memory processing jobs for active sessions
-# Will be synced with database for persistence
-processing_jobs = {}
+# Live state of jobs handled by this process; status changes are written
+# to the database in batches by the registry's write-behind flusher, and
+# shared with the other processes on this host through the status table
+processing_jobs = JobRegistry(app)
+
+# Deletes expired jobs and their files and keeps storage within budget.
+# Only serving processes start it (main.py); tools that import the app don't
+janitor = StorageJanitor(app, registry=processing_jobs)
+
+# Jobs interrupted by a restart resume from their checkpoints. Only enable
+# this where one process runs jobs; worker.py recovers jobs through leases.
+RESUME_INTERRUPTED_JOBS = os.environ.get('RESUME_INTERRUPTED_JOBS', '0') == '1'
 
 # Helper function to check allowed file
 def allowed_file(filename):
@@ -53,10 +95,6 @@ def allowed_file(filename):
 def ensure_session():
     if 'user_session_id' not in session:
         session['user_session_id'] = str(uuid.uuid4())
-    
-    # Run cleanup occasionally
-    if random.random() < 0.01:  # 1% probability per request
-        TranslationJob.cleanup_old_jobs(hours=24)
 
 # Route for the home page
 @app.route('/')
@@ -76,7 +114,7 @@ def index():
         db.session.commit()
     
     # Get recent jobs for this user to display in history
-    recent_jobs = TranslationJob.query.order_by(desc(TranslationJob.created_at)).limit(5).all()
+    recent_jobs = TranslationJob.history(user_session_id, limit=5)
     
     return render_template('index.html', 
                            user_prefs=user_prefs, 
@@ -119,6 +157,105 @@ def set_preferences():
         }
     })
 
+def queue_load():
+    """(jobs waiting for a worker, workers serving the queue)"""
+    if JOB_QUEUE_BACKEND == 'database':
+        waiting = TranslationJob.query.filter_by(status='queued').count()
+        busy = (TranslationJob.query.filter(TranslationJob.worker_id.isnot(None))
+                .filter(TranslationJob.status.notin_(TranslationJob.TERMINAL_STATUSES + ('queued',))).count())
+        return waiting, max(1, busy)
+    scheduler = get_scheduler()
+    return scheduler.queue_depth(), scheduler.max_workers
+
+def overloaded(message, seconds):
+    """429 response telling the client when to try again"""
+    delay = retry_after(seconds)
+    response = jsonify({'success': False, 'message': message, 'retry_after': delay})
+    response.headers['Retry-After'] = str(delay)
+    return response, 429
+
+def register_job(job_id, filename, file_path, file_size, content_hash, target_language, parent_id=None,
+                 duration=None, profile=False):
+    """Create the in-memory and database records for one target language.
+    
+    Reuses a finished output or joins an in-flight job for identical content
+    when possible. The caller holds the content store lock and commits.
+    """
+    store = get_content_store()
+    output_path = None
+    leader = None
+    if store.has_output(content_hash, target_language, filename):
+        output_path = store.checkout_output(
+            content_hash, target_language,
+            os.path.join(PROCESSED_FOLDER, job_id, f'dubbed_{filename}'))
+        status, progress, message = 'completed', 100, 'Processing completed (reused identical video)'
+    else:
+        leader = TranslationJob.find_in_flight(content_hash, target_language, PIPELINE_VERSION)
+        if leader:
+            status, progress, message = 'waiting_duplicate', 0, 'Identical video is already being processed...'
+        elif parent_id:
+            status, progress, message = 'waiting_parent', 0, 'Waiting for shared transcription...'
+        else:
+            status, progress, message = 'queued', 0, 'Waiting for a free worker...'
+    
+    # Create database record
+    job = TranslationJob(
+        id=job_id,
+        filename=filename,
+        original_path=file_path,
+        output_path=output_path,
+        target_language=target_language,
+        status=status,
+        progress=progress,
+        message=message,
+        file_size=file_size,
+        duration=duration,
+        content_hash=content_hash,
+        pipeline_version=PIPELINE_VERSION,
+        duplicate_of=leader.id if leader else None,
+        parent_id=parent_id,
+        owner=session.get('user_session_id'),
+        extra_data={'profile': True} if profile else None,
+        completed_at=datetime.utcnow() if output_path else None
+    )
+    if leader is None and output_path is None:
+        # Another process may be registering the same content; the unique
+        # index on leader rows lets only one of them lead
+        try:
+            with db.session.begin_nested():
+                db.session.add(job)
+        except IntegrityError:
+            leader = TranslationJob.find_in_flight(content_hash, target_language, PIPELINE_VERSION)
+            if leader:
+                status, progress, message = 'waiting_duplicate', 0, 'Identical video is already being processed...'
+                job.status, job.message, job.duplicate_of = status, message, leader.id
+            db.session.add(job)
+    else:
+        db.session.add(job)
+    
+    # Initialize job status in memory
+    job_data = {
+        'id': job_id,
+        'status': status,
+        'progress': progress,
+        'message': message,
+        'filename': filename,
+        'target_language': target_language,
+        'original_path': file_path,
+        'output_path': output_path,
+        'file_size': file_size,
+        'duration': duration,
+        'duplicate_of': leader.id if leader else None,
+        'parent_id': parent_id,
+        'created_at': time.time()
+    }
+    if profile:
+        job_data['profile'] = True
+    
+    if JOB_QUEUE_BACKEND == 'local':
+        processing_jobs.create(job_id, job_data)
+    return job_data
+
 # Route for video upload
 @app.route('/upload', methods=['POST'])
 def upload_video():
@@ -134,6 +271,20 @@ def upload_video():
         flash('No selected file', 'danger')
         return jsonify({'success': False, 'message': 'No selected file'})
     
+    # Refuse uploads that would leave too little disk space
+    if not janitor.has_room(request.content_length or 0):
+        janitor.reject_upload()
+        return overloaded('Server storage is full, please try again later', janitor.interval)
+    
+    # Shed load while the queue is full, so jobs already accepted keep their latency
+    eta_model = get_eta_model()
+    eta_model.refresh()
+    waiting, workers = queue_load()
+    if MAX_QUEUED_JOBS and waiting >= MAX_QUEUED_JOBS:
+        refuse('queue_full')
+        return overloaded('The server is busy, please try again later',
+                          eta_model.processing_seconds() * (waiting - MAX_QUEUED_JOBS + 1) / workers)
+    
     # Check if the file extension is allowed
     if file and allowed_file(file.filename):
         # Generate a unique ID for the job
@@ -146,129 +297,495 @@ def upload_video():
         job_dir = os.path.join(UPLOAD_FOLDER, job_id)
         os.makedirs(job_dir, exist_ok=True)
         
-        # Save the file
+        # Save the file, hashing it on the way to disk
         file_path = os.path.join(job_dir, filename)
-        file.save(file_path)
+        content_hash, file_size = save_and_hash(file, file_path)
         
-        # Get target language
-        target_language = request.form.get('target_language', 'en')
+        # Check duration and streams before any work is queued
+        try:
+            probe = preflight(file_path)
+        except PreflightError as e:
+            refuse(e.reason)
+            shutil.rmtree(job_dir, ignore_errors=True)
+            return jsonify({'success': False, 'message': str(e)}), 400
         
-        # Save file size
-        file_size = os.path.getsize(file_path)
+        # Keep a single copy of identical uploads
+        store = get_content_store()
+        store.adopt_upload(content_hash, file_path)
         
-        # Initialize job status in memory
-        job_data = {
-            'status': 'uploaded',
-            'progress': 0,
-            'message': 'Video uploaded successfully',
-            'filename': filename,
-            'target_language': target_language,
-            'original_path': file_path,
-            'output_path': None,
-            'file_size': file_size,
-            'created_at': time.time()
-        }
+        # Get target languages; several may be requested for one upload
+        target_languages = []
+        for value in request.form.getlist('target_language'):
+            for language in value.split(','):
+                language = language.strip()
+                if language and language not in target_languages:
+                    target_languages.append(language)
+        target_languages = target_languages or ['en']
         
-        processing_jobs[job_id] = job_data
+        # Lower values are scheduled first
+        priority = request.form.get('priority', 0, type=int)
+        # Debug flag: record a profile of this job's run
+        profile = request.form.get('profile', '').lower() in ('1', 'true', 'on', 'yes')
         
-        # Create database record
-        translation_job = TranslationJob(
-            id=job_id,
-            filename=filename,
-            original_path=file_path,
-            target_language=target_language,
-            status='uploaded',
-            progress=0,
-            message='Video uploaded successfully',
-            file_size=file_size
-        )
-        
-        # Save to database
-        db.session.add(translation_job)
-        db.session.commit()
+        # The jobs' owner column references the session's preferences
+        UserPreference.ensure(session.get('user_session_id'))
+        with store.lock:
+            if len(target_languages) == 1:
+                job_data = register_job(job_id, filename, file_path, file_size, content_hash, target_languages[0],
+                                        duration=probe.duration, profile=profile)
+                pending = {target_languages[0]: job_id} if job_data['status'] == 'queued' else {}
+            else:
+                # A parent job runs the shared stages; each language gets a child job
+                children = {}
+                for language in target_languages:
+                    child_id = str(uuid.uuid4())
+                    children[language] = register_job(child_id, filename, file_path, file_size,
+                                                      content_hash, language, parent_id=job_id,
+                                                      duration=probe.duration)
+                pending = {language: child['id'] for language, child in children.items()
+                           if child['status'] == 'waiting_parent'}
+                if pending:
+                    status, message = 'queued', 'Waiting for a free worker...'
+                else:
+                    status, message = 'completed', 'All languages reused from identical videos'
+                job_data = {
+                    'id': job_id,
+                    'status': status,
+                    'progress': 0 if pending else 100,
+                    'message': message,
+                    'filename': filename,
+                    'target_language': 'multi',
+                    'original_path': file_path,
+                    'output_path': None,
+                    'file_size': file_size,
+                    'duration': probe.duration,
+                    'children': {language: child['id'] for language, child in children.items()},
+                    'created_at': time.time()
+                }
+                if profile:
+                    job_data['profile'] = True
+                if JOB_QUEUE_BACKEND == 'local':
+                    processing_jobs.create(job_id, job_data)
+                db.session.add(TranslationJob(
+                    id=job_id,
+                    filename=filename,
+                    original_path=file_path,
+                    target_language='multi',
+                    status=status,
+                    progress=job_data['progress'],
+                    message=message,
+                    file_size=file_size,
+                    duration=probe.duration,
+                    content_hash=content_hash,
+                    pipeline_version=PIPELINE_VERSION,
+                    owner=session.get('user_session_id'),
+                    extra_data={'profile': True} if profile else None,
+                    completed_at=None if pending else datetime.utcnow()
+                ))
+            
+            # Save to database
+            db.session.commit()
         
         # Store user's last target language
         user_session_id = session.get('user_session_id')
         if user_session_id:
             user_prefs = UserPreference.query.filter_by(session_id=user_session_id).first()
             if user_prefs:
-                user_prefs.last_target_language = target_language
+                user_prefs.last_target_language = target_languages[0]
                 db.session.commit()
         
-        # Start processing in a separate thread
-        processor = VideoProcessor(job_id, file_path, target_language, processing_jobs)
-        thread = threading.Thread(target=processor.process_video)
-        thread.daemon = True
-        thread.start()
-        
-        return jsonify({
+        response = {
             'success': True,
             'job_id': job_id,
-            'message': 'Video uploaded successfully. Processing started.'
-        })
+            'children': job_data.get('children'),
+            'message': 'Video uploaded successfully. Processing queued.'
+        }
+        
+        if pending:
+            response['eta_seconds'] = eta_model.estimate(probe.duration, jobs_ahead=waiting, workers=workers)
+        
+        if not pending:
+            # Nothing to process: the outputs exist or will come from leader jobs
+            response.update({'duplicate_of': job_data.get('duplicate_of'), 'message': job_data['message']})
+            return jsonify(response)
+        
+        if JOB_QUEUE_BACKEND == 'database':
+            # A worker.py process will claim the queued row
+            response['queue_position'] = TranslationJob.query.filter_by(status='queued').count()
+        else:
+            # Hand the job to the bounded worker pool
+            child_jobs = pending if job_data.get('children') else None
+            response['queue_position'] = submit_job(job_id, file_path, job_data['target_language'], pending,
+                                                    child_jobs=child_jobs, priority=priority)
+        
+        return jsonify(response)
     
     flash('File type not allowed', 'danger')
     return jsonify({'success': False, 'message': 'File type not allowed'})
 
-# Route to check job status
-@app.route('/status/<job_id>', methods=['GET'])
-def job_status(job_id):
-    # Check in-memory cache first for performance
-    if job_id in processing_jobs:
-        # If status is completed or error, sync with database
-        status = processing_jobs[job_id].get('status')
-        if status in ['completed', 'error']:
-            # Update database
-            job = TranslationJob.query.get(job_id)
-            if job:
-                job.status = status
-                job.progress = processing_jobs[job_id].get('progress', 0)
-                job.message = processing_jobs[job_id].get('message', '')
-                job.output_path = processing_jobs[job_id].get('output_path')
-                
-                if status == 'completed':
-                    job.completed_at = datetime.utcnow()
-                
-                db.session.commit()
-                
-        return jsonify(processing_jobs[job_id])
+def submit_job(job_id, file_path, target_language, pending, child_jobs=None, priority=0):
+    """Queue a job on this process's worker pool and return its queue position.
+    
+    ``pending`` maps target language -> id of each job the run finishes.
+    Stages checkpointed by an earlier run of the same job are skipped.
+    """
+    scheduler = get_scheduler()
+    
+    def run_job():
+        # The pipeline (numpy, speech and TTS clients) is only loaded by
+        # processes that actually run jobs
+        from video_processor import VideoProcessor
+        processor = VideoProcessor(job_id, file_path, target_language, processing_jobs,
+                                   scheduler=scheduler, child_jobs=child_jobs)
+        processor.process_video()
+        # Write the final states now rather than at the next interval
+        processing_jobs.flush()
+        with app.app_context():
+            # Share the results with identical uploads that joined these jobs
+            for finished_id in pending.values():
+                get_content_store().resolve_duplicates(finished_id, processing_jobs.get(finished_id),
+                                                       processing_jobs)
+    
+    return scheduler.submit(job_id, run_job, priority=priority)
+
+def requeue_job(job, message):
+    """Run an unfinished or failed job again, resuming from its checkpoints.
+    
+    Returns False if another process requeued it first.
+    """
+    children = TranslationJob.query.filter_by(parent_id=job.id).filter(
+        TranslationJob.status.notin_(['completed', 'waiting_duplicate'])).all()
+    if job.content_hash and job.duplicate_of is None and job.target_language != 'multi':
+        leader = TranslationJob.find_in_flight(job.content_hash, job.target_language, job.pipeline_version)
+        if leader is not None and leader.id != job.id:
+            # An identical job is running now; wait for its result instead
+            TranslationJob.follow([job.id], leader.id)
+            return True
+    if not TranslationJob.mark_for_resume(job.id, job.status, message):
+        return False
+    for child in children:
+        TranslationJob.mark_for_resume(child.id, child.status, 'Waiting for shared transcription...',
+                                       status='waiting_parent')
+    if JOB_QUEUE_BACKEND == 'database':
+        # A worker.py process will claim the queued row
+        return True
+    
+    for entry in [job] + children:
+        db.session.refresh(entry)
+        processing_jobs.create(entry.id, {**entry.to_dict(), 'original_path': entry.original_path})
+    if job.target_language == 'multi':
+        pending = {child.target_language: child.id for child in children}
+        submit_job(job.id, job.original_path, 'multi', pending, child_jobs=pending)
+    else:
+        submit_job(job.id, job.original_path, job.target_language, {job.target_language: job.id})
+    return True
+
+def resume_interrupted_jobs():
+    """Requeue jobs that were in progress when the server last stopped"""
+    with app.app_context():
+        interrupted = (TranslationJob.query
+                       .filter(TranslationJob.status.notin_(TranslationJob.TERMINAL_STATUSES
+                                                            + ('waiting_duplicate', 'waiting_parent',
+                                                               TranslationJob.BATCH_QUEUED)))
+                       .filter(TranslationJob.parent_id.is_(None)).all())
+        resumed = sum(requeue_job(job, 'Resuming after a restart...') for job in interrupted)
+        if resumed:
+            logger.info(f"Resumed {resumed} interrupted job(s)")
+
+def settle_orphaned_duplicates():
+    """Run at the end of janitor passes: settle or promote jobs whose identical job is gone"""
+    with app.app_context():
+        for job in get_content_store().settle_orphans(processing_jobs=processing_jobs):
+            requeue_job(job, 'Identical job is gone, dubbing this video...')
+
+janitor.tasks.append(settle_orphaned_duplicates)
+
+def child_statuses(parent_id):
+    """Per-language status of a multi-language job's children"""
+    children = TranslationJob.query.filter_by(parent_id=parent_id).all()
+    statuses = []
+    for child in children:
+        # Prefer live in-memory progress over the database row
+        live = processing_jobs.get(child.id, {})
+        statuses.append({
+            'job_id': child.id,
+            'target_language': child.target_language,
+            'status': live.get('status', child.status),
+            'progress': live.get('progress', child.progress),
+            'message': live.get('message', child.message),
+        })
+    return statuses
+
+def job_state(job_id):
+    """Current state of a job as (response dict, HTTP status code)"""
+    # Check the registry first (this process's jobs and those shared by other
+    # processes on this host); it never waits on the database
+    response = processing_jobs.get(job_id)
+    if response is not None:
+        status = response.get('status')
+        
+        # Report queue position and wait time alongside the job state
+        scheduled_id = job_id
+        leader_id = response.get('duplicate_of')
+        leader = processing_jobs.get(leader_id) if leader_id else None
+        if status not in ['completed', 'error'] and leader is not None:
+            # Jobs that joined an identical upload follow its progress
+            response.update({'progress': leader.get('progress', 0), 'message': leader.get('message', '')})
+            scheduled_id = leader_id
+        scheduler = get_scheduler()
+        response.update(scheduler.job_info(scheduled_id))
+        if status not in ['completed', 'error'] and response.get('duration'):
+            # Jobs ahead in the queue plus the stages this job has left
+            timings = (leader or response).get('timings') or {}
+            response['eta_seconds'] = get_eta_model().estimate(
+                response['duration'], jobs_ahead=response.get('queue_position') or 0,
+                workers=scheduler.max_workers, done=timings)
+        if response.get('children'):
+            response['children'] = child_statuses(job_id)
+        preview_path = response.pop('preview_path', None)
+        if preview_path:
+            # Streaming jobs can be watched while they are still being dubbed
+            response['preview_url'] = url_for('preview_file', job_id=job_id,
+                                              filename=os.path.basename(preview_path))
+        return response, 200
     else:
         # Check database
         job = TranslationJob.query.get(job_id)
         if job:
-            # Load job data into memory for faster access
-            processing_jobs[job_id] = job.to_dict()
-            return jsonify(processing_jobs[job_id])
+            # Only finished jobs are safe to cache; anything else may still be
+            # advancing in another process
+            if job.status in TranslationJob.TERMINAL_STATUSES and job.target_language != 'multi':
+                processing_jobs.load(job_id, job.to_dict())
+            response = job.to_dict()
+            if job.target_language == 'multi':
+                response['children'] = child_statuses(job_id)
+            return response, 200
         else:
-            return jsonify({'status': 'not_found', 'message': 'Job not found'}), 404
+            return {'status': 'not_found', 'message': 'Job not found'}, 404
+
+def status_version(job_id):
+    """Version of a job's state, numbered alike by every process on the host"""
+    return max(get_hub().current(job_id)[0], processing_jobs.version(job_id))
+
+def wait_for_change(job_id, since, timeout):
+    """Block until a job's version exceeds ``since``, whichever process updates it"""
+    # Give the pooled database connection back; waits can last minutes
+    db.session.remove()
+    if processing_jobs.table is not None:
+        # Updates made by other processes reach this one's hub through the watcher
+        processing_jobs.table.watch(get_hub())
+    return get_hub().wait(job_id, since, timeout=timeout)
+
+def watched_job(job_id):
+    """Job whose status events move this job forward"""
+    job_data = processing_jobs.get(job_id, {})
+    leader = processing_jobs.get(job_data.get('duplicate_of') or '')
+    if (job_data.get('status') == 'waiting_duplicate' and leader is not None
+            and leader.get('status') not in ['completed', 'error']):
+        return leader['id']
+    return job_id
+
+# Route to check job status
+@app.route('/status/<job_id>', methods=['GET'])
+def job_status(job_id):
+    # Long-poll: with ?wait=<seconds>&since=<version>, hold the request until
+    # the job changes past the version the client already has
+    wait = min(request.args.get('wait', 0, type=float), LONG_POLL_MAX_SECONDS)
+    watch_id = watched_job(job_id)
+    if wait > 0:
+        wait_for_change(watch_id, request.args.get('since', 0, type=int), wait)
+    
+    version = status_version(watch_id)
+    response, code = job_state(job_id)
+    response['version'] = version
+    return jsonify(response), code
+
+# Route to stream job status changes as Server-Sent Events
+@app.route('/status/<job_id>/stream', methods=['GET'])
+def job_status_stream(job_id):
+    def generate():
+        last = None
+        while True:
+            watch_id = watched_job(job_id)
+            version = status_version(watch_id)
+            response, code = job_state(job_id)
+            # Don't hold a pooled connection while the client reads or the job runs
+            db.session.remove()
+            if code != 200:
+                yield f"event: error\ndata: {json.dumps(response)}\n\n"
+                return
+            if response != last:
+                response['version'] = version
+                yield f"data: {json.dumps(response)}\n\n"
+                response.pop('version')
+                last = response
+            if response.get('status') in ['completed', 'error']:
+                return
+            # Sleep until the job changes; send a comment now and then so
+            # proxies keep the connection open
+            if wait_for_change(watch_id, version, SSE_KEEPALIVE_SECONDS)[0] == version:
+                yield ': keepalive\n\n'
+    
+    return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+def send_output(job_id, output_path, download_name):
+    """Serve a finished output, or hand it to the front proxy"""
+    # Players fetch many ranges while seeking; count only the first one as a download
+    if request.headers.get('Range', 'bytes=0-').startswith('bytes=0-'):
+        TranslationJob.touch(job_id)
+    
+    if DOWNLOAD_OFFLOAD == 'x-accel':
+        relative = os.path.relpath(os.path.abspath(output_path), os.path.abspath(PROCESSED_FOLDER))
+        response = Response(mimetype=mimetypes.guess_type(download_name)[0] or 'application/octet-stream')
+        response.headers['X-Accel-Redirect'] = DOWNLOAD_ACCEL_PREFIX.rstrip('/') + '/' + quote(relative)
+        try:
+            download_name.encode('ascii')
+            names = {'filename': download_name}
+        except UnicodeEncodeError:
+            ascii_name = unicodedata.normalize('NFKD', download_name).encode('ascii', 'ignore').decode('ascii')
+            names = {'filename': ascii_name, 'filename*': f"UTF-8''{quote(download_name)}"}
+        response.headers.set('Content-Disposition', 'attachment', **names)
+    else:
+        # Conditional responses answer Range (206), If-None-Match and
+        # If-Modified-Since (304) without re-sending the whole file. With
+        # X-Sendfile the proxy handles ranges itself.
+        # Flask resolves relative paths against the app root, not the working directory
+        response = send_file(os.path.abspath(output_path), as_attachment=True, download_name=download_name,
+                             conditional=DOWNLOAD_OFFLOAD != 'x-sendfile', etag=True, max_age=DOWNLOAD_MAX_AGE)
+    
+    # Outputs belong to one user; shared caches must not keep them
+    response.cache_control.public = False
+    response.cache_control.private = True
+    response.cache_control.max_age = DOWNLOAD_MAX_AGE
+    return response
 
 # Route to download processed video
 @app.route('/download/<job_id>', methods=['GET'])
 def download_video(job_id):
     # Check in-memory cache first
-    if job_id in processing_jobs and processing_jobs[job_id].get('status') == 'completed':
-        output_path = processing_jobs[job_id].get('output_path')
+    job_data = processing_jobs.get(job_id)
+    if job_data and job_data.get('status') == 'completed':
+        output_path = job_data.get('output_path')
         if output_path and os.path.exists(output_path):
-            return send_file(output_path, as_attachment=True, download_name=f"dubbed_{processing_jobs[job_id].get('filename', 'video.mp4')}")
+            return send_output(job_id, output_path, f"dubbed_{job_data.get('filename', 'video.mp4')}")
     
     # Check database
     job = TranslationJob.query.get(job_id)
     if job and job.status == 'completed' and job.output_path and os.path.exists(job.output_path):
-        return send_file(job.output_path, as_attachment=True, download_name=f"dubbed_{job.filename}")
+        return send_output(job_id, job.output_path, f"dubbed_{job.filename}")
     
     flash('Video not found or processing not complete', 'danger')
     return redirect(url_for('index'))
 
-# Route to list translation jobs
+# Route for the HLS preview of a job dubbed in streaming mode
+@app.route('/preview/<job_id>/<path:filename>', methods=['GET'])
+def preview_file(job_id, filename):
+    if job_id != secure_filename(job_id):
+        abort(404)
+    directory = os.path.abspath(os.path.join(PROCESSED_FOLDER, job_id, 'hls'))
+    if filename.endswith('.m3u8'):
+        # The playlist grows while the job runs
+        response = send_from_directory(directory, filename, mimetype='application/vnd.apple.mpegurl',
+                                       max_age=0)
+        response.cache_control.no_cache = True
+        return response
+    return send_from_directory(directory, filename, mimetype='video/mp2t', max_age=DOWNLOAD_MAX_AGE)
+
+# Route to retry a failed job, resuming from its last finished stage
+@app.route('/retry/<job_id>', methods=['POST'])
+def retry_job(job_id):
+    owner = session.get('user_session_id')
+    # Jobs without an owner (e.g. from batch.py) belong to no session
+    job = TranslationJob.query.get(job_id) if owner else None
+    if job is None or job.owner != owner or job.parent_id:
+        return jsonify({'success': False, 'message': 'Job not found'}), 404
+    if job.status != 'error':
+        return jsonify({'success': False, 'message': 'Only failed jobs can be retried'}), 409
+    if not requeue_job(job, 'Retrying from the last finished stage...'):
+        return jsonify({'success': False, 'message': 'Job is already being retried'}), 409
+    return jsonify({'success': True, 'job_id': job_id, 'message': 'Job queued for retry'})
+
+# Route for Prometheus metrics of this process
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+def job_profile_dir(job_id):
+    """Profile directory of one of this user's jobs, or None.
+    
+    Language branches of a multi-language job are profiled with their parent.
+    """
+    owner = session.get('user_session_id')
+    job = TranslationJob.query.get(job_id) if owner and job_id == secure_filename(job_id) else None
+    if job is None or job.owner != owner:
+        return None
+    return os.path.abspath(profile_dir(os.path.join(PROCESSED_FOLDER, job.parent_id or job.id)))
+
+# Route listing the profile recorded for a job (upload with profile=1)
+@app.route('/debug/profile/<job_id>', methods=['GET'])
+def job_profile(job_id):
+    directory = job_profile_dir(job_id)
+    if directory is None:
+        return jsonify({'success': False, 'message': 'Job not found'}), 404
+    files = {name: url_for('job_profile_file', job_id=job_id, filename=name)
+             for name in PROFILE_ARTIFACTS if os.path.exists(os.path.join(directory, name))}
+    if not files:
+        return jsonify({'success': False, 'message': 'No profile recorded for this job'}), 404
+    return jsonify({'success': True, 'job_id': job_id, 'files': files})
+
+# Route to download a profile artifact: trace.json (Chrome trace) or stacks.folded (flamegraph)
+@app.route('/debug/profile/<job_id>/<filename>', methods=['GET'])
+def job_profile_file(job_id, filename):
+    directory = job_profile_dir(job_id)
+    if directory is None or filename not in PROFILE_ARTIFACTS:
+        abort(404)
+    return send_from_directory(directory, filename, mimetype=PROFILE_ARTIFACTS[filename], as_attachment=True,
+                               download_name=f'{job_id}-{filename}', max_age=0)
+
+def encode_cursor(job):
+    """Opaque cursor pointing just past ``job`` in the history order"""
+    return base64.urlsafe_b64encode(f'{job.created_at.isoformat()}|{job.id}'.encode()).decode()
+
+def decode_cursor(cursor):
+    """(created_at, id) from a cursor made by encode_cursor"""
+    created_at, job_id = base64.urlsafe_b64decode(cursor.encode()).decode().split('|', 1)
+    return datetime.fromisoformat(created_at), job_id
+
+# Route to list this user's translation jobs, newest first.
+# Filters: ?status=completed,error&language=fr; page with ?limit=&cursor=
 @app.route('/jobs', methods=['GET'])
 def list_jobs():
-    # Get most recent jobs
-    jobs = TranslationJob.query.order_by(desc(TranslationJob.created_at)).limit(10).all()
+    limit = max(1, min(request.args.get('limit', JOBS_PAGE_SIZE, type=int), MAX_JOBS_PAGE_SIZE))
+    before = None
+    if request.args.get('cursor'):
+        try:
+            before = decode_cursor(request.args['cursor'])
+        except (ValueError, UnicodeDecodeError):
+            return jsonify({'success': False, 'message': 'Invalid cursor'}), 400
+    statuses = [status for status in request.args.get('status', '').split(',') if status]
+    
+    # Fetch one extra row to know whether another page exists
+    rows = TranslationJob.history(session.get('user_session_id'), limit=limit + 1, before=before,
+                                  statuses=statuses, language=request.args.get('language'))
+    next_cursor = encode_cursor(rows[limit - 1]) if len(rows) > limit else None
     return jsonify({
         'success': True,
-        'jobs': [job.to_dict() for job in jobs]
+        'jobs': [TranslationJob.serialize(row) for row in rows[:limit]],
+        'next_cursor': next_cursor
     })
 
-# Ensure database tables exist
-with app.app_context():
-    db.create_all()
+def init_db():
+    """Create any missing database tables"""
+    with app.app_context():
+        db.create_all()
+
+# Create the database tables with: flask --app app init-db
+@app.cli.command('init-db')
+def init_db_command():
+    """Create any missing database tables"""
+    init_db()
+    print('Database tables created')
+
+if RESUME_INTERRUPTED_JOBS and JOB_QUEUE_BACKEND == 'local':
+    resume_interrupted_jobs()
@@ -0,0 +1,223 @@
+"""asyncio engine for the network-bound pipeline stages.
+
+With STAGE_EXECUTOR=asyncio, speech recognition, translation and TTS
+requests of every job in a process are driven by one event loop running
+on its own thread, instead of each request holding a thread while it
+waits on HTTP. Each service has its own concurrency limit (and optionally
+a request rate limit), every call has a timeout and is retried like
+call_service does, and the requests of a job can be cancelled as a whole
+when the job is abandoned. Client libraries that block, and any CPU-bound
+work the backends do, run on the loop's default executor.
+
+A blocking call can't be interrupted: when its request times out or is
+cancelled, its thread runs on until the client library returns. The
+call keeps its service slot until then, so the concurrency limits hold
+for the threads actually busy with a service.
+"""
+import os
+import asyncio
+import contextvars
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from backends import BackendError
+from checkpoint import SERVICE_RETRIES, TRANSIENT_ERRORS, backoff_delay
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# 'threads' waits on each service call from a pipeline thread; 'asyncio'
+# sends them through the process-wide event loop in this module
+STAGE_EXECUTOR = os.environ.get('STAGE_EXECUTOR', 'threads')
+# Requests in flight per service across all jobs of the process
+SERVICE_CONCURRENCY = {
+    'speech': int(os.environ.get('SPEECH_CONCURRENCY', '64')),
+    'translate': int(os.environ.get('TRANSLATE_CONCURRENCY', '32')),
+    'tts': int(os.environ.get('TTS_CONCURRENCY', '32')),
+}
+# Requests per second per service, to stay within API quotas; 0 means no limit
+SERVICE_RATE_LIMITS = {
+    'speech': float(os.environ.get('SPEECH_RATE_LIMIT', '0')),
+    'translate': float(os.environ.get('TRANSLATE_RATE_LIMIT', '0')),
+    'tts': float(os.environ.get('TTS_RATE_LIMIT', '0')),
+}
+SERVICE_TIMEOUT = float(os.environ.get('SERVICE_TIMEOUT_SECONDS', '60'))
+# Threads for blocking client libraries and CPU-bound backend work; by
+# default one per request the service limits allow in flight
+BLOCKING_THREADS = int(os.environ.get('ASYNC_BLOCKING_THREADS', '0'))
+# Segments of one job sent for recognition at the same time
+ASYNC_JOB_FANOUT = int(os.environ.get('ASYNC_JOB_FANOUT', '32'))
+
+IN_FLIGHT = metrics.REGISTRY.register(metrics.Gauge(
+    'videoverse_engine_requests_in_flight', 'Service requests in flight on the stage engine', ['service']))
+
+
+# Executor calls made by the service request running in the current context
+_blocking_calls = contextvars.ContextVar('blocking_calls', default=None)
+
+
+class BlockingExecutor(ThreadPoolExecutor):
+    """Default executor of the engine's loop.
+
+    Remembers which service request submitted each call, so a request
+    whose thread outlives it keeps its slot until the thread returns.
+    """
+
+    def submit(self, fn, /, *args, **kwargs):
+        future = super().submit(fn, *args, **kwargs)
+        calls = _blocking_calls.get()
+        if calls is not None:
+            calls.append(future)
+        return future
+
+
+class RateLimiter:
+    """Spaces calls out to at most ``rate`` per second; only used on the loop"""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate
+        self.next_slot = 0.0
+
+    async def acquire(self):
+        now = asyncio.get_running_loop().time()
+        slot = max(now, self.next_slot)
+        self.next_slot = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+
+class StageEngine:
+    """Event loop on a background thread running service calls for all jobs"""
+
+    def __init__(self, concurrency=None, rate_limits=None, timeout=SERVICE_TIMEOUT,
+                 blocking_threads=BLOCKING_THREADS):
+        self.concurrency = dict(SERVICE_CONCURRENCY, **(concurrency or {}))
+        self.rate_limits = dict(SERVICE_RATE_LIMITS, **(rate_limits or {}))
+        self.timeout = timeout
+        self.loop = asyncio.new_event_loop()
+        self.loop.set_default_executor(BlockingExecutor(
+            max_workers=blocking_threads or sum(self.concurrency.values()),
+            thread_name_prefix='stage-blocking'))
+        # Only touched from the loop thread
+        self._semaphores = {}
+        self._limiters = {}
+        self._tasks = {}  # job id -> tasks still running for it
+        self._releases = set()  # slots waiting for their blocking calls to return
+        self._thread = threading.Thread(target=self._run, name='stage-engine')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def submit(self, job_id, service, make_call, on_retry=None):
+        """Schedule a call from any thread and return a concurrent Future.
+
+        ``make_call()`` returns a new awaitable for each attempt.
+        """
+        return asyncio.run_coroutine_threadsafe(
+            self._tracked(job_id, self.call(service, make_call, on_retry)), self.loop)
+
+    def cancel_job(self, job_id):
+        """Cancel every call still running for a job; safe from any thread"""
+        self.loop.call_soon_threadsafe(self._cancel, job_id)
+
+    def _cancel(self, job_id):
+        tasks = self._tasks.pop(job_id, ())
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            logger.info(f"Cancelled {len(tasks)} service calls of job {job_id}")
+
+    async def _tracked(self, job_id, call):
+        task = asyncio.current_task()
+        self._tasks.setdefault(job_id, set()).add(task)
+        try:
+            return await call
+        finally:
+            tasks = self._tasks.get(job_id)
+            if tasks is not None:
+                tasks.discard(task)
+                if not tasks:
+                    del self._tasks[job_id]
+
+    async def call(self, service, make_call, on_retry=None, attempts=SERVICE_RETRIES):
+        """Await a service call within the service's limits, retrying transient failures"""
+        for attempt in range(1, attempts + 2):
+            try:
+                return await self._attempt(service, make_call)
+            except TRANSIENT_ERRORS as e:
+                if attempt > attempts:
+                    raise
+                delay = backoff_delay(attempt)
+                logger.warning(f"{service} attempt {attempt} failed ({e}), retrying in {delay:.1f}s")
+                if on_retry is not None:
+                    on_retry(attempt, e)
+                await asyncio.sleep(delay)
+
+    async def _attempt(self, service, make_call):
+        limiter = self._limiter(service)
+        if limiter is not None:
+            await limiter.acquire()
+        semaphore = self._semaphore(service)
+        await semaphore.acquire()
+        IN_FLIGHT.inc(service=service)
+        calls = []
+        # wait_for runs the call in a task that copies this context, so the
+        # executor sees the list
+        token = _blocking_calls.set(calls)
+        try:
+            return await asyncio.wait_for(make_call(), self.timeout)
+        except asyncio.TimeoutError:
+            raise BackendError(f'{service} request timed out after {self.timeout:g}s')
+        finally:
+            _blocking_calls.reset(token)
+            running = [call for call in calls if not call.done()]
+            if running:
+                release = asyncio.ensure_future(self._release_later(service, semaphore, running))
+                self._releases.add(release)
+                release.add_done_callback(self._releases.discard)
+            else:
+                IN_FLIGHT.dec(service=service)
+                semaphore.release()
+
+    async def _release_later(self, service, semaphore, calls):
+        """Free a slot once the threads of its abandoned request return"""
+        try:
+            await asyncio.gather(*[asyncio.wrap_future(call) for call in calls], return_exceptions=True)
+        finally:
+            IN_FLIGHT.dec(service=service)
+            semaphore.release()
+
+    def _semaphore(self, service):
+        semaphore = self._semaphores.get(service)
+        if semaphore is None:
+            semaphore = self._semaphores[service] = asyncio.Semaphore(self.concurrency.get(service, 16))
+        return semaphore
+
+    def _limiter(self, service):
+        if service not in self._limiters:
+            rate = self.rate_limits.get(service)
+            self._limiters[service] = RateLimiter(rate) if rate else None
+        return self._limiters[service]
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_engine():
+    """Return the process-wide stage engine, starting its loop on first use"""
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = StageEngine()
+        return _engine
+
+
+def cancel_job(job_id):
+    """Cancel a job's service calls if the engine is running in this process"""
+    if _engine is not None:
+        _engine.cancel_job(job_id)
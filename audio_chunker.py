@@ -0,0 +1,234 @@
+import os
+import sys
+import logging
+import subprocess
+import time
+import wave
+from collections import namedtuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Format produced by the extraction stage: 16 kHz, mono, signed 16-bit PCM
+SAMPLE_RATE = 16000
+SAMPLE_WIDTH = 2
+
+# Chunking defaults, overridable through the environment
+SILENCE_THRESHOLD_DB = float(os.environ.get('SILENCE_THRESHOLD_DB', '-35'))
+MIN_SILENCE_SECONDS = float(os.environ.get('MIN_SILENCE_SECONDS', '0.35'))
+MIN_SEGMENT_SECONDS = float(os.environ.get('MIN_SEGMENT_SECONDS', '3'))
+MAX_SEGMENT_SECONDS = float(os.environ.get('MAX_SEGMENT_SECONDS', '25'))
+
+# A chunk of audio with its position in the source, in seconds.
+# ``voiced`` is the fraction of frames above the silence threshold.
+AudioSegment = namedtuple('AudioSegment', 'index start end pcm voiced')
+
+
+class SilenceChunker:
+    """Split a stream of PCM audio into bounded segments at silence gaps.
+
+    Audio is fed incrementally with ``feed()``; finished segments are
+    returned as soon as a cut point is known, so only the current segment
+    (at most ``max_segment`` seconds) is ever held in memory. Frame energy is
+    computed with NumPy over whole blocks rather than sample by sample.
+    """
+
+    def __init__(self, sample_rate=SAMPLE_RATE, frame_ms=30,
+                 silence_db=SILENCE_THRESHOLD_DB, min_silence=MIN_SILENCE_SECONDS,
+                 min_segment=MIN_SEGMENT_SECONDS, max_segment=MAX_SEGMENT_SECONDS):
+        self.sample_rate = sample_rate
+        self.frame_samples = int(sample_rate * frame_ms / 1000)
+        self.frame_bytes = self.frame_samples * SAMPLE_WIDTH
+        self.frame_seconds = self.frame_samples / sample_rate
+        self.silence_db = silence_db
+        self.min_silence_frames = max(1, int(min_silence / self.frame_seconds))
+        self.min_segment_frames = max(1, int(min_segment / self.frame_seconds))
+        self.max_segment_frames = max(self.min_segment_frames + 1, int(max_segment / self.frame_seconds))
+
+        self._partial = bytearray()      # trailing bytes that don't fill a frame yet
+        self._segment = bytearray()      # framed audio of the current segment
+        self._energies = np.empty(0, dtype=np.float32)
+        self._emitted_bytes = 0
+        self._index = 0
+
+    def frame_energies(self, pcm):
+        """Energy in dBFS of each whole frame in ``pcm``"""
+        samples = np.frombuffer(pcm, dtype='<i2').astype(np.float32) / 32768.0
+        frames = samples.reshape(-1, self.frame_samples)
+        rms = np.sqrt(np.mean(frames * frames, axis=1))
+        return 20.0 * np.log10(rms + 1e-10)
+
+    def feed(self, pcm):
+        """Add PCM bytes and return any segments that are now complete"""
+        self._partial += pcm
+        whole = len(self._partial) - len(self._partial) % self.frame_bytes
+        if whole == 0:
+            return []
+
+        block = memoryview(self._partial)[:whole]
+        energies = self.frame_energies(block)
+        self._segment += block
+        block.release()
+        del self._partial[:whole]
+        self._energies = np.concatenate((self._energies, energies))
+
+        segments = []
+        while True:
+            cut = self._find_cut()
+            if cut is None:
+                break
+            segments.append(self._emit(cut))
+        return segments
+
+    def flush(self):
+        """Return the final segment once the stream has ended"""
+        self._segment += self._partial
+        self._partial.clear()
+        if not self._segment:
+            return []
+        frames = len(self._energies)
+        if len(self._segment) > frames * self.frame_bytes:
+            # Count a trailing partial frame as silence
+            self._energies = np.append(self._energies, np.float32(-100.0))
+            frames += 1
+        return [self._emit(frames, final=True)]
+
+    def _find_cut(self):
+        """Frame index to cut the current segment at, or None to keep buffering"""
+        frames = len(self._energies)
+        if frames < self.min_segment_frames:
+            return None
+
+        # Look for the first silent run long enough to cut at, once the
+        # segment has reached its minimum length
+        silent = (self._energies < self.silence_db).astype(np.int8)
+        edges = np.flatnonzero(np.diff(np.concatenate(([0], silent, [0]))))
+        starts, ends = edges[0::2], edges[1::2]
+        half = self.min_silence_frames // 2
+        cuts = np.maximum(starts, self.min_segment_frames - half) + half
+        usable = ((ends - starts >= self.min_silence_frames)
+                  & (cuts <= ends) & (cuts <= self.max_segment_frames))
+        if usable.any():
+            return int(cuts[np.argmax(usable)])
+
+        if frames >= self.max_segment_frames:
+            # No silence found: cut at the quietest frame near the end of the window
+            window_start = int(self.max_segment_frames * 0.6)
+            quietest = np.argmin(self._energies[window_start:self.max_segment_frames])
+            return int(window_start + quietest + 1)
+        return None
+
+    def _emit(self, frames, final=False):
+        nbytes = len(self._segment) if final else frames * self.frame_bytes
+        pcm = bytes(self._segment[:nbytes])
+        del self._segment[:nbytes]
+
+        voiced = float(np.mean(self._energies[:frames] >= self.silence_db)) if frames else 0.0
+        self._energies = self._energies[frames:]
+
+        # Times come from the bytes emitted, so a trailing partial frame
+        # doesn't push the last segment's end past the audio
+        bytes_per_second = self.sample_rate * SAMPLE_WIDTH
+        start = self._emitted_bytes / bytes_per_second
+        self._emitted_bytes += nbytes
+        segment = AudioSegment(self._index, round(start, 3),
+                               round(self._emitted_bytes / bytes_per_second, 3), pcm, voiced)
+        self._index += 1
+        return segment
+
+
+def iter_wav_segments(path, chunker=None, block_seconds=5):
+    """Yield segments of a 16 kHz mono WAV file, reading it block by block"""
+    chunker = chunker or SilenceChunker()
+    with wave.open(path, 'rb') as wav:
+        if (wav.getframerate(), wav.getnchannels(), wav.getsampwidth()) != (chunker.sample_rate, 1, SAMPLE_WIDTH):
+            raise ValueError(f'Expected {chunker.sample_rate} Hz mono 16-bit audio in {path}')
+        block_frames = int(chunker.sample_rate * block_seconds)
+        while True:
+            pcm = wav.readframes(block_frames)
+            if not pcm:
+                break
+            yield from chunker.feed(pcm)
+    yield from chunker.flush()
+
+
+def pcm_pipe_command(video_path, sample_rate=SAMPLE_RATE):
+    """ffmpeg command that decodes a video's audio track to raw PCM on stdout"""
+    return [
+        'ffmpeg', '-nostdin', '-loglevel', 'error', '-i', video_path,
+        '-vn', '-acodec', 'pcm_s16le', '-f', 's16le',
+        '-ar', str(sample_rate), '-ac', '1', 'pipe:1'
+    ]
+
+
+def iter_pipe_segments(video_path, chunker=None, block_seconds=1):
+    """Yield segments while ffmpeg is still decoding the video.
+
+    ffmpeg writes raw PCM to a pipe which is read into one reusable buffer,
+    so nothing touches the disk and segments are handed out as soon as a
+    silence gap closes them.
+    """
+    chunker = chunker or SilenceChunker()
+    buffer = bytearray(int(chunker.sample_rate * block_seconds) * SAMPLE_WIDTH)
+    view = memoryview(buffer)
+    process = subprocess.Popen(pcm_pipe_command(video_path, chunker.sample_rate),
+                               stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    try:
+        while True:
+            read = process.stdout.readinto(view)
+            if not read:
+                break
+            yield from chunker.feed(view[:read])
+        stderr = process.stderr.read()
+        if process.wait() != 0:
+            raise subprocess.CalledProcessError(process.returncode, process.args,
+                                                stderr=stderr.decode(errors='replace'))
+        yield from chunker.flush()
+    finally:
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+        process.stdout.close()
+        process.stderr.close()
+
+
+def compare_extraction_modes(video_path, workdir):
+    """Time the file and pipe extraction paths over the same video"""
+    results = {}
+
+    start = time.perf_counter()
+    wav_path = os.path.join(workdir, 'compare_audio.wav')
+    subprocess.run(['ffmpeg', '-nostdin', '-loglevel', 'error', '-i', video_path,
+                    '-vn', '-acodec', 'pcm_s16le', '-ar', str(SAMPLE_RATE), '-ac', '1',
+                    wav_path, '-y'], check=True)
+    first = None
+    count = 0
+    for _ in iter_wav_segments(wav_path):
+        first = first or time.perf_counter() - start
+        count += 1
+    results['file'] = {'total_seconds': round(time.perf_counter() - start, 3),
+                       'first_segment_seconds': round(first or 0, 3),
+                       'segments': count,
+                       'disk_bytes': os.path.getsize(wav_path)}
+    os.remove(wav_path)
+
+    start = time.perf_counter()
+    first = None
+    count = 0
+    for _ in iter_pipe_segments(video_path):
+        first = first or time.perf_counter() - start
+        count += 1
+    results['pipe'] = {'total_seconds': round(time.perf_counter() - start, 3),
+                       'first_segment_seconds': round(first or 0, 3),
+                       'segments': count,
+                       'disk_bytes': 0}
+    return results
+
+
+if __name__ == '__main__':
+    # python audio_chunker.py <video> -- compare file vs pipe extraction
+    import json
+    import tempfile
+    with tempfile.TemporaryDirectory() as workdir:
+        print(json.dumps(compare_extraction_modes(sys.argv[1], workdir), indent=2))
@@ -0,0 +1,391 @@
+import os
+import io
+import abc
+import asyncio
+import inspect
+import logging
+import queue
+import importlib.util
+import shutil
+import subprocess
+import threading
+import wave
+import zlib
+from concurrent.futures import Future
+from contextlib import contextmanager
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Engine used for each service, overridable through the environment.
+# 'local' runs without network access.
+DEFAULT_BACKENDS = {
+    'speech': os.environ.get('SPEECH_BACKEND', 'google'),
+    'translation': os.environ.get('TRANSLATION_BACKEND', 'google'),
+    'tts': os.environ.get('TTS_BACKEND', 'gtts'),
+}
+# HTTP clients kept per engine and shared by all jobs
+CLIENT_POOL_SIZE = int(os.environ.get('BACKEND_POOL_SIZE', os.environ.get('NETWORK_CONCURRENCY', '4')))
+# Translation requests from concurrent jobs arriving within this window are
+# sent together, up to TRANSLATION_BATCH_SIZE texts per request
+TRANSLATION_BATCH_WINDOW = float(os.environ.get('TRANSLATION_BATCH_WINDOW_MS', '20')) / 1000
+TRANSLATION_BATCH_SIZE = int(os.environ.get('TRANSLATION_BATCH_SIZE', '32'))
+
+
+class BackendError(RuntimeError):
+    """A speech, translation or TTS service failed; usually worth retrying"""
+
+
+class SpeechBackend(abc.ABC):
+    """Turns 16-bit mono PCM into text"""
+
+    name = None
+
+    @abc.abstractmethod
+    def transcribe(self, pcm, sample_rate, sample_width, language):
+        """Text spoken in ``pcm``, or '' if there is no recognisable speech"""
+        raise NotImplementedError
+
+    def transcribe_batch(self, clips, sample_rate, sample_width, language):
+        return [self.transcribe(pcm, sample_rate, sample_width, language) for pcm in clips]
+
+    async def transcribe_async(self, pcm, sample_rate, sample_width, language):
+        """transcribe() for the stage engine; blocking clients run on its executor"""
+        return await asyncio.to_thread(self.transcribe, pcm, sample_rate, sample_width, language)
+
+
+class TranslationBackend(abc.ABC):
+    """Translates text between languages"""
+
+    name = None
+
+    def translate(self, text, target, source='auto'):
+        return self.translate_batch([text], target, source)[0]
+
+    @abc.abstractmethod
+    def translate_batch(self, texts, target, source='auto'):
+        """Translations of ``texts``, in the same order"""
+        raise NotImplementedError
+
+
+class TTSBackend(abc.ABC):
+    """Synthesizes speech audio for text"""
+
+    name = None
+    # Identifies the voice settings, so cached clips are not mixed across voices
+    voice = None
+
+    @abc.abstractmethod
+    def synthesize(self, text, language):
+        """Encoded audio (any format ffmpeg reads) speaking ``text``"""
+        raise NotImplementedError
+
+    async def synthesize_async(self, text, language):
+        """synthesize() for the stage engine; blocking clients run on its executor"""
+        return await asyncio.to_thread(self.synthesize, text, language)
+
+
+_engines = {'speech': {}, 'translation': {}, 'tts': {}}
+_instances = {}
+_instances_lock = threading.Lock()
+
+
+def register_backend(kind, name):
+    """Class decorator adding an engine to the registry"""
+    def decorator(cls):
+        if inspect.isabstract(cls):
+            # Fail at import rather than inside the first job that uses it
+            missing = ', '.join(sorted(cls.__abstractmethods__))
+            raise TypeError(f"{kind} backend {name!r} does not implement {missing}")
+        cls.name = name
+        _engines[kind][name] = cls
+        return cls
+    return decorator
+
+
+def available_backends():
+    return {kind: sorted(engines) for kind, engines in _engines.items()}
+
+
+def get_backend(kind, name=None):
+    """Process-wide instance of an engine, so clients are reused across jobs"""
+    name = name or DEFAULT_BACKENDS[kind]
+    with _instances_lock:
+        instance = _instances.get((kind, name))
+        if instance is None:
+            try:
+                engine = _engines[kind][name]
+            except KeyError:
+                raise ValueError(f"Unknown {kind} backend {name!r}; available: {sorted(_engines[kind])}")
+            instance = _instances[(kind, name)] = engine()
+            logger.info(f"Using {kind} backend {name}")
+        return instance
+
+
+class ClientPool:
+    """Bounded set of reusable clients, created on first use"""
+
+    def __init__(self, factory, size=CLIENT_POOL_SIZE):
+        self.factory = factory
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(max(1, size))
+
+    @contextmanager
+    def client(self):
+        self._slots.acquire()
+        try:
+            try:
+                client = self._idle.get_nowait()
+            except queue.Empty:
+                client = self.factory()
+            yield client
+            self._idle.put(client)
+        finally:
+            self._slots.release()
+
+
+class MicroBatcher:
+    """Coalesces single requests from concurrent callers into batch calls.
+
+    Items submitted under the same key within ``window`` seconds are passed
+    to ``batch_func(key, items)`` together, which must return one result
+    per item. A batch is sent early once it holds ``max_batch`` items.
+    """
+
+    def __init__(self, batch_func, window=TRANSLATION_BATCH_WINDOW, max_batch=TRANSLATION_BATCH_SIZE):
+        self.batch_func = batch_func
+        self.window = window
+        self.max_batch = max(1, max_batch)
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def submit(self, key, item):
+        """Queue one item; returns a Future for its result"""
+        future = Future()
+        with self._lock:
+            pending = self._pending.setdefault(key, [])
+            pending.append((item, future))
+            full = self._pending.pop(key) if len(pending) >= self.max_batch else None
+            if full is None and len(pending) == 1:
+                timer = threading.Timer(self.window, self._flush, args=(key,))
+                timer.daemon = True
+                timer.start()
+        if full:
+            self._run(key, full)
+        return future
+
+    def _flush(self, key):
+        with self._lock:
+            batch = self._pending.pop(key, None)
+        if batch:
+            self._run(key, batch)
+
+    def _run(self, key, batch):
+        # Items whose caller gave up (cancelled jobs) are not sent
+        batch = [(item, future) for item, future in batch if future.set_running_or_notify_cancel()]
+        if not batch:
+            return
+        try:
+            results = list(self.batch_func(key, [item for item, _ in batch]))
+            if len(results) != len(batch):
+                # Results can't be matched to items; callers wait without a
+                # timeout, so none may be left unresolved
+                raise BackendError(f'Batch call returned {len(results)} results for {len(batch)} items')
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        for (_, future), result in zip(batch, results):
+            future.set_result(result)
+
+
+_translation_batcher = None
+
+
+def get_translation_batcher():
+    """Process-wide batcher for translations keyed by (backend, source, target)"""
+    global _translation_batcher
+    with _instances_lock:
+        if _translation_batcher is None:
+            def translate(key, texts):
+                name, source, target = key
+                return get_backend('translation', name).translate_batch(texts, target, source)
+            _translation_batcher = MicroBatcher(translate)
+        return _translation_batcher
+
+
+def silence_wav(seconds, sample_rate=16000):
+    """WAV bytes holding ``seconds`` of silence"""
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as out:
+        out.setnchannels(1)
+        out.setsampwidth(2)
+        out.setframerate(sample_rate)
+        out.writeframes(b'\0\0' * int(sample_rate * seconds))
+    return buffer.getvalue()
+
+
+# Google engines
+
+@register_backend('speech', 'google')
+class GoogleSpeech(SpeechBackend):
+    """Google Web Speech API through SpeechRecognition"""
+
+    def __init__(self):
+        import speech_recognition as sr
+        self.sr = sr
+        self.pool = ClientPool(sr.Recognizer)
+
+    def transcribe(self, pcm, sample_rate, sample_width, language):
+        sr = self.sr
+        audio_data = sr.AudioData(pcm, sample_rate, sample_width)
+        with self.pool.client() as recognizer:
+            try:
+                return recognizer.recognize_google(audio_data, language=language)
+            except sr.UnknownValueError:
+                # If failed with specific language, try without language hint
+                metrics.EXTERNAL_CALLS.inc(service='speech', outcome='retry')
+                try:
+                    return recognizer.recognize_google(audio_data)
+                except sr.UnknownValueError:
+                    return ''
+            except sr.RequestError as e:
+                raise BackendError(str(e))
+
+
+@register_backend('translation', 'google')
+class GoogleTranslation(TranslationBackend):
+    """Google Translate through googletrans, sending batches as one request"""
+
+    # Stay under the service's per-request text limit
+    MAX_CHARS = 4500
+
+    def __init__(self):
+        from googletrans import Translator
+        self.pool = ClientPool(Translator)
+
+    def translate_batch(self, texts, target, source='auto'):
+        texts = [' '.join(text.split()) for text in texts]
+        results = []
+        chunk, size = [], 0
+        for text in texts:
+            if chunk and size + len(text) + 1 > self.MAX_CHARS:
+                results.extend(self._translate_chunk(chunk, target, source))
+                chunk, size = [], 0
+            chunk.append(text)
+            size += len(text) + 1
+        if chunk:
+            results.extend(self._translate_chunk(chunk, target, source))
+        return results
+
+    def _translate_chunk(self, texts, target, source):
+        try:
+            with self.pool.client() as translator:
+                if len(texts) > 1:
+                    # One request for the whole chunk, one line per text
+                    lines = translator.translate('\n'.join(texts), dest=target, src=source).text.split('\n')
+                    if len(lines) == len(texts):
+                        return [line.strip() for line in lines]
+                    logger.debug(f"Batched translation returned {len(lines)} lines for {len(texts)} texts")
+                return [translator.translate(text, dest=target, src=source).text if text else ''
+                        for text in texts]
+        except Exception as e:
+            raise BackendError(f'Translation failed: {e}')
+
+
+@register_backend('tts', 'gtts')
+class GoogleTTS(TTSBackend):
+    """Google Translate's TTS through gTTS's public API"""
+
+    voice = 'gtts-normal'
+
+    def __init__(self):
+        from gtts import gTTS, gTTSError
+        self.gTTS = gTTS
+        self.gTTSError = gTTSError
+
+    def synthesize(self, text, language):
+        # Not pooled: a gTTS object holds one text, and gTTS opens its own
+        # HTTP session per call without a way to pass one in
+        clip = io.BytesIO()
+        try:
+            self.gTTS(text=text, lang=language, slow=False).write_to_fp(clip)
+        except self.gTTSError as e:
+            raise BackendError(f'TTS request failed: {e}')
+        return clip.getvalue()
+
+
+# Local engines, for running without network access
+
+@register_backend('speech', 'local')
+class LocalSpeech(SpeechBackend):
+    """CMU Sphinx when pocketsphinx is installed, otherwise a placeholder transcript.
+
+    The placeholder is derived from the audio, so it is stable across runs,
+    and has about as many words as the clip would hold.
+    """
+
+    def __init__(self):
+        self.sphinx = importlib.util.find_spec('pocketsphinx') is not None
+        if not self.sphinx:
+            logger.info("pocketsphinx is not installed; local speech backend returns placeholder text")
+            return
+        import speech_recognition as sr
+        self.sr = sr
+        self.recognizer = sr.Recognizer()
+
+    def transcribe(self, pcm, sample_rate, sample_width, language):
+        if self.sphinx:
+            try:
+                return self.recognizer.recognize_sphinx(self.sr.AudioData(pcm, sample_rate, sample_width))
+            except self.sr.UnknownValueError:
+                return ''
+        words = max(1, int(len(pcm) / (sample_rate * sample_width) * 2.5))
+        return ' '.join(['speech'] * (words - 1) + [f'{zlib.crc32(pcm) % 1000:03d}'])
+
+
+@register_backend('translation', 'local')
+class LocalTranslation(TranslationBackend):
+    """Returns the text unchanged"""
+
+    def translate_batch(self, texts, target, source='auto'):
+        return list(texts)
+
+
+@register_backend('tts', 'local')
+class LocalTTS(TTSBackend):
+    """espeak-ng (or espeak) when installed, otherwise silence of a plausible length"""
+
+    voice = 'local'
+
+    def __init__(self):
+        self.command = shutil.which('espeak-ng') or shutil.which('espeak')
+        if self.command:
+            self.voice = f'local-{os.path.basename(self.command)}'
+
+    def synthesize(self, text, language):
+        if self.command:
+            try:
+                return subprocess.run([self.command, '-v', language, '--stdout', text],
+                                      capture_output=True, check=True).stdout
+            except subprocess.CalledProcessError as e:
+                logger.warning(f"{self.command} failed for {language}: {e.stderr[:200]}")
+        # About 0.4 seconds per word
+        return silence_wav(0.4 * len(text.split()))
+
+    async def synthesize_async(self, text, language):
+        if self.command:
+            # A child process needs no executor thread while it runs
+            process = await asyncio.create_subprocess_exec(
+                self.command, '-v', language, '--stdout', text,
+                stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            try:
+                stdout, stderr = await process.communicate()
+            except asyncio.CancelledError:
+                process.kill()
+                raise
+            if process.returncode == 0:
+                return stdout
+            logger.warning(f"{self.command} failed for {language}: {stderr[:200]}")
+        return silence_wav(0.4 * len(text.split()))
@@ -0,0 +1,504 @@
+"""Dub a back catalogue of videos from the command line.
+
+Takes a directory of videos, or a CSV or JSON manifest of videos and their
+target languages, and runs the pipeline over them on a process pool sized
+to the available cores:
+
+    python batch.py catalogue/ --languages fr,de --output results.jsonl
+    python batch.py manifest.csv --processes 8 --output results.jsonl
+
+CSV manifests have a ``path`` column and an optional ``languages`` column
+(languages separated by commas, semicolons or spaces); JSON manifests are
+a list of ``{"path": ..., "languages": [...]}`` objects. Relative paths
+are resolved against the manifest's directory. Videos are read where they
+are instead of being copied into uploads/.
+
+Each video is hashed and probed first. Languages whose output is already
+in the content store are skipped, so re-running a batch only does what is
+left. Job rows are inserted in bulk and their progress is written back in
+batches by the job registry's write-behind flusher. One JSON line per
+video is appended to ``--output``; its hashes are reused on the next run
+for files whose size and modification time have not changed.
+
+Rows are marked with the run that registered them. A later run fails the
+rows of a run that died and dubs those videos again, and skips languages
+that a run still going is dubbing.
+"""
+import os
+import argparse
+import csv
+import json
+import logging
+import multiprocessing
+import re
+import socket
+import sys
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+# Rows per INSERT when registering jobs
+INSERT_BATCH_SIZE = 500
+# Seconds between progress lines
+PROGRESS_INTERVAL = 5.0
+
+
+def available_cores():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def batch_run_id(pid=None):
+    """Id a run stores in the worker_id column of its rows"""
+    return f'batch-{pid or os.getpid()}-{socket.gethostname()}'[:64]
+
+
+def run_alive(run_id):
+    """Whether the batch run that registered a row may still be going.
+
+    Runs on other hosts can't be checked and count as alive.
+    """
+    try:
+        pid = int(run_id.split('-', 2)[1])
+    except (AttributeError, IndexError, ValueError):
+        return False
+    if run_id != batch_run_id(pid):
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def split_languages(value):
+    if isinstance(value, (list, tuple)):
+        return [language for language in value if language]
+    return [language for language in re.split(r'[,;\s]+', value or '') if language]
+
+
+def read_inputs(source, default_languages, extensions):
+    """(absolute path, target languages) for every video of a directory or manifest"""
+    if os.path.isdir(source):
+        videos = []
+        for dirpath, _, filenames in os.walk(source):
+            for name in sorted(filenames):
+                if name.rsplit('.', 1)[-1].lower() in extensions:
+                    videos.append((os.path.abspath(os.path.join(dirpath, name)), default_languages))
+        return sorted(videos)
+
+    base = os.path.dirname(os.path.abspath(source))
+    with open(source, newline='') as f:
+        if source.lower().endswith('.json'):
+            entries = json.load(f)
+            if isinstance(entries, dict):
+                entries = entries.get('videos', [])
+        else:
+            entries = list(csv.DictReader(f))
+    videos = []
+    for entry in entries:
+        path = entry.get('path')
+        if not path:
+            continue
+        languages = split_languages(entry.get('languages') or entry.get('target_languages'))
+        videos.append((os.path.join(base, path), languages or default_languages))
+    return videos
+
+
+def read_previous_results(path):
+    """Hashes from an earlier run, keyed by (path, size, mtime)"""
+    hashes = {}
+    if not path or not os.path.exists(path):
+        return hashes
+    with open(path) as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            if entry.get('content_hash'):
+                hashes[(entry['path'], entry.get('size'), entry.get('mtime'))] = entry['content_hash']
+    return hashes
+
+
+def init_process():
+    # Before the pipeline modules configure logging at DEBUG; the parent
+    # reports progress
+    logging.basicConfig(level=logging.WARNING)
+
+
+def inspect_video(path, known_hash=None):
+    """Hash and probe one input; runs in a pool process"""
+    from checkpoint import file_sha256
+    from admission import preflight, PreflightError
+
+    result = {'path': path}
+    try:
+        stat = os.stat(path)
+        result.update(size=stat.st_size, mtime=stat.st_mtime)
+        result['content_hash'] = known_hash or file_sha256(path)
+        result['duration'] = preflight(path).duration
+    except PreflightError as e:
+        result.update(status='refused', message=str(e))
+    except OSError as e:
+        result.update(status='error', message=str(e))
+    return result
+
+
+def dub_video(job_id, path, target_language, child_jobs=None):
+    """Run the pipeline over one video; returns the final state of each job it finished.
+
+    Runs in a pool process. Job state is kept in a local registry and
+    returned, so only the parent process talks to the database.
+    """
+    from video_processor import VideoProcessor
+    from job_registry import JobRegistry
+
+    registry = JobRegistry(publish=False)
+    parent_language = 'multi' if child_jobs else target_language
+    for language, entry_id in [(parent_language, job_id)] + list((child_jobs or {}).items()):
+        registry.create(entry_id, {'status': 'claimed', 'progress': 0, 'message': '',
+                                   'filename': os.path.basename(path), 'target_language': language,
+                                   'original_path': path, 'output_path': None})
+    started = time.perf_counter()
+    try:
+        VideoProcessor(job_id, path, target_language, registry, child_jobs=child_jobs).process_video()
+    except Exception as e:
+        registry.update(job_id, status='error', progress=0, message=f'Unexpected error: {e}'[:255])
+    entries = [job_id] + list((child_jobs or {}).values())
+    return {'seconds': time.perf_counter() - started,
+            'jobs': {entry_id: registry.get(entry_id) for entry_id in entries}}
+
+
+class Progress:
+    """Aggregate progress and throughput, printed to stderr"""
+
+    def __init__(self, total, stream=sys.stderr, interval=PROGRESS_INTERVAL):
+        self.total = total
+        self.stream = stream
+        self.interval = interval
+        self.counts = {}
+        self.audio_seconds = 0.0
+        self.started = time.time()
+        self.printed = 0.0
+
+    def add(self, outcome, audio_seconds=None):
+        self.counts[outcome] = self.counts.get(outcome, 0) + 1
+        self.audio_seconds += audio_seconds or 0
+        if time.time() - self.printed >= self.interval or self.done == self.total:
+            self.print()
+
+    @property
+    def done(self):
+        return sum(self.counts.values())
+
+    def print(self):
+        self.printed = time.time()
+        elapsed = max(self.printed - self.started, 1e-6)
+        rate = self.done / elapsed * 60
+        remaining = (self.total - self.done) / rate * 60 if rate else None
+        outcomes = ', '.join(f'{count} {outcome}' for outcome, count in sorted(self.counts.items()))
+        self.stream.write(
+            f"[{self.done}/{self.total}] {outcomes or 'started'} | {rate:.1f} videos/min, "
+            f"{self.audio_seconds / elapsed:.2f}x realtime"
+            + (f', about {remaining:.0f}s left' if remaining is not None and self.done < self.total else '')
+            + '\n')
+        self.stream.flush()
+
+
+class BatchRun:
+    """Registers, dispatches and records the jobs of one batch"""
+
+    def __init__(self, app, processes, output=None, owner=None):
+        from job_registry import JobRegistry
+        from content_store import get_content_store
+
+        self.app = app
+        self.processes = processes
+        self.output = output
+        self.owner = owner
+        self.store = get_content_store()
+        self.run_id = batch_run_id()
+        self.planned = set()
+        # Final job states are written back in batched UPDATEs
+        self.registry = JobRegistry(app, publish=False)
+
+    def plan(self, video, languages):
+        """Job rows for the languages of a video that are not dubbed yet"""
+        from models import TranslationJob
+
+        filename = os.path.basename(video['path'])
+        # Copies of one video in the same batch are dubbed once
+        pending = [language for language in dict.fromkeys(languages)
+                   if not self.store.has_output(video['content_hash'], language, filename)
+                   and (video['content_hash'], language) not in self.planned]
+        self.planned.update((video['content_hash'], language) for language in pending)
+        video['languages'] = pending
+        video['skipped'] = [language for language in languages if language not in pending]
+        if not pending:
+            return None, {}, []
+
+        def row(job_id, language, parent_id=None):
+            return {
+                'id': job_id,
+                'filename': filename,
+                'original_path': video['path'],
+                'target_language': language,
+                'status': TranslationJob.BATCH_QUEUED,
+                'worker_id': self.run_id,
+                'progress': 0,
+                'message': 'Waiting in a batch run...',
+                'file_size': video['size'],
+                'duration': video['duration'],
+                'content_hash': video['content_hash'],
+                'pipeline_version': self.store.version,
+                'parent_id': parent_id,
+                'owner': self.owner,
+                'created_at': datetime.utcnow(),
+            }
+
+        job_id = str(uuid.uuid4())
+        if len(pending) == 1:
+            return job_id, {}, [row(job_id, pending[0])]
+        # As for uploads: a parent runs the shared stages, a child per language
+        child_jobs = {language: str(uuid.uuid4()) for language in pending}
+        rows = [row(job_id, 'multi')] + [row(child_id, language, job_id)
+                                         for language, child_id in child_jobs.items()]
+        return job_id, child_jobs, rows
+
+    def take_over(self, hashes):
+        """Deal with rows earlier runs left registered for these videos.
+
+        Rows of a run that died are failed, so their videos are planned
+        again; the languages of a run still going, or of an upload being
+        dubbed, are skipped.
+        """
+        from models import db, TranslationJob
+
+        hashes = list(hashes)
+        leftovers = []
+        with self.app.app_context():
+            for start in range(0, len(hashes), INSERT_BATCH_SIZE):
+                chunk = hashes[start:start + INSERT_BATCH_SIZE]
+                leftovers.extend(TranslationJob.query
+                                 .filter(TranslationJob.content_hash.in_(chunk))
+                                 .filter_by(status=TranslationJob.BATCH_QUEUED).all())
+                self.planned.update(db.session.query(TranslationJob.content_hash, TranslationJob.target_language)
+                                    .filter(TranslationJob.content_hash.in_(chunk))
+                                    .filter_by(duplicate_of=None, pipeline_version=self.store.version)
+                                    .filter(TranslationJob.status.notin_(TranslationJob.TERMINAL_STATUSES
+                                                                         + (TranslationJob.BATCH_QUEUED,)))
+                                    .all())
+            dead = []
+            for job in leftovers:
+                if not run_alive(job.worker_id):
+                    dead.append((job.id, job.target_language))
+                elif job.target_language != 'multi':
+                    self.planned.add((job.content_hash, job.target_language))
+            if not dead:
+                return
+            final = {'status': 'error', 'progress': 0, 'message': 'Batch run stopped before dubbing this video',
+                     'output_path': None}
+            for start in range(0, len(dead), INSERT_BATCH_SIZE):
+                ids = [job_id for job_id, _ in dead[start:start + INSERT_BATCH_SIZE]]
+                (TranslationJob.query.filter(TranslationJob.id.in_(ids))
+                 .filter_by(status=TranslationJob.BATCH_QUEUED)
+                 .update({'status': 'error', 'progress': 0, 'message': final['message'], 'worker_id': None},
+                         synchronize_session=False))
+            db.session.commit()
+        for job_id, language in dead:
+            if language != 'multi':
+                self.settle(job_id, final)
+        logger.warning(f"Failed {len(dead)} job(s) left by batch runs that stopped")
+
+    def release(self):
+        """Unmark this run's rows once it is over"""
+        from models import db, TranslationJob
+
+        with self.app.app_context():
+            (TranslationJob.query.filter_by(worker_id=self.run_id)
+             .update({'worker_id': None}, synchronize_session=False))
+            db.session.commit()
+
+    def insert(self, rows):
+        """Register jobs with a few multi-row INSERTs instead of a commit per job"""
+        from sqlalchemy.exc import IntegrityError
+        from models import db, TranslationJob, UserPreference
+
+        insert = db.insert(TranslationJob.__table__)
+        with self.app.app_context():
+            if self.owner:
+                # The owner column references the session's preferences
+                UserPreference.ensure(self.owner)
+                db.session.commit()
+            for start in range(0, len(rows), INSERT_BATCH_SIZE):
+                chunk = rows[start:start + INSERT_BATCH_SIZE]
+                try:
+                    db.session.execute(insert, chunk)
+                    db.session.commit()
+                    continue
+                except IntegrityError:
+                    db.session.rollback()
+                # An upload of one of these videos took the lead since
+                # take_over; the batch still dubs it, without leading
+                for row in chunk:
+                    try:
+                        with db.session.begin_nested():
+                            db.session.execute(insert, [row])
+                    except IntegrityError:
+                        leader = TranslationJob.find_in_flight(row['content_hash'], row['target_language'],
+                                                               row['pipeline_version'])
+                        db.session.execute(insert, [{**row, 'duplicate_of': leader and leader.id}])
+                db.session.commit()
+        for row in rows:
+            self.registry.create(row['id'], {name: row[name] for name in
+                                             ('status', 'progress', 'message', 'filename',
+                                              'target_language', 'original_path')})
+
+    def record(self, video):
+        if self.output:
+            with open(self.output, 'a') as f:
+                f.write(json.dumps(video, default=str) + '\n')
+
+    def finish(self, video, result):
+        """Store a finished video's job states and publish its outputs"""
+        video['seconds'] = round(result['seconds'], 1)
+        video['jobs'] = {}
+        for entry_id, state in result['jobs'].items():
+            state = state or {'status': 'error', 'message': 'No result'}
+            fields = {name: state.get(name) for name in ('status', 'progress', 'message', 'output_path')}
+            fields.update({name: state[name] for name in ('timings', 'audio_seconds', 'realtime_factor',
+                                                          'checkpoint') if state.get(name) is not None})
+            self.registry.update(entry_id, **fields)
+            language = state.get('target_language')
+            if language != 'multi':
+                self.settle(entry_id, fields)
+            output_path = fields['output_path'] and os.path.abspath(fields['output_path'])
+            video['jobs'][entry_id] = {'target_language': language, 'status': fields['status'],
+                                       'message': fields['message'], 'output_path': output_path}
+        top = result['jobs'].get(video['job_id']) or {}
+        video['status'] = top.get('status', 'error')
+        video['audio_seconds'] = top.get('audio_seconds')
+        return video['status']
+
+    def settle(self, job_id, final):
+        """Publish a finished job's output and settle the uploads that joined it"""
+        # Uploads of the same video find batch jobs in flight and wait on them
+        with self.app.app_context():
+            self.store.resolve_duplicates(job_id, final)
+
+    def fail(self, video, message):
+        """Mark every job of a video as failed"""
+        final = {'status': 'error', 'progress': 0, 'message': message[:255], 'output_path': None}
+        for entry_id in [video['job_id']] + list(video['child_jobs'].values()):
+            self.registry.update(entry_id, **final)
+            self.settle(entry_id, final)
+
+    def run(self, videos, previous_hashes=None):
+        """Process (path, languages) pairs; returns the number of videos that failed"""
+        previous_hashes = previous_hashes or {}
+        context = multiprocessing.get_context('spawn')
+        failed = 0
+        with ProcessPoolExecutor(max_workers=self.processes, mp_context=context,
+                                 initializer=init_process) as pool:
+            # 1. Hash and probe every input
+            languages_by_path = dict(videos)
+            futures = {}
+            for path, _ in videos:
+                try:
+                    stat = os.stat(path)
+                    known = previous_hashes.get((path, stat.st_size, stat.st_mtime))
+                except OSError:
+                    known = None
+                futures[pool.submit(inspect_video, path, known)] = path
+            inspected = []
+            progress = Progress(len(videos))
+            for future in as_completed(futures):
+                video = future.result()
+                if video.get('status'):
+                    self.record(video)
+                    progress.add(video['status'])
+                    failed += 1
+                else:
+                    inspected.append(video)
+
+            # 2. Register what is left to do
+            self.take_over({video['content_hash'] for video in inspected})
+            rows = []
+            for video in inspected:
+                languages = languages_by_path[video['path']]
+                video['job_id'], video['child_jobs'], video_rows = self.plan(video, languages)
+                if video['job_id'] is None:
+                    video['status'] = 'skipped'
+                    self.record(video)
+                    progress.add('skipped')
+                rows.extend(video_rows)
+            self.insert(rows)
+            logger.info(f"Registered {len(rows)} job(s) for {len(inspected)} video(s)")
+
+            # 3. Dub
+            running = {}
+            for video in inspected:
+                if video['job_id'] is None:
+                    continue
+                future = pool.submit(dub_video, video['job_id'], video['path'], video['languages'][0],
+                                     video['child_jobs'] or None)
+                running[future] = video
+            try:
+                for future in as_completed(running):
+                    video = running.pop(future)
+                    try:
+                        status = self.finish(video, future.result())
+                    except Exception as e:
+                        # The pool process died (out of memory, killed)
+                        logger.error(f"Batch job for {video['path']} failed: {e}")
+                        self.fail(video, f'Batch process failed: {e}')
+                        video['status'], status = 'error', 'error'
+                    failed += status != 'completed'
+                    self.record(video)
+                    progress.add(status, video.get('audio_seconds'))
+            except KeyboardInterrupt:
+                for future, video in running.items():
+                    future.cancel()
+                    self.fail(video, 'Batch run interrupted')
+                raise
+            finally:
+                self.registry.stop()
+                self.release()
+        return failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Dub a directory or manifest of videos')
+    parser.add_argument('source', help='directory of videos, or a CSV or JSON manifest')
+    parser.add_argument('--languages', default='en',
+                        help='target languages for videos whose manifest entry names none')
+    parser.add_argument('--processes', type=int, default=available_cores(), help='pool processes')
+    parser.add_argument('--output', help='append one JSON line per video to this file')
+    parser.add_argument('--owner', help='session id whose history lists the jobs')
+    parser.add_argument('--dry-run', action='store_true', help='list the inputs and exit')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    from app import app, ALLOWED_EXTENSIONS
+
+    videos = read_inputs(args.source, split_languages(args.languages), ALLOWED_EXTENSIONS)
+    if args.dry_run:
+        for path, languages in videos:
+            print(f"{path}\t{','.join(languages)}")
+        return
+    logger.info(f"Dubbing {len(videos)} video(s) on {args.processes} process(es)")
+    run = BatchRun(app, args.processes, args.output, args.owner)
+    failed = run.run(videos, read_previous_results(args.output))
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
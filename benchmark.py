@@ -0,0 +1,368 @@
+"""Offline end-to-end benchmark of the dubbing pipeline.
+
+Generates synthetic test videos with ffmpeg's lavfi sources, registers
+deterministic local stand-in speech, translation and TTS backends (with
+configurable latency and failure injection) and runs jobs
+through VideoProcessor on the job scheduler. Results are written as JSON
+so runs can be compared across commits:
+
+    python benchmark.py --video-seconds 60 --jobs 8 --concurrency 4 --output bench.json
+    python benchmark.py --compare before.json bench.json
+"""
+import os
+import argparse
+import asyncio
+import json
+import logging
+import random
+import resource
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+import zlib
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+# Stages whose timings are reported per job
+STAGES = ('extract_audio', 'first_segment', 'transcribe_audio', 'translate_text',
+          'text_to_speech', 'merge_audio_video')
+
+CODECS = {
+    # name -> (video encoder, audio encoder, container extension)
+    'h264': ('libx264', 'aac', 'mp4'),
+    'vp9': ('libvpx-vp9', 'libopus', 'webm'),
+    'mpeg4': ('mpeg4', 'aac', 'mp4'),
+}
+
+
+def generate_video(path, seconds, codec='h264', size='640x360', rate=25):
+    """Render a test-pattern video whose audio alternates 3 s tone and 1 s silence"""
+    video_codec, audio_codec, _ = CODECS[codec]
+    command = [
+        'ffmpeg', '-hide_banner', '-loglevel', 'error',
+        '-f', 'lavfi', '-i', f'testsrc2=size={size}:rate={rate}:duration={seconds}',
+        '-f', 'lavfi', '-i', f"aevalsrc='0.4*sin(2*PI*440*t)*lt(mod(t,4),3)':s=44100:d={seconds}",
+        '-c:v', video_codec, '-c:a', audio_codec, '-shortest',
+        path, '-y'
+    ]
+    subprocess.run(command, check=True)
+    return path
+
+
+class StandIn:
+    """Latency and failure model shared by the stand-in services.
+
+    Both are derived from a hash of the request, so the same input always
+    takes the same time and fails the same way across runs.
+    """
+
+    def __init__(self, latency=0.2, jitter=0.5, failure_rate=0.0, seed=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.seed = seed
+        self.calls = 0
+        self.failures = 0
+        self._lock = threading.Lock()
+
+    def draw(self, payload):
+        """(latency, failed) of one call"""
+        rng = random.Random(zlib.crc32(payload) ^ self.seed)
+        delay = max(0.0, self.latency * (1 + self.jitter * (2 * rng.random() - 1)))
+        failed = rng.random() < self.failure_rate
+        with self._lock:
+            self.calls += 1
+            self.failures += failed
+        return delay, failed
+
+    def call(self, payload):
+        """Sleep like a network round trip; returns False for an injected failure"""
+        delay, failed = self.draw(payload)
+        time.sleep(delay)
+        return not failed
+
+    async def call_async(self, payload):
+        """call() for the stage engine, waiting without a thread like a real async client"""
+        delay, failed = self.draw(payload)
+        await asyncio.sleep(delay)
+        return not failed
+
+    def stats(self):
+        with self._lock:
+            return {'calls': self.calls, 'failures': self.failures}
+
+
+def install_stand_ins(latency, jitter, failure_rate, seed):
+    """Register local stand-in backends and make them the default engines"""
+    import backends
+
+    services = {name: StandIn(latency, jitter, failure_rate, seed)
+                for name in ('speech', 'translate', 'tts')}
+
+    @backends.register_backend('speech', 'standin')
+    class StandInSpeech(backends.SpeechBackend):
+        def transcribe(self, pcm, sample_rate, sample_width, language):
+            if not services['speech'].call(pcm):
+                raise backends.BackendError('injected failure')
+            return self.text(pcm, sample_rate, sample_width)
+
+        async def transcribe_async(self, pcm, sample_rate, sample_width, language):
+            if not await services['speech'].call_async(pcm):
+                raise backends.BackendError('injected failure')
+            return self.text(pcm, sample_rate, sample_width)
+
+        def text(self, pcm, sample_rate, sample_width):
+            # About 2.5 words per second of audio
+            words = max(1, int(len(pcm) / (sample_rate * sample_width) * 2.5))
+            return ' '.join(f'w{zlib.crc32(pcm) % 997}' for _ in range(words))
+
+    @backends.register_backend('translation', 'standin')
+    class StandInTranslation(backends.TranslationBackend):
+        def translate_batch(self, texts, target, source='auto'):
+            # One round trip per batch, as with a real batch API
+            if not services['translate'].call('\n'.join([target] + list(texts)).encode('utf-8')):
+                raise backends.BackendError('injected failure')
+            return [f'[{target}] {text}' for text in texts]
+
+    @backends.register_backend('tts', 'standin')
+    class StandInTTS(backends.TTSBackend):
+        voice = 'standin'
+
+        def synthesize(self, text, language):
+            if not services['tts'].call(f'{language}:{text}'.encode('utf-8')):
+                raise backends.BackendError('injected failure')
+            # Silence at the length a voice would need, 0.4 s per word
+            return backends.silence_wav(0.4 * len(text.split()))
+
+        async def synthesize_async(self, text, language):
+            if not await services['tts'].call_async(f'{language}:{text}'.encode('utf-8')):
+                raise backends.BackendError('injected failure')
+            return backends.silence_wav(0.4 * len(text.split()))
+
+    backends.DEFAULT_BACKENDS.update(speech='standin', translation='standin', tts='standin')
+    return services
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of a list of numbers"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(fraction * len(ordered) + 0.5)) - 1))
+    return round(ordered[index], 3)
+
+
+def summarize(values):
+    if not values:
+        return None
+    return {
+        'mean': round(sum(values) / len(values), 3),
+        'p50': percentile(values, 0.5),
+        'p95': percentile(values, 0.95),
+        'max': round(max(values), 3),
+    }
+
+
+def directory_size(path):
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for name in filenames:
+            try:
+                total += os.path.getsize(os.path.join(dirpath, name))
+            except OSError:
+                pass
+    return total
+
+
+class DiskSampler:
+    """Tracks the peak size of a directory from a background thread"""
+
+    def __init__(self, path, interval=0.2):
+        self.path = path
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='disk-sampler')
+        self._thread.daemon = True
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, directory_size(self.path))
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, directory_size(self.path))
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, check=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmark(video_seconds=30, codec='h264', jobs=4, concurrency=2, languages=('fr',),
+                  latency=0.2, jitter=0.5, failure_rate=0.0, seed=0, audio_mode=None, keep=False,
+                  executor=None):
+    """Run ``jobs`` pipeline jobs ``concurrency`` at a time and return the results"""
+    # Fresh caches, so every run pays for every stage
+    os.environ.setdefault('CACHE_BACKEND', 'none')
+    import video_processor
+    from job_registry import JobRegistry
+    from scheduler import JobScheduler
+
+    services = install_stand_ins(latency, jitter, failure_rate, seed)
+    if audio_mode:
+        video_processor.AUDIO_EXTRACTION_MODE = audio_mode
+    if executor:
+        video_processor.STAGE_EXECUTOR = executor
+
+    workdir = tempfile.mkdtemp(prefix='videoverse-bench-')
+    previous_dir = os.getcwd()
+    os.chdir(workdir)
+    try:
+        extension = CODECS[codec][2]
+        source = generate_video(os.path.abspath(f'source.{extension}'), video_seconds, codec)
+        registry = JobRegistry(publish=False)
+        scheduler = JobScheduler(max_workers=concurrency)
+        finished = threading.Semaphore(0)
+        results = []
+        results_lock = threading.Lock()
+
+        def run_job(index):
+            job_id = f'bench-{index:04d}'
+            # Each job gets its own copy of the input, as uploads would
+            video_path = os.path.join('uploads', job_id, os.path.basename(source))
+            os.makedirs(os.path.dirname(video_path), exist_ok=True)
+            shutil.copyfile(source, video_path)
+            child_jobs = ({language: f'{job_id}-{language}' for language in languages}
+                          if len(languages) > 1 else None)
+            for entry_id in [job_id] + list((child_jobs or {}).values()):
+                registry.create(entry_id, {'status': 'queued'})
+            started = time.perf_counter()
+            status, timings = 'error', {}
+            try:
+                processor = video_processor.VideoProcessor(job_id, video_path, languages[0], registry,
+                                                           scheduler=scheduler, child_jobs=child_jobs)
+                processor.process_video()
+                timings = dict(processor.timings)
+                # Branch stages run in parallel; report the slowest language
+                for branch in processor.branches.values():
+                    for stage, seconds in branch.timings.items():
+                        timings[stage] = max(timings.get(stage, 0), seconds)
+                status = registry.get(job_id)['status']
+            finally:
+                with results_lock:
+                    results.append({'job_id': job_id, 'status': status,
+                                    'seconds': time.perf_counter() - started, 'timings': timings})
+                finished.release()
+
+        with DiskSampler(workdir) as disk:
+            started = time.perf_counter()
+            for index in range(jobs):
+                scheduler.submit(f'bench-{index:04d}', lambda index=index: run_job(index))
+            for _ in range(jobs):
+                finished.acquire()
+            wall = time.perf_counter() - started
+
+        latencies = [result['seconds'] for result in results]
+        stage_times = {stage: summarize([result['timings'][stage] for result in results
+                                         if stage in result['timings']])
+                       for stage in STAGES}
+        completed = sum(1 for result in results if result['status'] == 'completed')
+        return {
+            'revision': git_revision(),
+            'timestamp': datetime.utcnow().isoformat(),
+            'config': {
+                'video_seconds': video_seconds, 'codec': codec, 'jobs': jobs, 'concurrency': concurrency,
+                'languages': list(languages), 'latency': latency, 'jitter': jitter,
+                'failure_rate': failure_rate, 'seed': seed, 'audio_mode': video_processor.AUDIO_EXTRACTION_MODE,
+                'executor': video_processor.STAGE_EXECUTOR,
+            },
+            'wall_seconds': round(wall, 3),
+            'jobs_per_minute': round(jobs / wall * 60, 2) if wall else None,
+            'completed': completed,
+            'failed': jobs - completed,
+            'latency': summarize(latencies),
+            'stages': {stage: summary for stage, summary in stage_times.items() if summary},
+            'services': {name: service.stats() for name, service in services.items()},
+            # ru_maxrss is in kilobytes on Linux
+            'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+            'peak_child_rss_mb': round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024, 1),
+            'peak_disk_mb': round(disk.peak / (1024 * 1024), 1),
+        }
+    finally:
+        os.chdir(previous_dir)
+        if not keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+def compare(baseline, current):
+    """Relative change of the headline numbers between two result files"""
+    def change(path):
+        old, new = baseline, current
+        for key in path:
+            old = (old or {}).get(key)
+            new = (new or {}).get(key)
+        if not old or new is None:
+            return None
+        return {'before': old, 'after': new, 'change': f'{(new - old) / old:+.1%}'}
+
+    rows = {'jobs_per_minute': change(['jobs_per_minute']),
+            'latency_p50': change(['latency', 'p50']),
+            'latency_p95': change(['latency', 'p95']),
+            'peak_rss_mb': change(['peak_rss_mb']),
+            'peak_disk_mb': change(['peak_disk_mb'])}
+    for stage in STAGES:
+        rows[f'{stage}_p50'] = change(['stages', stage, 'p50'])
+    return {name: row for name, row in rows.items() if row}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the dubbing pipeline offline')
+    parser.add_argument('--video-seconds', type=float, default=30, help='length of the synthetic video')
+    parser.add_argument('--codec', choices=sorted(CODECS), default='h264')
+    parser.add_argument('--jobs', type=int, default=4, help='number of jobs to run')
+    parser.add_argument('--concurrency', type=int, default=2, help='jobs processed at the same time')
+    parser.add_argument('--languages', default='fr', help='comma-separated target languages per job')
+    parser.add_argument('--latency', type=float, default=0.2, help='mean stand-in service latency in seconds')
+    parser.add_argument('--jitter', type=float, default=0.5, help='latency spread as a fraction of the mean')
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='fraction of service calls that fail')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--audio-mode', choices=['file', 'pipe'], help='override AUDIO_EXTRACTION_MODE')
+    parser.add_argument('--executor', choices=['threads', 'asyncio'], help='override STAGE_EXECUTOR')
+    parser.add_argument('--keep', action='store_true', help='keep the working directory')
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--compare', nargs=2, metavar=('BASELINE', 'CURRENT'),
+                        help='compare two result files instead of running')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    if args.compare:
+        with open(args.compare[0]) as f, open(args.compare[1]) as g:
+            print(json.dumps(compare(json.load(f), json.load(g)), indent=2))
+        return
+
+    results = run_benchmark(args.video_seconds, args.codec, args.jobs, args.concurrency,
+                            [language.strip() for language in args.languages.split(',') if language.strip()],
+                            args.latency, args.jitter, args.failure_rate, args.seed, args.audio_mode, args.keep,
+                            args.executor)
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    print(text)
+
+
+if __name__ == '__main__':
+    main()
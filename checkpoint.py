@@ -0,0 +1,145 @@
+"""Per-job checkpoints so interrupted jobs resume where they stopped.
+
+Each finished stage is recorded in processed/<job_id>/checkpoint.json with
+its artifacts, their SHA-256 hashes and how long it took; transcription
+also records every finished audio segment. A job that is run again skips
+stages whose artifacts are still intact and only transcribes segments
+that are missing, so a restart after a deploy or crash costs seconds
+rather than a full reprocess.
+"""
+import os
+import json
+import hashlib
+import logging
+import random
+import threading
+import time
+from datetime import datetime
+
+from backends import BackendError
+from content_store import PIPELINE_VERSION
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_NAME = 'checkpoint.json'
+# Retries for failed speech, translation and TTS calls
+SERVICE_RETRIES = int(os.environ.get('SERVICE_RETRIES', '3'))
+SERVICE_RETRY_BASE_SECONDS = float(os.environ.get('SERVICE_RETRY_BASE_SECONDS', '1.0'))
+SERVICE_RETRY_MAX_SECONDS = 30
+
+# Failures worth retrying: service errors and dropped or slow connections
+TRANSIENT_ERRORS = (BackendError, ConnectionError, TimeoutError)
+
+
+def file_sha256(path, chunk_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def fingerprint(value):
+    """Short hash of a stage's inputs, to notice when they change"""
+    return hashlib.sha256(json.dumps(value, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+
+
+def backoff_delay(attempt, base=SERVICE_RETRY_BASE_SECONDS, cap=SERVICE_RETRY_MAX_SECONDS):
+    """Seconds to wait before retry number ``attempt`` (1-based), with full jitter"""
+    return random.uniform(0, min(cap, base * 2 ** (attempt - 1)))
+
+
+class JobCheckpoint:
+    """Manifest of a job's finished stages and transcribed segments.
+
+    A manifest written by another pipeline version or for another target
+    language is ignored, so stale artifacts are never reused.
+    """
+
+    def __init__(self, job_dir, target_language, version=PIPELINE_VERSION):
+        self.job_dir = job_dir
+        self.path = os.path.join(job_dir, MANIFEST_NAME)
+        self.identity = {'version': version, 'target_language': target_language}
+        self._lock = threading.Lock()
+        self.manifest = self._read()
+        self.resumed = bool(self.manifest['stages'] or self.manifest['segments'])
+
+    def _read(self):
+        try:
+            with open(self.path) as f:
+                manifest = json.load(f)
+        except FileNotFoundError:
+            manifest = None
+        except ValueError:
+            logger.warning(f"Ignoring unreadable checkpoint {self.path}")
+            manifest = None
+        if not manifest or manifest.get('identity') != self.identity:
+            manifest = {'identity': self.identity, 'stages': {}, 'segments': {}}
+        return manifest
+
+    def _write(self):
+        partial = self.path + '.part'
+        with open(partial, 'w') as f:
+            json.dump(self.manifest, f)
+        os.replace(partial, self.path)
+
+    def completed(self, stage, inputs=None):
+        """Data saved with a finished stage, or None if it must run (again).
+
+        The stage is redone if it was run on different ``inputs`` or if one of
+        its artifacts was truncated or replaced since.
+        """
+        with self._lock:
+            entry = self.manifest['stages'].get(stage)
+        if entry is None or entry.get('inputs') != (fingerprint(inputs) if inputs is not None else None):
+            return None
+        for name, digest in entry['artifacts'].items():
+            path = os.path.join(self.job_dir, name)
+            if not os.path.exists(path) or file_sha256(path) != digest:
+                logger.info(f"Checkpoint for {stage} is stale ({name} changed), running it again")
+                return None
+        return entry.get('data') or {}
+
+    def stage_done(self, stage, seconds, artifacts=(), data=None, inputs=None):
+        """Record a finished stage with the paths of its output files"""
+        entry = {
+            'inputs': fingerprint(inputs) if inputs is not None else None,
+            'artifacts': {os.path.relpath(path, self.job_dir): file_sha256(path) for path in artifacts},
+            'seconds': round(seconds, 3),
+            'completed_at': datetime.utcnow().isoformat(),
+        }
+        if data is not None:
+            entry['data'] = data
+        with self._lock:
+            self.manifest['stages'][stage] = entry
+            self._write()
+
+    def segment_text(self, index, start, end):
+        with self._lock:
+            return self.manifest['segments'].get(f'{index}:{start}:{end}')
+
+    def segment_done(self, index, start, end, text):
+        with self._lock:
+            self.manifest['segments'][f'{index}:{start}:{end}'] = text
+            self._write()
+
+    def summary(self):
+        """Stage timings and artifact hashes, for TranslationJob.extra_data"""
+        with self._lock:
+            return {stage: {'seconds': entry['seconds'], 'artifacts': entry['artifacts']}
+                    for stage, entry in self.manifest['stages'].items()}
+
+
+def call_with_retries(func, on_retry=None, attempts=SERVICE_RETRIES, sleep=time.sleep):
+    """Call ``func()``, retrying transient failures with exponential backoff"""
+    for attempt in range(1, attempts + 2):
+        try:
+            return func()
+        except TRANSIENT_ERRORS as e:
+            if attempt > attempts:
+                raise
+            delay = backoff_delay(attempt)
+            logger.warning(f"Attempt {attempt} failed ({e}), retrying in {delay:.1f}s")
+            if on_retry is not None:
+                on_retry(attempt, e)
+            sleep(delay)
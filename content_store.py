@@ -0,0 +1,215 @@
+import os
+import logging
+import hashlib
+import shutil
+import threading
+from datetime import datetime, timedelta
+
+from sqlalchemy.exc import IntegrityError
+
+from models import db, TranslationJob
+from events import get_hub
+
+logger = logging.getLogger(__name__)
+
+# Bump whenever a pipeline change alters the dubbed output, so stored
+# results from older pipelines are no longer reused
+PIPELINE_VERSION = '2'
+
+PROCESSED_DIR = 'processed'
+STORE_DIR = os.environ.get('CONTENT_STORE_DIR', os.path.join('processed', 'store'))
+UPLOAD_STORE_DIR = os.environ.get('UPLOAD_STORE_DIR', os.path.join('uploads', 'store'))
+CHUNK_SIZE = 1024 * 1024
+# Jobs waiting on an identical job for longer than this are failed, in
+# case the process running it died
+DUPLICATE_WAIT_SECONDS = float(os.environ.get('DUPLICATE_WAIT_SECONDS', str(6 * 3600)))
+
+
+def save_and_hash(file_storage, path, chunk_size=CHUNK_SIZE):
+    """Save an uploaded file while hashing it; returns (sha256 hex digest, size)"""
+    digest = hashlib.sha256()
+    size = 0
+    with open(path, 'wb') as out:
+        while True:
+            chunk = file_storage.stream.read(chunk_size)
+            if not chunk:
+                break
+            digest.update(chunk)
+            out.write(chunk)
+            size += len(chunk)
+    return digest.hexdigest(), size
+
+
+def output_extension(filename):
+    """Extension of a dubbed output: the source's, since ffmpeg keeps its container"""
+    return os.path.splitext(filename)[1].lower() or '.mp4'
+
+
+def link_or_copy(src, dst):
+    """Hard-link ``src`` to ``dst``, copying when linking is not possible"""
+    os.makedirs(os.path.dirname(dst) or '.', exist_ok=True)
+    if os.path.exists(dst):
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+    return dst
+
+
+class ContentStore:
+    """Uploads and dubbed outputs addressed by the SHA-256 of the source video.
+
+    Outputs are keyed by (video hash, target language, pipeline version)
+    and keep the source's extension.
+    Files are hard-linked in and out of the store, so each distinct video or
+    output occupies disk space once no matter how many jobs refer to it.
+    """
+
+    def __init__(self, root=STORE_DIR, upload_root=UPLOAD_STORE_DIR, version=PIPELINE_VERSION):
+        self.root = root
+        self.upload_root = upload_root
+        self.version = version
+        # Serialises lookup-then-insert within this process; across
+        # processes the unique index on leader rows picks a single leader
+        self.lock = threading.Lock()
+
+    def _sharded(self, root, name):
+        return os.path.join(root, name[:2], name)
+
+    def output_path(self, content_hash, target_language, extension='.mp4'):
+        return self._sharded(self.root, f'{content_hash}-{target_language}-v{self.version}{extension}')
+
+    def has_output(self, content_hash, target_language, filename):
+        """Whether an output for a source called ``filename`` is stored"""
+        return os.path.exists(self.output_path(content_hash, target_language, output_extension(filename)))
+
+    def adopt_upload(self, content_hash, path):
+        """Deduplicate a freshly saved upload against earlier identical ones"""
+        blob = self._sharded(self.upload_root, content_hash)
+        if os.path.exists(blob):
+            link_or_copy(blob, path)
+        else:
+            link_or_copy(path, blob)
+        return path
+
+    def publish_output(self, content_hash, target_language, path):
+        """Add a finished output to the store"""
+        return link_or_copy(path, self.output_path(content_hash, target_language, output_extension(path)))
+
+    def checkout_output(self, content_hash, target_language, dest):
+        """Link a stored output into a job's own directory"""
+        return link_or_copy(self.output_path(content_hash, target_language, output_extension(dest)), dest)
+
+    def resolve_duplicates(self, leader_id, final, processing_jobs=None):
+        """Publish a finished job's output and settle the jobs that joined it.
+
+        Must be called inside an app context. ``final`` holds the leader's
+        final status, message and output path.
+        """
+        leader = TranslationJob.query.get(leader_id)
+        if leader is None or not leader.content_hash:
+            return 0
+
+        completed = final.get('status') == 'completed' and final.get('output_path')
+        if completed and os.path.exists(final['output_path']):
+            self.publish_output(leader.content_hash, leader.target_language, final['output_path'])
+
+        followers = (TranslationJob.query.filter_by(duplicate_of=leader_id)
+                     .filter(TranslationJob.status.notin_(TranslationJob.TERMINAL_STATUSES)).all())
+        for job in followers:
+            if completed:
+                # Named after the follower, in the container the leader produced
+                name = os.path.splitext(job.filename)[0] + output_extension(leader.filename)
+                job.output_path = self.checkout_output(
+                    leader.content_hash, leader.target_language,
+                    os.path.join(PROCESSED_DIR, job.id, f'dubbed_{name}'))
+                job.status, job.progress, job.message = 'completed', 100, 'Processing completed'
+                job.completed_at = datetime.utcnow()
+            else:
+                job.status, job.progress = 'error', 0
+                job.message = f"Original job failed: {final.get('message', '')}"[:255]
+            self._announce(job, processing_jobs, output_path=job.output_path)
+        db.session.commit()
+        if followers:
+            logger.info(f"Job {leader_id} settled {len(followers)} duplicate job(s)")
+        return len(followers)
+
+    def _announce(self, job, processing_jobs, **fields):
+        """Pass a change of a job on to its registry entry or to watchers"""
+        if processing_jobs is not None and job.id in processing_jobs:
+            # The caller commits the row, so the registry needn't flush it
+            processing_jobs.update(job.id, persist=False, status=job.status, progress=job.progress,
+                                   message=job.message, **fields)
+        else:
+            get_hub().publish(job.id, job.to_dict())
+
+    def settle_orphans(self, wait_seconds=DUPLICATE_WAIT_SECONDS, processing_jobs=None):
+        """Settle jobs waiting on an identical job that will not settle them.
+
+        Must be called inside an app context. Jobs whose leader finished
+        without settling them are settled now. When the leader is gone, or
+        its output is, the oldest waiting job leads instead. Jobs waiting
+        longer than ``wait_seconds`` on an unfinished leader are failed, so
+        they can be retried on their own. Returns the promoted jobs, which
+        are queued but still need a worker.
+        """
+        waiting = (TranslationJob.query.filter_by(status=TranslationJob.WAITING_DUPLICATE)
+                   .order_by(TranslationJob.created_at).all())
+        groups = {}
+        for job in waiting:
+            groups.setdefault(job.duplicate_of, []).append(job)
+
+        cutoff = datetime.utcnow() - timedelta(seconds=wait_seconds)
+        promoted = []
+        for leader_id, jobs in groups.items():
+            leader = TranslationJob.query.get(leader_id) if leader_id else None
+            if leader is not None and leader.status not in TranslationJob.TERMINAL_STATUSES:
+                stale = [job for job in jobs if job.created_at < cutoff]
+                for job in stale:
+                    job.status, job.progress = 'error', 0
+                    job.message = 'Timed out waiting for an identical video, retry to dub it on its own'
+                    self._announce(job, processing_jobs)
+                db.session.commit()
+                continue
+            if leader is not None and (leader.status == 'error'
+                                       or self.has_output(leader.content_hash, leader.target_language,
+                                                          leader.filename)
+                                       or leader.output_path and os.path.exists(leader.output_path)):
+                self.resolve_duplicates(leader.id, {'status': leader.status, 'message': leader.message,
+                                                    'output_path': leader.output_path}, processing_jobs)
+                continue
+
+            head = jobs[0]
+            try:
+                updated = (TranslationJob.query
+                           .filter_by(id=head.id, status=TranslationJob.WAITING_DUPLICATE, duplicate_of=leader_id)
+                           .update({'status': 'queued', 'duplicate_of': None,
+                                    'message': 'Identical job is gone, dubbing this video...'},
+                                   synchronize_session=False))
+                db.session.commit()
+            except IntegrityError:
+                # Another identical job took the lead meanwhile; wait on that one
+                db.session.rollback()
+                current = TranslationJob.find_in_flight(head.content_hash, head.target_language,
+                                                        head.pipeline_version)
+                if current is not None:
+                    TranslationJob.follow([job.id for job in jobs], current.id)
+                continue
+            if updated:
+                TranslationJob.follow([job.id for job in jobs[1:]], head.id)
+                promoted.append(head)
+        if promoted:
+            logger.info(f"Promoted {len(promoted)} job(s) whose identical job is gone")
+        return promoted
+
+
+_store = None
+
+
+def get_content_store():
+    """Return the process-wide content store"""
+    global _store
+    if _store is None:
+        _store = ContentStore()
+    return _store
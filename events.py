@@ -0,0 +1,107 @@
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# Channels kept for jobs nobody is listening to any more
+MAX_IDLE_CHANNELS = 10000
+
+
+class _Channel:
+    __slots__ = ('condition', 'version', 'data', 'waiters')
+
+    def __init__(self, lock):
+        self.condition = threading.Condition(lock)
+        self.version = 0
+        self.data = None
+        self.waiters = 0
+
+
+class StatusHub:
+    """In-process publish/subscribe for job status changes.
+
+    Each job has a monotonically increasing version. Subscribers block on
+    a per-job condition until the version moves past the one they have
+    already seen, so an idle subscriber costs a sleeping thread and nothing
+    else, and a publish only wakes the subscribers of that job.
+    """
+
+    def __init__(self, max_idle_channels=MAX_IDLE_CHANNELS):
+        self.max_idle_channels = max_idle_channels
+        self._lock = threading.Lock()
+        self._channels = OrderedDict()
+
+    def _channel(self, job_id):
+        # Caller holds self._lock
+        channel = self._channels.get(job_id)
+        if channel is None:
+            channel = self._channels[job_id] = _Channel(self._lock)
+            self._trim()
+        else:
+            self._channels.move_to_end(job_id)
+        return channel
+
+    def _trim(self):
+        excess = len(self._channels) - self.max_idle_channels
+        if excess <= 0:
+            return
+        for job_id in list(self._channels):
+            if excess <= 0:
+                break
+            if self._channels[job_id].waiters == 0:
+                del self._channels[job_id]
+                excess -= 1
+
+    def publish(self, job_id, data, version=None):
+        """Record a new state for a job and wake its subscribers.
+
+        ``version`` is the job's version in the shared status table, so that
+        every process numbers the job's states alike.
+        """
+        with self._lock:
+            channel = self._channel(job_id)
+            channel.version = version if version and version > channel.version else channel.version + 1
+            channel.data = data
+            channel.condition.notify_all()
+            return channel.version
+
+    def current(self, job_id):
+        """Latest (version, data) published for a job; (0, None) if none"""
+        with self._lock:
+            channel = self._channels.get(job_id)
+            if channel is None:
+                return 0, None
+            return channel.version, channel.data
+
+    def wait(self, job_id, since=0, timeout=None):
+        """Block until a job's version exceeds ``since`` or the timeout passes.
+
+        Returns the latest (version, data), which is unchanged on timeout.
+        """
+        with self._lock:
+            channel = self._channel(job_id)
+            channel.waiters += 1
+            try:
+                channel.condition.wait_for(lambda: channel.version > since, timeout)
+                return channel.version, channel.data
+            finally:
+                channel.waiters -= 1
+
+    def watched(self):
+        """{job id: version} of the jobs clients are waiting on"""
+        with self._lock:
+            return {job_id: channel.version for job_id, channel in self._channels.items() if channel.waiters}
+
+    def subscribers(self):
+        """Number of clients currently waiting on any job"""
+        with self._lock:
+            return sum(channel.waiters for channel in self._channels.values())
+
+
+_hub = StatusHub()
+
+
+def get_hub():
+    """Return the process-wide status hub"""
+    return _hub
@@ -0,0 +1,349 @@
+"""Background cleanup of finished jobs and their files.
+
+Deletes finished jobs past the retention period together with their
+upload and output directories, and evicts the least recently downloaded
+outputs while the storage budget is exceeded. Jobs that are still in
+flight are never touched. Runs in the web processes started through
+main.py; a lock file lets only one of them on a host run a pass at a
+time. Run a single pass by hand with:
+
+    python janitor.py --once
+"""
+import os
+import argparse
+import logging
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+try:
+    import fcntl
+except ImportError:  # Windows: every process runs its own passes
+    fcntl = None
+
+from models import TranslationJob
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Janitor settings, overridable through the environment
+JANITOR_INTERVAL = float(os.environ.get('JANITOR_INTERVAL', '300'))
+RETENTION_HOURS = float(os.environ.get('JOB_RETENTION_HOURS', '24'))
+# Combined size of uploads/ and processed/; 0 means no budget
+STORAGE_BUDGET_BYTES = int(os.environ.get('STORAGE_BUDGET_BYTES', '0'))
+# Uploads are refused when the disk would be left with less than this free
+MIN_FREE_BYTES = int(os.environ.get('MIN_FREE_BYTES', str(1024 * 1024 * 1024)))
+DELETE_BATCH_SIZE = int(os.environ.get('JANITOR_BATCH_SIZE', '500'))
+# Directories without a job row are only removed once this old
+ORPHAN_GRACE_SECONDS = 3600
+
+UPLOAD_FOLDER = 'uploads'
+PROCESSED_FOLDER = 'processed'
+# Held by the process running a pass, under the processed folder
+LOCK_NAME = '.janitor.lock'
+
+JOBS_DELETED = metrics.REGISTRY.register(metrics.Counter(
+    'videoverse_janitor_jobs_deleted_total', 'Jobs deleted by the storage janitor', ['reason']))
+BYTES_FREED = metrics.REGISTRY.register(metrics.Counter(
+    'videoverse_janitor_bytes_freed_total', 'Bytes of files removed by the storage janitor', ['reason']))
+JANITOR_RUNS = metrics.REGISTRY.register(metrics.Counter(
+    'videoverse_janitor_runs_total', 'Storage janitor passes', ['outcome']))
+STORAGE_BYTES = metrics.REGISTRY.register(metrics.Gauge(
+    'videoverse_storage_bytes', 'Bytes used by uploads and outputs at the last janitor pass'))
+UPLOADS_REJECTED = metrics.REGISTRY.register(metrics.Counter(
+    'videoverse_uploads_rejected_total', 'Uploads refused for lack of disk space'))
+
+
+def tree_usage(*roots):
+    """Bytes used under ``roots``, counting hard-linked files once"""
+    seen = set()
+    total = 0
+    for root in roots:
+        for dirpath, _, filenames in os.walk(root):
+            for name in filenames:
+                try:
+                    stat = os.lstat(os.path.join(dirpath, name))
+                except OSError:
+                    continue
+                if (stat.st_dev, stat.st_ino) not in seen:
+                    seen.add((stat.st_dev, stat.st_ino))
+                    total += stat.st_size
+    return total
+
+
+def freed_by_removing(path):
+    """Bytes that deleting ``path`` returns to the disk (files with no other links)"""
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for name in filenames:
+            try:
+                stat = os.lstat(os.path.join(dirpath, name))
+            except OSError:
+                continue
+            if stat.st_nlink <= 1:
+                total += stat.st_size
+    return total
+
+
+class StorageJanitor:
+    """Retention and disk-budget enforcement for job rows and files"""
+
+    def __init__(self, app, registry=None, interval=JANITOR_INTERVAL, retention_hours=RETENTION_HOURS,
+                 budget_bytes=STORAGE_BUDGET_BYTES, min_free_bytes=MIN_FREE_BYTES,
+                 batch_size=DELETE_BATCH_SIZE, upload_root=UPLOAD_FOLDER, processed_root=PROCESSED_FOLDER):
+        self.app = app
+        self.registry = registry
+        # Other housekeeping run at the end of each pass
+        self.tasks = []
+        self.interval = interval
+        self.retention_hours = retention_hours
+        self.budget_bytes = budget_bytes
+        self.min_free_bytes = min_free_bytes
+        self.batch_size = batch_size
+        self.upload_root = upload_root
+        self.processed_root = processed_root
+        # Directories managed by the content store rather than by jobs
+        self.store_dirs = {os.path.join(upload_root, 'store'), os.path.join(processed_root, 'store')}
+        self.usage = None  # bytes used at the last pass
+        self._lock = threading.Lock()  # one pass at a time
+        self._thread = None
+        self._stop = threading.Event()
+
+    def start(self):
+        """Run passes every ``interval`` seconds in a background thread (idempotent)"""
+        if self._thread is not None or self.interval <= 0:
+            return
+        self._thread = threading.Thread(target=self._loop, name='storage-janitor')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _loop(self):
+        try:
+            # Upload checks need a figure before the first full pass
+            self.measure()
+        except OSError as e:
+            logger.warning(f"Could not measure storage: {e}")
+        # Stagger the first pass so several processes don't all start at once
+        while not self._stop.wait(self.interval * (0.5 + (os.getpid() % 100) / 200)):
+            self.run_once()
+
+    @contextmanager
+    def host_lock(self):
+        """Yield whether this process holds the host's janitor lock"""
+        if fcntl is None:
+            yield True
+            return
+        os.makedirs(self.processed_root, exist_ok=True)
+        fd = os.open(os.path.join(self.processed_root, LOCK_NAME), os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                yield False
+            else:
+                yield True
+        finally:
+            # Closing the file releases the lock
+            os.close(fd)
+
+    def run_once(self):
+        """One full pass: retention, disk budget, then unreferenced store blobs"""
+        if not self._lock.acquire(blocking=False):
+            return None
+        started = time.perf_counter()
+        try:
+            with self.host_lock() as held:
+                if not held:
+                    # Another process is running a pass; only refresh the
+                    # figure this one checks uploads against
+                    self.measure()
+                    return None
+                with self.app.app_context():
+                    expired = self.delete_expired()
+                    evicted = self.enforce_budget()
+                orphans = self.remove_orphans()
+                blobs = self.remove_unreferenced_uploads()
+                for task in self.tasks:
+                    task()
+            JANITOR_RUNS.inc(outcome='ok')
+            summary = {'expired': expired, 'evicted': evicted, 'orphans': orphans,
+                       'upload_blobs': blobs, 'usage_bytes': self.usage}
+            if expired or evicted or orphans or blobs:
+                logger.info(f"Janitor pass in {time.perf_counter() - started:.2f}s: {summary}")
+            return summary
+        except Exception as e:
+            JANITOR_RUNS.inc(outcome='error')
+            logger.error(f"Janitor pass failed: {e}")
+            return None
+        finally:
+            self._lock.release()
+
+    def job_dirs(self, job_id):
+        return [os.path.join(self.upload_root, job_id), os.path.join(self.processed_root, job_id)]
+
+    def remove_jobs(self, ids, reason):
+        """Delete jobs' directories, then their rows in one bulk DELETE"""
+        freed = 0
+        for job_id in ids:
+            for path in self.job_dirs(job_id):
+                if os.path.isdir(path):
+                    freed += freed_by_removing(path)
+                    shutil.rmtree(path, ignore_errors=True)
+            if self.registry is not None:
+                self.registry.discard(job_id)
+        deleted = TranslationJob.delete_ids(ids)
+        JOBS_DELETED.inc(deleted, reason=reason)
+        BYTES_FREED.inc(freed, reason=reason)
+        return deleted, freed
+
+    def delete_expired(self):
+        """Remove finished jobs older than the retention period"""
+        if self.retention_hours <= 0:
+            return 0
+        cutoff = datetime.utcnow() - timedelta(hours=self.retention_hours)
+        total = 0
+        while not self._stop.is_set():
+            ids = TranslationJob.expired_ids(cutoff, self.batch_size)
+            total += self.remove_jobs(ids, 'retention')[0]
+            if len(ids) < self.batch_size:
+                break
+        return total
+
+    def measure(self):
+        self.usage = tree_usage(self.upload_root, self.processed_root)
+        STORAGE_BYTES.set(self.usage)
+        return self.usage
+
+    def enforce_budget(self):
+        """Evict least recently downloaded finished jobs until under 90% of the budget"""
+        usage = self.measure()
+        if not self.budget_bytes or usage <= self.budget_bytes:
+            return 0
+        target = self.budget_bytes * 0.9
+        evicted = 0
+        while not self._stop.is_set():
+            # Stored outputs nobody links to are only kept for reuse; drop them
+            # first, including those released by the jobs evicted below
+            for path, size in self.unreferenced_outputs():
+                if usage <= target:
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    # Gone already, or a job linked it meanwhile
+                    continue
+                usage -= size
+                BYTES_FREED.inc(size, reason='budget')
+            if usage <= target:
+                break
+            ids = TranslationJob.least_recently_used_ids(min(self.batch_size, 50))
+            if not ids:
+                break
+            deleted, freed = self.remove_jobs(ids, 'budget')
+            evicted += deleted
+            usage -= freed
+        self.usage = usage
+        STORAGE_BYTES.set(usage)
+        if usage > self.budget_bytes:
+            logger.warning(f"Storage still over budget after eviction: {usage} > {self.budget_bytes} bytes")
+        return evicted
+
+    def unreferenced_outputs(self):
+        """(path, size) of stored outputs no job links to, oldest first"""
+        store = os.path.join(self.processed_root, 'store')
+        entries = []
+        for dirpath, _, filenames in os.walk(store):
+            for name in filenames:
+                path = os.path.join(dirpath, name)
+                try:
+                    stat = os.lstat(path)
+                except OSError:
+                    continue
+                if stat.st_nlink <= 1:
+                    entries.append((stat.st_mtime, path, stat.st_size))
+        return [(path, size) for _, path, size in sorted(entries)]
+
+    def remove_unreferenced_uploads(self):
+        """Drop stored upload blobs once no job directory links to them"""
+        removed = 0
+        cutoff = time.time() - ORPHAN_GRACE_SECONDS
+        for dirpath, _, filenames in os.walk(os.path.join(self.upload_root, 'store')):
+            for name in filenames:
+                path = os.path.join(dirpath, name)
+                try:
+                    stat = os.lstat(path)
+                    if stat.st_nlink <= 1 and stat.st_mtime < cutoff:
+                        os.remove(path)
+                        BYTES_FREED.inc(stat.st_size, reason='unreferenced')
+                        removed += 1
+                except OSError:
+                    continue
+        return removed
+
+    def remove_orphans(self):
+        """Remove job directories whose job row no longer exists"""
+        cutoff = time.time() - ORPHAN_GRACE_SECONDS
+        candidates = {}
+        for root in (self.upload_root, self.processed_root):
+            try:
+                entries = list(os.scandir(root))
+            except FileNotFoundError:
+                continue
+            for entry in entries:
+                if (entry.is_dir(follow_symlinks=False) and entry.path not in self.store_dirs
+                        and entry.stat(follow_symlinks=False).st_mtime < cutoff):
+                    candidates.setdefault(entry.name, []).append(entry.path)
+        if not candidates:
+            return 0
+        removed = 0
+        names = list(candidates)
+        with self.app.app_context():
+            for i in range(0, len(names), self.batch_size):
+                batch = names[i:i + self.batch_size]
+                known = {job_id for (job_id,) in TranslationJob.query.with_entities(TranslationJob.id)
+                         .filter(TranslationJob.id.in_(batch)).all()}
+                for job_id in batch:
+                    if job_id in known:
+                        continue
+                    for path in candidates[job_id]:
+                        BYTES_FREED.inc(freed_by_removing(path), reason='orphan')
+                        shutil.rmtree(path, ignore_errors=True)
+                        removed += 1
+        return removed
+
+    def has_room(self, incoming_bytes=0):
+        """Whether an upload of ``incoming_bytes`` fits on disk and in the budget"""
+        free = shutil.disk_usage(self.upload_root).free
+        if free - incoming_bytes < self.min_free_bytes:
+            return False
+        if self.budget_bytes and self.usage is not None:
+            return self.usage + incoming_bytes <= self.budget_bytes
+        return True
+
+    def reject_upload(self):
+        UPLOADS_REJECTED.inc()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Delete expired jobs and enforce the storage budget')
+    parser.add_argument('--once', action='store_true', help='run a single pass and exit')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    # The app's janitor also runs the housekeeping the app registers with it
+    from app import janitor
+    if args.once:
+        print(janitor.run_once())
+        return
+    while True:
+        janitor.run_once()
+        time.sleep(janitor.interval)
+
+
+if __name__ == '__main__':
+    main()
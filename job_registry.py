@@ -0,0 +1,371 @@
+import os
+import logging
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from datetime import datetime
+
+from sqlalchemy import bindparam, or_, select, update
+
+from models import db, TranslationJob
+from events import get_hub
+from status_table import get_status_table
+
+logger = logging.getLogger(__name__)
+
+# Registry tuning, overridable through the environment
+FLUSH_INTERVAL = float(os.environ.get('STATUS_FLUSH_INTERVAL', '1.0'))
+FINISHED_TTL = float(os.environ.get('FINISHED_JOB_TTL', '3600'))
+# Unfinished jobs this process won't update again (copies loaded from the
+# database, jobs waiting on an identical job) are dropped once this stale
+STALE_TTL = float(os.environ.get('STALE_JOB_TTL', '600'))
+MAX_FINISHED_JOBS = int(os.environ.get('MAX_FINISHED_JOBS', '5000'))
+SHARDS = 16
+
+TERMINAL_STATUSES = TranslationJob.TERMINAL_STATUSES
+
+
+class JobAbandoned(BaseException):
+    """Raised by updates of a job this worker no longer holds the lease on.
+
+    A BaseException, like asyncio.CancelledError, so the stages' error
+    handlers don't report it as a failure of the job.
+    """
+
+
+class JobRecord:
+    """Compact live state of one job.
+
+    The fields every job has are slots; rarely used ones (children,
+    duplicate_of, timings, ...) live in ``extra``.
+    """
+
+    __slots__ = ('job_id', 'status', 'progress', 'message', 'filename', 'target_language',
+                 'original_path', 'output_path', 'file_size', 'created_at', 'updated_at', 'extra',
+                 'version', 'owned', 'abandoned')
+
+    FIELDS = ('status', 'progress', 'message', 'filename', 'target_language',
+              'original_path', 'output_path', 'file_size', 'created_at')
+    # Extra fields written to TranslationJob.extra_data for later diagnosis
+    METADATA = ('timings', 'audio_seconds', 'realtime_factor', 'checkpoint', 'profile')
+
+    def __init__(self, job_id, fields):
+        self.job_id = job_id
+        self.status = None
+        self.progress = 0
+        self.message = ''
+        self.filename = None
+        self.target_language = None
+        self.original_path = None
+        self.output_path = None
+        self.file_size = None
+        self.created_at = time.time()
+        self.extra = None
+        self.version = 0  # in the shared status table; 0 if not published there
+        self.owned = False  # written by this process rather than loaded from the database
+        self.abandoned = False  # another worker took the job over
+        self.apply(fields)
+
+    def apply(self, fields):
+        for name, value in fields.items():
+            if name in self.FIELDS:
+                setattr(self, name, value)
+            elif name != 'id':
+                if self.extra is None:
+                    self.extra = {}
+                self.extra[name] = value
+        self.updated_at = time.time()
+
+    def to_dict(self):
+        data = {'id': self.job_id}
+        for name in self.FIELDS:
+            data[name] = getattr(self, name)
+        if self.extra:
+            data.update(self.extra)
+        return data
+
+    def persisted_fields(self):
+        """Columns the write-behind flusher stores for this record"""
+        fields = {
+            'id': self.job_id,
+            'status': self.status,
+            'progress': self.progress,
+            'message': (self.message or '')[:255],
+            'output_path': self.output_path,
+        }
+        if self.status == 'completed':
+            fields['completed_at'] = datetime.utcfromtimestamp(self.updated_at)
+        metadata = {name: self.extra[name] for name in self.METADATA if self.extra and name in self.extra}
+        if metadata:
+            fields['extra_data'] = metadata
+        return fields
+
+
+class _Shard:
+    __slots__ = ('lock', 'records', 'finished', 'dirty')
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.records = {}
+        self.finished = OrderedDict()  # job_id -> None, in LRU order
+        self.dirty = set()
+
+
+class JobRegistry:
+    """Thread-safe store of live job state with write-behind persistence.
+
+    Records are spread over lock-striped shards so request threads reading
+    one job never wait on workers updating another. Updates only touch
+    memory and mark the record dirty; a background flusher writes all
+    dirty records to the database in one batched UPDATE per interval.
+    Finished jobs are evicted after ``finished_ttl`` seconds or once more
+    than ``max_finished`` of them are held; unfinished ones nothing here
+    updates, after ``stale_ttl`` seconds without a change.
+
+    A registry with a ``lease_owner`` (a queue worker's id) only writes
+    rows whose lease that worker still holds, directly or through the
+    parent job, so a worker that lost a lease can't overwrite the job
+    another worker now runs.
+
+    Registries that publish also share each update with the other processes
+    on the host through the status table, and ``get`` prefers the table's
+    state when another process has moved a job on since this one last saw
+    it, or holds a job this process doesn't. A job this process is running,
+    or has unflushed changes for, keeps its local state.
+    """
+
+    def __init__(self, app=None, flush_interval=FLUSH_INTERVAL, finished_ttl=FINISHED_TTL,
+                 max_finished=MAX_FINISHED_JOBS, publish=True, lease_owner=None, stale_ttl=STALE_TTL):
+        self.app = app
+        self.lease_owner = lease_owner
+        self.flush_interval = flush_interval
+        self.finished_ttl = finished_ttl
+        self.stale_ttl = stale_ttl
+        self.max_finished_per_shard = max(1, max_finished // SHARDS)
+        self.publish = publish
+        self.table = get_status_table() if publish else None
+        self._shards = [_Shard() for _ in range(SHARDS)]
+        self._flusher = None
+        self._flusher_lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def _shard(self, job_id):
+        return self._shards[zlib.crc32(job_id.encode()) % SHARDS]
+
+    def __contains__(self, job_id):
+        shard = self._shard(job_id)
+        with shard.lock:
+            return job_id in shard.records
+
+    def __len__(self):
+        return sum(len(shard.records) for shard in self._shards)
+
+    def create(self, job_id, fields, persist=False):
+        """Register a job; ``persist`` queues it for the next flush"""
+        return self._put(job_id, fields, persist, replace=True)
+
+    def load(self, job_id, fields):
+        """Cache state read from the database without writing it back"""
+        return self._put(job_id, fields, persist=False, replace=True, share=False)
+
+    def update(self, job_id, persist=True, **fields):
+        """Change a job's fields and return a snapshot of its new state"""
+        return self._put(job_id, fields, persist, replace=False)
+
+    def _put(self, job_id, fields, persist, replace, share=True):
+        shard = self._shard(job_id)
+        with shard.lock:
+            record = shard.records.get(job_id)
+            if record is None or replace:
+                record = shard.records[job_id] = JobRecord(job_id, fields)
+            else:
+                if record.abandoned:
+                    raise JobAbandoned(job_id)
+                record.apply(fields)
+            if record.status in TERMINAL_STATUSES:
+                shard.finished[job_id] = None
+                shard.finished.move_to_end(job_id)
+            else:
+                shard.finished.pop(job_id, None)
+            if share:
+                record.owned = True
+            if persist:
+                shard.dirty.add(job_id)
+            snapshot = record.to_dict()
+            if share and self.table is not None:
+                # Under the shard lock, so the table sees this job's updates in order
+                record.version = self.table.put(job_id, snapshot) or 0
+            version = record.version
+        if self.publish:
+            get_hub().publish(job_id, snapshot, version)
+        if persist:
+            self.start()
+        return snapshot
+
+    def get(self, job_id, default=None):
+        """Snapshot of a job's state, or ``default`` if it isn't held here or shared"""
+        shard = self._shard(job_id)
+        with shard.lock:
+            record = shard.records.get(job_id)
+            # Read under the lock: this process's own updates can't slip in
+            # between, so a newer shared version was written elsewhere
+            shared = (self.table.get(job_id, newer_than=record.version if record is not None else 0)
+                      if self.table is not None else None)
+            if shared is not None and record is not None and (
+                    job_id in shard.dirty or (record.owned and record.status not in TERMINAL_STATUSES)):
+                # This process runs the job, so its own state is the current
+                # one, whatever a worker that lost the job last published
+                shared = None
+            if shared is None:
+                if record is None:
+                    return default
+                if job_id in shard.finished:
+                    shard.finished.move_to_end(job_id)
+                return record.to_dict()
+            if record is not None:
+                # Another process took the job over (a retry, a worker claiming
+                # it); its state is the current one from now on. Dropped under
+                # the lock, so no update of ours can be lost with it.
+                del shard.records[job_id]
+                shard.finished.pop(job_id, None)
+        return shared[1]
+
+    def abandon(self, job_id):
+        """Stop persisting and sharing a job whose lease was lost.
+
+        Pending changes are dropped, and later updates raise JobAbandoned so
+        the pipeline still running the job stops at its next status update.
+        """
+        shard = self._shard(job_id)
+        with shard.lock:
+            record = shard.records.get(job_id)
+            if record is not None:
+                record.abandoned = True
+            shard.dirty.discard(job_id)
+
+    def abandoned(self, job_id):
+        """Whether the job was abandoned after its lease was lost"""
+        shard = self._shard(job_id)
+        with shard.lock:
+            record = shard.records.get(job_id)
+            return record is not None and record.abandoned
+
+    def version(self, job_id):
+        """Version of a job's state in the status table, 0 if it isn't shared"""
+        return self.table.version(job_id) if self.table is not None else 0
+
+    def discard(self, job_id):
+        """Forget a job, e.g. after it was deleted from the database"""
+        self.forget(job_id)
+        if self.table is not None:
+            self.table.discard(job_id)
+
+    def forget(self, job_id):
+        """Drop this process's copy of a job, leaving its shared state alone"""
+        shard = self._shard(job_id)
+        with shard.lock:
+            shard.records.pop(job_id, None)
+            shard.finished.pop(job_id, None)
+            shard.dirty.discard(job_id)
+
+    def start(self):
+        """Start the write-behind flusher (idempotent)"""
+        if self._flusher is not None or self.app is None:
+            return
+        with self._flusher_lock:
+            if self._flusher is None:
+                self._flusher = threading.Thread(target=self._flush_loop, name='job-registry-flusher')
+                self._flusher.daemon = True
+                self._flusher.start()
+
+    def _flush_loop(self):
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+                self.evict()
+            except Exception as e:
+                logger.error(f"Job registry flush failed: {e}")
+
+    def flush(self):
+        """Write every dirty record to the database in one batch"""
+        rows = []
+        for shard in self._shards:
+            with shard.lock:
+                for job_id in shard.dirty:
+                    record = shard.records.get(job_id)
+                    if record is not None:
+                        rows.append(record.persisted_fields())
+                shard.dirty.clear()
+        if not rows or self.app is None:
+            return 0
+
+        try:
+            with self.app.app_context():
+                table = TranslationJob.__table__
+                # Records only hold the METADATA keys; keep whatever else
+                # the column holds
+                ids = [row['id'] for row in rows if 'extra_data' in row]
+                if ids:
+                    stored = dict(db.session.execute(
+                        select(table.c.id, table.c.extra_data).where(table.c.id.in_(ids))).all())
+                    for row in rows:
+                        if 'extra_data' in row:
+                            row['extra_data'] = {**(stored.get(row['id']) or {}), **row['extra_data']}
+                # Group by column set: completed rows also carry completed_at.
+                # Core executemany skips rows deleted meanwhile instead of failing.
+                for columns in {tuple(sorted(row)) for row in rows}:
+                    batch = [{**row, 'job_id': row['id']} for row in rows if tuple(sorted(row)) == columns]
+                    statement = (update(table).where(table.c.id == bindparam('job_id'))
+                                 .values({name: bindparam(name) for name in columns if name != 'id'}))
+                    if self.lease_owner is not None:
+                        statement = statement.where(self._leased(table))
+                    db.session.execute(statement, batch)
+                db.session.commit()
+        except Exception:
+            # Keep the changes for the next attempt
+            for row in rows:
+                shard = self._shard(row['id'])
+                with shard.lock:
+                    shard.dirty.add(row['id'])
+            raise
+        logger.debug(f"Flushed {len(rows)} job status update(s)")
+        return len(rows)
+
+    def _leased(self, table):
+        """Rows leased to this registry's worker, directly or through their parent"""
+        parent = table.alias('parent')
+        return or_(table.c.worker_id == self.lease_owner,
+                   table.c.parent_id.in_(select(parent.c.id).where(parent.c.worker_id == self.lease_owner)))
+
+    def evict(self):
+        """Drop finished jobs past their TTL or beyond the per-shard cap, and
+        unfinished ones that went stale while waiting on another process"""
+        now = time.time()
+        cutoff = now - self.finished_ttl
+        stale_cutoff = now - self.stale_ttl
+        evicted = 0
+        for shard in self._shards:
+            with shard.lock:
+                for job_id in list(shard.finished):
+                    record = shard.records[job_id]
+                    over_cap = len(shard.finished) > self.max_finished_per_shard
+                    if job_id in shard.dirty or not (over_cap or record.updated_at < cutoff):
+                        continue
+                    del shard.finished[job_id]
+                    del shard.records[job_id]
+                    evicted += 1
+                for job_id, record in list(shard.records.items()):
+                    # Jobs this process runs keep their records however long
+                    # a stage takes; get() falls back to the shared state
+                    waiting = not record.owned or record.status == TranslationJob.WAITING_DUPLICATE
+                    if (waiting and record.updated_at < stale_cutoff and job_id not in shard.finished
+                            and job_id not in shard.dirty):
+                        del shard.records[job_id]
+                        evicted += 1
+        return evicted
+
+    def stop(self):
+        """Stop the flusher after writing any remaining changes"""
+        self._stop.set()
+        self.flush()
@@ -1,6 +1,13 @@
 import logging
-from app import app
+from app import app, init_db, janitor
+
+# gunicorn imports this module in each worker after forking, so every
+# serving process runs the janitor; worker.py, batch.py and the CLIs don't
+janitor.start()
 
 if __name__ == "__main__":
     logging.basicConfig(level=logging.DEBUG)
+    # The development server creates missing tables itself; deployments run
+    # flask --app app init-db once instead
+    init_db()
     app.run(host="0.0.0.0", port=5000, debug=True)
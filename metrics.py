@@ -0,0 +1,244 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Histogram buckets in seconds, from a cached lookup to a long ffmpeg run
+LATENCY_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+# Processing seconds per second of video
+REALTIME_BUCKETS = (0.1, 0.25, 0.5, 1, 2, 4, 8, 16)
+DURATION_BUCKETS = (10, 30, 60, 120, 300, 600, 1200, 1800, 3600, 7200)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.extend(self._render_sample(key, value))
+        return lines
+
+    def _render_sample(self, key, value):
+        return [f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}']
+
+
+class Counter(_Metric):
+    """Monotonically increasing count"""
+
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    """Value that can go up and down"""
+
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    """Distribution of observations over fixed cumulative buckets"""
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                # Per-bucket counts, running sum, total count
+                entry = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+                    break
+            entry[1] += value
+            entry[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the duration of the enclosed block"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def _render_sample(self, key, value):
+        counts, total, count = value
+        lines = []
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets, counts):
+            cumulative += bucket_count
+            labels = _format_labels(self.labelnames, key, [('le', _format_value(float(bound)))])
+            lines.append(f'{self.name}_bucket{labels} {cumulative}')
+        labels = _format_labels(self.labelnames, key)
+        lines.append(f'{self.name}_sum{labels} {_format_value(round(total, 6))}')
+        lines.append(f'{self.name}_count{labels} {count}')
+        return lines
+
+
+class Registry:
+    """Collection of metrics plus callbacks that sample state at scrape time"""
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector):
+        """Call ``collector()`` before every scrape, e.g. to refresh gauges"""
+        with self._lock:
+            self._collectors.append(collector)
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format"""
+        with self._lock:
+            collectors = list(self._collectors)
+            metrics = list(self._metrics)
+        for collector in collectors:
+            try:
+                collector()
+            except Exception as e:
+                logger.warning(f"Metrics collector {collector.__name__} failed: {e}")
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Pipeline stages
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    'videoverse_stage_duration_seconds', 'Time spent in each pipeline stage', ['stage']))
+STAGE_ERRORS = REGISTRY.register(Counter(
+    'videoverse_stage_errors_total', 'Pipeline stages that failed', ['stage']))
+STAGE_BYTES = REGISTRY.register(Counter(
+    'videoverse_stage_bytes_total', 'Bytes read and written by pipeline stages', ['stage', 'direction']))
+
+# Whole jobs
+JOB_SECONDS = REGISTRY.register(Histogram(
+    'videoverse_job_duration_seconds', 'End-to-end processing time of a job', ['outcome']))
+JOBS_FINISHED = REGISTRY.register(Counter(
+    'videoverse_jobs_finished_total', 'Jobs that finished processing', ['outcome']))
+VIDEO_SECONDS = REGISTRY.register(Histogram(
+    'videoverse_video_duration_seconds', 'Duration of the processed audio track', buckets=DURATION_BUCKETS))
+REALTIME_FACTOR = REGISTRY.register(Histogram(
+    'videoverse_realtime_factor', 'Processing seconds per second of video', buckets=REALTIME_BUCKETS))
+
+# Scheduling
+QUEUE_WAIT_SECONDS = REGISTRY.register(Histogram(
+    'videoverse_queue_wait_seconds', 'Time jobs waited for a free worker'))
+WORKERS = REGISTRY.register(Gauge(
+    'videoverse_workers', 'Worker pool size and number of busy workers', ['state']))
+QUEUE_DEPTH = REGISTRY.register(Gauge(
+    'videoverse_queue_depth', 'Jobs waiting for a free worker'))
+STAGE_ACTIVE = REGISTRY.register(Gauge(
+    'videoverse_stage_slots_active', 'Concurrency slots in use per stage class', ['stage_class']))
+
+# External services
+EXTERNAL_CALLS = REGISTRY.register(Counter(
+    'videoverse_external_calls_total', 'Calls to speech, translation and TTS services',
+    ['service', 'outcome']))
+
+# Caches
+CACHE_REQUESTS = REGISTRY.register(Gauge(
+    'videoverse_cache_requests', 'Stage cache lookups since start', ['cache', 'result']))
+CACHE_HIT_RATIO = REGISTRY.register(Gauge(
+    'videoverse_cache_hit_ratio', 'Stage cache hit ratio since start', ['cache']))
+
+# Status push
+STATUS_SUBSCRIBERS = REGISTRY.register(Gauge(
+    'videoverse_status_subscribers', 'Clients waiting for job status changes'))
+
+
+def render():
+    """Current metrics of this process in Prometheus text format"""
+    return REGISTRY.render()
+
+
+def _collect_runtime():
+    # Imported here so that importing metrics never pulls in the pipeline
+    from scheduler import get_scheduler
+    from stage_cache import cache_stats
+    from events import get_hub
+
+    stats = get_scheduler().stats()
+    WORKERS.set(stats['workers'], state='total')
+    WORKERS.set(stats['active_workers'], state='busy')
+    QUEUE_DEPTH.set(stats['queue_depth'])
+    for stage_class, active in stats['stage_active'].items():
+        STAGE_ACTIVE.set(active, stage_class=stage_class)
+
+    for namespace, cache in cache_stats().items():
+        CACHE_REQUESTS.set(cache['hits'], cache=namespace, result='hit')
+        CACHE_REQUESTS.set(cache['misses'], cache=namespace, result='miss')
+        CACHE_HIT_RATIO.set(cache['hit_rate'], cache=namespace)
+
+    STATUS_SUBSCRIBERS.set(get_hub().subscribers())
+
+
+REGISTRY.add_collector(_collect_runtime)
@@ -1,6 +1,7 @@
 from flask_sqlalchemy import SQLAlchemy
-from datetime import datetime
+from datetime import datetime, timedelta
 from sqlalchemy.dialects.postgresql import JSON
+from sqlalchemy.exc import IntegrityError
 
 db = SQLAlchemy()
 
@@ -13,34 +14,78 @@ class TranslationJob(db.Model):
     output_path = db.Column(db.String(512), nullable=True)
     source_language = db.Column(db.String(10), nullable=True)
     target_language = db.Column(db.String(10), nullable=False)
-    status = db.Column(db.String(20), nullable=False, default='uploaded')
+    status = db.Column(db.String(20), nullable=False, default='uploaded', index=True)
     progress = db.Column(db.Integer, nullable=False, default=0)
     message = db.Column(db.String(255), nullable=True)
     created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
     completed_at = db.Column(db.DateTime, nullable=True)
+    last_accessed_at = db.Column(db.DateTime, nullable=True)  # Last download, for disk-budget eviction
     file_size = db.Column(db.Integer, nullable=True)  # Size in bytes
     duration = db.Column(db.Float, nullable=True)  # Video duration in seconds
     extra_data = db.Column(JSON, nullable=True)  # Any additional metadata
     
+    # Content addressing: identical uploads share one pipeline run
+    content_hash = db.Column(db.String(64), nullable=True)  # SHA-256 of the uploaded video
+    pipeline_version = db.Column(db.String(16), nullable=True)
+    duplicate_of = db.Column(db.String(36), nullable=True, index=True)  # Leader job this one joined
+    
+    # Multi-language uploads: one parent job runs the shared stages, one
+    # child job per target language
+    parent_id = db.Column(db.String(36), nullable=True, index=True)
+    
+    # UserPreference.session_id of the uploader; history is scoped to it.
+    # Indexed by ix_translation_jobs_owner_created below
+    owner = db.Column(db.String(255), db.ForeignKey('user_preferences.session_id'), nullable=True)
+    user = db.relationship('UserPreference', backref=db.backref('jobs', lazy='dynamic'))
+    
+    # Work queue bookkeeping for out-of-process workers
+    worker_id = db.Column(db.String(64), nullable=True)  # Worker currently holding the lease
+    lease_expires_at = db.Column(db.DateTime, nullable=True)
+    heartbeat_at = db.Column(db.DateTime, nullable=True)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    
+    TERMINAL_STATUSES = ('completed', 'error')
+    # Joined an identical job in flight and waits for its result
+    WAITING_DUPLICATE = 'waiting_duplicate'
+    # Rows a batch.py run registered and dubs itself; the web tier and the
+    # queue workers leave them alone
+    BATCH_QUEUED = 'batch_queued'
+    
+    # Columns needed to list a job; history queries load only these
+    SUMMARY_COLUMNS = ('id', 'filename', 'status', 'progress', 'message', 'target_language',
+                       'source_language', 'created_at', 'completed_at', 'file_size', 'duration',
+                       'output_path', 'content_hash', 'duplicate_of', 'parent_id')
+    
+    # Rows that lead their content: at most one per (content_hash,
+    # target_language, pipeline_version), whichever process inserts them
+    LEADER_CONDITION = ("duplicate_of IS NULL AND target_language != 'multi' "
+                        "AND status NOT IN ('completed', 'error')")
+    
+    __table_args__ = (
+        db.Index('ix_translation_jobs_content', 'content_hash', 'target_language', 'pipeline_version'),
+        # Partial indexes are only supported by these databases
+        db.Index('ux_translation_jobs_leader', 'content_hash', 'target_language', 'pipeline_version',
+                 unique=True, sqlite_where=db.text(LEADER_CONDITION),
+                 postgresql_where=db.text(LEADER_CONDITION)).ddl_if(dialect=('sqlite', 'postgresql')),
+        db.Index('ix_translation_jobs_owner_created', 'owner', 'created_at'),
+        db.Index('ix_translation_jobs_status_created', 'status', 'created_at'),
+    )
+    
     def __repr__(self):
         return f'<TranslationJob {self.id}>'
     
     def to_dict(self):
         """Convert job to dictionary representation"""
-        return {
-            'id': self.id,
-            'filename': self.filename,
-            'status': self.status,
-            'progress': self.progress,
-            'message': self.message,
-            'target_language': self.target_language,
-            'source_language': self.source_language,
-            'created_at': self.created_at.isoformat() if self.created_at else None,
-            'completed_at': self.completed_at.isoformat() if self.completed_at else None,
-            'file_size': self.file_size,
-            'duration': self.duration,
-            'output_path': self.output_path
-        }
+        return self.serialize(self)
+    
+    @classmethod
+    def serialize(cls, row):
+        """Dictionary representation of a job or of a row of SUMMARY_COLUMNS"""
+        data = {name: getattr(row, name) for name in cls.SUMMARY_COLUMNS}
+        for name in ('created_at', 'completed_at'):
+            if data[name] is not None:
+                data[name] = data[name].isoformat()
+        return data
     
     @classmethod
     def get_recent_jobs(cls, limit=10):
@@ -48,18 +93,214 @@ class TranslationJob(db.Model):
         return cls.query.order_by(cls.created_at.desc()).limit(limit).all()
     
     @classmethod
-    def cleanup_old_jobs(cls, hours=24):
-        """Delete jobs older than specified hours"""
-        from datetime import timedelta
-        cutoff = datetime.utcnow() - timedelta(hours=hours)
-        old_jobs = cls.query.filter(cls.created_at < cutoff).all()
+    def history(cls, owner, limit=10, before=None, statuses=None, language=None):
+        """One page of an owner's jobs, newest first, as rows of SUMMARY_COLUMNS.
+        
+        Uses keyset pagination: ``before`` is the (created_at, id) of the last
+        job on the previous page, so deep pages cost the same as the first.
+        """
+        query = (db.session.query(*[getattr(cls, name) for name in cls.SUMMARY_COLUMNS])
+                 .filter(cls.owner == owner))
+        if statuses:
+            query = query.filter(cls.status.in_(statuses))
+        if language:
+            query = query.filter(cls.target_language == language)
+        if before:
+            query = query.filter(db.tuple_(cls.created_at, cls.id) < db.tuple_(*before))
+        return query.order_by(cls.created_at.desc(), cls.id.desc()).limit(limit).all()
+    
+    @classmethod
+    def recent_metrics(cls, limit=50):
+        """extra_data (stage timings, audio length) of the latest completed jobs"""
+        rows = (db.session.query(cls.extra_data)
+                .filter(cls.status == 'completed', cls.extra_data.isnot(None))
+                .order_by(cls.completed_at.desc()).limit(limit).all())
+        return [extra for (extra,) in rows if extra]
+    
+    @classmethod
+    def find_in_flight(cls, content_hash, target_language, pipeline_version):
+        """Unfinished job already processing the same content, if any"""
+        return (cls.query.filter_by(content_hash=content_hash,
+                                    target_language=target_language,
+                                    pipeline_version=pipeline_version,
+                                    duplicate_of=None)
+                .filter(cls.status.notin_(cls.TERMINAL_STATUSES))
+                .order_by(cls.created_at).first())
+    
+    @classmethod
+    def follow(cls, job_ids, leader_id, message='Identical video is already being processed...'):
+        """Make jobs wait for the result of the identical job ``leader_id``"""
+        if not job_ids:
+            return 0
+        updated = (cls.query.filter(cls.id.in_(job_ids))
+                   .update({'status': cls.WAITING_DUPLICATE, 'progress': 0, 'message': message,
+                            'duplicate_of': leader_id}, synchronize_session=False))
+        db.session.commit()
+        return updated
+    
+    @classmethod
+    def claim_next(cls, worker_id, lease_seconds=60):
+        """Atomically claim the oldest queued job for a worker.
+        
+        Uses SELECT ... FOR UPDATE SKIP LOCKED where the database supports it,
+        otherwise falls back to a compare-and-set UPDATE on the status column,
+        which is enough for SQLite's single-writer model.
+        """
+        now = datetime.utcnow()
+        lease = {
+            'status': 'claimed',
+            'message': f'Claimed by worker {worker_id}',
+            'worker_id': worker_id,
+            'heartbeat_at': now,
+            'lease_expires_at': now + timedelta(seconds=lease_seconds),
+            'attempts': cls.attempts + 1,
+        }
+        
+        if db.engine.dialect.name in ('postgresql', 'mysql', 'oracle'):
+            job = (cls.query.filter_by(status='queued')
+                   .order_by(cls.created_at)
+                   .with_for_update(skip_locked=True)
+                   .first())
+            if job is None:
+                db.session.commit()
+                return None
+            cls.query.filter_by(id=job.id).update(lease, synchronize_session=False)
+            db.session.commit()
+            return cls.query.get(job.id)
+        
+        # Compare-and-set fallback: the first worker whose UPDATE matches wins
+        candidates = (db.session.query(cls.id).filter_by(status='queued')
+                      .order_by(cls.created_at).limit(5).all())
+        for (job_id,) in candidates:
+            claimed = (cls.query.filter_by(id=job_id, status='queued')
+                       .update(lease, synchronize_session=False))
+            db.session.commit()
+            if claimed:
+                return cls.query.get(job_id)
+        return None
+    
+    @classmethod
+    def heartbeat(cls, job_id, worker_id, lease_seconds=60):
+        """Extend a worker's lease; returns False if the lease was lost"""
+        now = datetime.utcnow()
+        updated = (cls.query.filter_by(id=job_id, worker_id=worker_id)
+                   .update({'heartbeat_at': now,
+                            'lease_expires_at': now + timedelta(seconds=lease_seconds)},
+                           synchronize_session=False))
+        db.session.commit()
+        return updated == 1
+    
+    @classmethod
+    def release(cls, job_id, worker_id, **fields):
+        """Drop a worker's lease and store the job's final fields"""
+        fields.update({'worker_id': None, 'lease_expires_at': None})
+        updated = (cls.query.filter_by(id=job_id, worker_id=worker_id)
+                   .update(fields, synchronize_session=False))
+        db.session.commit()
+        return updated == 1
+    
+    @classmethod
+    def mark_for_resume(cls, job_id, expected_status, message, status='queued'):
+        """Compare-and-set a job back to ``status``; False if its status changed meanwhile
+        or an identical job took the lead in the meantime"""
+        try:
+            updated = (cls.query.filter_by(id=job_id, status=expected_status)
+                       .update({'status': status, 'progress': 0, 'message': message,
+                                'worker_id': None, 'lease_expires_at': None, 'completed_at': None},
+                               synchronize_session=False))
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            return False
+        return updated == 1
+    
+    @classmethod
+    def requeue_expired(cls, max_attempts=3):
+        """Put jobs whose worker stopped heartbeating back on the queue.
         
-        for job in old_jobs:
-            # Delete file logic could be implemented here
-            db.session.delete(job)
+        Jobs that already used up ``max_attempts`` are marked as errors instead
+        of being retried forever; the unfinished children of a multi-language
+        job follow their parent in the same transaction. Returns (requeued,
+        failed) counts.
+        """
+        now = datetime.utcnow()
+        expired = (cls.query.filter(cls.worker_id.isnot(None))
+                   .filter(cls.lease_expires_at < now)
+                   .filter(cls.status.notin_(cls.TERMINAL_STATUSES)))
+        failing = [job_id for (job_id,) in expired.filter(cls.attempts >= max_attempts).with_entities(cls.id)]
+        retrying = [job_id for (job_id,) in expired.filter(cls.attempts < max_attempts).with_entities(cls.id)]
         
+        def settle(ids, status, message, child_status, child_message):
+            if not ids:
+                return 0
+            updated = (expired.filter(cls.id.in_(ids))
+                       .update({'status': status, 'progress': 0, 'message': message,
+                                'worker_id': None, 'lease_expires_at': None},
+                               synchronize_session=False))
+            # Only children of parents updated above; a parent whose worker
+            # heartbeated meanwhile keeps its children
+            parents = (db.session.query(cls.id).filter(cls.id.in_(ids))
+                       .filter_by(status=status, worker_id=None))
+            (cls.query.filter(cls.parent_id.in_(parents.scalar_subquery()))
+             .filter(cls.status.notin_(cls.TERMINAL_STATUSES + (cls.WAITING_DUPLICATE,)))
+             .update({'status': child_status, 'progress': 0, 'message': child_message},
+                     synchronize_session=False))
+            return updated
+        
+        failed = settle(failing, 'error', 'Worker lost too many times, giving up',
+                        'error', 'Worker lost too many times, giving up')
+        requeued = settle(retrying, 'queued', 'Worker lost, waiting for another worker...',
+                          'waiting_parent', 'Waiting for shared transcription...')
         db.session.commit()
-        return len(old_jobs)
+        return requeued, failed
+    
+    @classmethod
+    def expired_ids(cls, cutoff, limit=500):
+        """Ids of finished jobs created before ``cutoff``, oldest first"""
+        rows = (db.session.query(cls.id)
+                .filter(cls.status.in_(cls.TERMINAL_STATUSES))
+                .filter(cls.created_at < cutoff)
+                .order_by(cls.created_at).limit(limit).all())
+        return [job_id for (job_id,) in rows]
+    
+    @classmethod
+    def least_recently_used_ids(cls, limit=100):
+        """Ids of finished jobs, least recently downloaded first"""
+        last_used = db.func.coalesce(cls.last_accessed_at, cls.completed_at, cls.created_at)
+        rows = (db.session.query(cls.id)
+                .filter(cls.status.in_(cls.TERMINAL_STATUSES))
+                .order_by(last_used).limit(limit).all())
+        return [job_id for (job_id,) in rows]
+    
+    @classmethod
+    def delete_ids(cls, ids):
+        """Delete jobs with one bulk DELETE"""
+        if not ids:
+            return 0
+        deleted = cls.query.filter(cls.id.in_(ids)).delete(synchronize_session=False)
+        db.session.commit()
+        return deleted
+    
+    @classmethod
+    def touch(cls, job_id):
+        """Record a download of a job's output"""
+        cls.query.filter_by(id=job_id).update({'last_accessed_at': datetime.utcnow()},
+                                              synchronize_session=False)
+        db.session.commit()
+    
+    @classmethod
+    def cleanup_old_jobs(cls, hours=24, batch_size=500):
+        """Delete finished jobs older than specified hours, in bulk batches.
+        
+        Only removes database rows; StorageJanitor also removes the files.
+        """
+        cutoff = datetime.utcnow() - timedelta(hours=hours)
+        deleted = 0
+        while True:
+            ids = cls.expired_ids(cutoff, batch_size)
+            deleted += cls.delete_ids(ids)
+            if len(ids) < batch_size:
+                return deleted
 
 class UserPreference(db.Model):
     __tablename__ = 'user_preferences'
@@ -73,4 +314,22 @@ class UserPreference(db.Model):
     updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
     
     def __repr__(self):
-        return f'<UserPreference {self.session_id}>'
\ No newline at end of file
+        return f'<UserPreference {self.session_id}>'
+    
+    @classmethod
+    def ensure(cls, session_id):
+        """A session's preferences, added with the defaults if it has none yet.
+        
+        Jobs reference their owner's row, so it must exist before they are
+        inserted. The caller commits.
+        """
+        prefs = cls.query.filter_by(session_id=session_id).first()
+        if prefs is None:
+            prefs = cls(session_id=session_id, preferred_language='en', theme='dark')
+            try:
+                with db.session.begin_nested():
+                    db.session.add(prefs)
+            except IntegrityError:
+                # Another request of the same session added it first
+                prefs = cls.query.filter_by(session_id=session_id).first()
+        return prefs
\ No newline at end of file
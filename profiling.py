@@ -0,0 +1,160 @@
+"""On-demand profiling of single jobs.
+
+A job is profiled when its upload asks for it (the ``profile`` form field)
+or when it is picked by sampling one in PROFILE_SAMPLE_RATE jobs. While it
+runs, a sampler thread records the stacks of every thread working for the
+job, and the pipeline records spans for its stages, ffmpeg runs, external
+service calls, status updates and checkpoint writes. When the job ends
+both are written to processed/<job_id>/profile/:
+
+- trace.json, the spans in Chrome trace event format (open it in
+  chrome://tracing or https://ui.perfetto.dev)
+- stacks.folded, the samples as folded stacks for flamegraph.pl or
+  https://www.speedscope.app
+
+Jobs that are not profiled create no profiler at all, so they pay nothing.
+"""
+import os
+import json
+import logging
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Profile one in this many jobs; 0 only profiles jobs that ask for it
+PROFILE_SAMPLE_RATE = int(os.environ.get('PROFILE_SAMPLE_RATE', '0'))
+PROFILE_INTERVAL = float(os.environ.get('PROFILE_INTERVAL_MS', '5')) / 1000
+# Spans kept per job, so a pathological job can't exhaust memory
+MAX_SPANS = 100000
+MAX_STACK_DEPTH = 64
+
+PROFILE_DIR = 'profile'
+TRACE_NAME = 'trace.json'
+STACKS_NAME = 'stacks.folded'
+ARTIFACTS = {TRACE_NAME: 'application/json', STACKS_NAME: 'text/plain; charset=utf-8'}
+
+
+def should_profile(requested=False, rate=PROFILE_SAMPLE_RATE):
+    """Whether to profile a job that did or did not ask for it"""
+    return bool(requested) or (rate > 0 and random.randrange(rate) == 0)
+
+
+def profile_dir(job_dir):
+    return os.path.join(job_dir, PROFILE_DIR)
+
+
+class JobProfiler:
+    """Span timeline and sampled stacks of one job.
+
+    The job's threads are recognised by their stacks: a sample is kept
+    when one of its frames is a method of an object registered with
+    ``add_owner`` (the job's processors), so helper threads and pools need
+    no instrumentation of their own.
+    """
+
+    def __init__(self, job_id, directory, interval=PROFILE_INTERVAL):
+        self.job_id = job_id
+        self.directory = directory
+        self.interval = interval
+        self.started = time.perf_counter()
+        self.started_at = time.time()
+        self.spans = []
+        self.dropped = 0
+        self.stacks = Counter()
+        self.samples = 0
+        self._owners = set()
+        self._thread_names = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._sampler = threading.Thread(target=self._sample_loop, name=f'profiler-{job_id[:8]}')
+        self._sampler.daemon = True
+
+    def add_owner(self, obj):
+        self._owners.add(id(obj))
+
+    def start(self):
+        self._sampler.start()
+        return self
+
+    @contextmanager
+    def span(self, name, category, **args):
+        """Record the time spent in a block as a span"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, category, started, time.perf_counter(), args)
+
+    def record(self, name, category, started, ended, args=None):
+        """Record a span measured with time.perf_counter()"""
+        thread = threading.current_thread()
+        event = {
+            'name': name, 'cat': category, 'ph': 'X', 'pid': os.getpid(), 'tid': thread.ident,
+            'ts': round((started - self.started) * 1e6), 'dur': round((ended - started) * 1e6),
+        }
+        if args:
+            event['args'] = args
+        with self._lock:
+            self._thread_names[thread.ident] = thread.name
+            if len(self.spans) < MAX_SPANS:
+                self.spans.append(event)
+            else:
+                self.dropped += 1
+
+    def _sample_loop(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident != own:
+                    self._sample(names.get(ident, str(ident)), frame)
+
+    def _sample(self, thread_name, frame):
+        stack = []
+        owned = False
+        while frame is not None and len(stack) < MAX_STACK_DEPTH:
+            code = frame.f_code
+            if not owned and code.co_argcount and code.co_varnames[0] == 'self':
+                owned = id(frame.f_locals.get('self')) in self._owners
+            stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+            frame = frame.f_back
+        if owned:
+            # Pool threads differ only by number; fold them together
+            stack.append(re.sub(r'[-_]\d+', '', thread_name))
+            self.stacks[';'.join(reversed(stack))] += 1
+            self.samples += 1
+
+    def finish(self):
+        """Stop sampling and write the artifacts; returns their paths"""
+        self._stop.set()
+        if self._sampler.is_alive():
+            self._sampler.join()
+        os.makedirs(self.directory, exist_ok=True)
+        with self._lock:
+            events = [{'name': 'thread_name', 'ph': 'M', 'pid': os.getpid(), 'tid': ident, 'args': {'name': name}}
+                      for ident, name in self._thread_names.items()]
+            events.extend(self.spans)
+        trace = {
+            'traceEvents': events,
+            'displayTimeUnit': 'ms',
+            'otherData': {'job_id': self.job_id, 'started_at': self.started_at, 'samples': self.samples,
+                          'sample_interval_ms': self.interval * 1000, 'dropped_spans': self.dropped},
+        }
+        paths = []
+        for name, content in ((TRACE_NAME, json.dumps(trace)),
+                              (STACKS_NAME, ''.join(f'{stack} {count}\n' for stack, count in
+                                                    self.stacks.most_common()))):
+            path = os.path.join(self.directory, name)
+            with open(path + '.part', 'w') as f:
+                f.write(content)
+            os.replace(path + '.part', path)
+            paths.append(path)
+        logger.info(f"Job {self.job_id}: profile written to {self.directory} "
+                    f"({len(self.spans)} spans, {self.samples} samples)")
+        return paths
@@ -0,0 +1,167 @@
+import os
+import logging
+import threading
+import itertools
+import queue
+import time
+from contextlib import contextmanager
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Default pool sizes, overridable through the environment
+DEFAULT_WORKERS = int(os.environ.get('WORKER_POOL_SIZE', '2'))
+DEFAULT_STAGE_LIMITS = {
+    # ffmpeg decode/encode is CPU and disk heavy
+    'ffmpeg': int(os.environ.get('FFMPEG_CONCURRENCY', '2')),
+    # Speech recognition, translation and TTS mostly wait on HTTP
+    'network': int(os.environ.get('NETWORK_CONCURRENCY', '4')),
+}
+
+
+class JobScheduler:
+    """Bounded worker pool that runs pipeline jobs from a priority queue.
+
+    Jobs with a lower priority value run first; jobs with the same priority
+    run in FIFO order. Individual pipeline stages can additionally be capped
+    with ``stage()`` so that, for example, only a few ffmpeg processes run at
+    the same time regardless of the pool size.
+    """
+
+    def __init__(self, max_workers=DEFAULT_WORKERS, stage_limits=None):
+        self.max_workers = max(1, max_workers)
+        self.stage_limits = dict(DEFAULT_STAGE_LIMITS)
+        self.stage_limits.update(stage_limits or {})
+        self._stage_semaphores = {
+            name: threading.BoundedSemaphore(max(1, limit))
+            for name, limit in self.stage_limits.items()
+        }
+        self._stage_active = {name: 0 for name in self.stage_limits}
+
+        self._queue = queue.PriorityQueue()
+        self._sequence = itertools.count()
+        self._lock = threading.Lock()
+        self._pending = {}   # job_id -> enqueue time, for jobs still waiting
+        self._running = {}   # job_id -> (enqueue time, start time)
+        self._waits = []     # recent queue wait times in seconds
+        self._threads = []
+        self._started = False
+
+    def start(self):
+        """Start the worker threads (idempotent)"""
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+            for i in range(self.max_workers):
+                thread = threading.Thread(target=self._worker_loop, name=f'job-worker-{i}')
+                thread.daemon = True
+                thread.start()
+                self._threads.append(thread)
+        logger.info(f"Job scheduler started with {self.max_workers} workers, stage limits {self.stage_limits}")
+
+    def submit(self, job_id, func, priority=0):
+        """Queue ``func`` to run for ``job_id`` and return its queue position"""
+        self.start()
+        enqueued_at = time.time()
+        with self._lock:
+            self._pending[job_id] = enqueued_at
+            self._queue.put((priority, next(self._sequence), job_id, func, enqueued_at))
+        return self.queue_position(job_id)
+
+    def _worker_loop(self):
+        while True:
+            priority, _, job_id, func, enqueued_at = self._queue.get()
+            started_at = time.time()
+            with self._lock:
+                self._pending.pop(job_id, None)
+                self._running[job_id] = (enqueued_at, started_at)
+                self._waits.append(started_at - enqueued_at)
+                del self._waits[:-100]
+            metrics.QUEUE_WAIT_SECONDS.observe(started_at - enqueued_at)
+            logger.debug(f"Job {job_id} started after waiting {started_at - enqueued_at:.2f}s")
+            try:
+                func()
+            except Exception as e:
+                logger.error(f"Job {job_id} failed in scheduler: {e}")
+            finally:
+                with self._lock:
+                    self._running.pop(job_id, None)
+                self._queue.task_done()
+
+    @contextmanager
+    def stage(self, name):
+        """Hold one of the concurrency slots for a pipeline stage class"""
+        semaphore = self._stage_semaphores.get(name)
+        if semaphore is None:
+            yield
+            return
+        semaphore.acquire()
+        with self._lock:
+            self._stage_active[name] += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._stage_active[name] -= 1
+            semaphore.release()
+
+    def queue_position(self, job_id):
+        """1-based position of a waiting job, or None if it is not queued"""
+        with self._lock:
+            enqueued_at = self._pending.get(job_id)
+            if enqueued_at is None:
+                return None
+            # PriorityQueue keeps its heap in ``queue``; order by (priority, seq)
+            ordered = sorted(entry[:3] for entry in list(self._queue.queue))
+        for position, (_, _, queued_id) in enumerate(ordered, start=1):
+            if queued_id == job_id:
+                return position
+        return None
+
+    def job_info(self, job_id):
+        """Scheduling details for a job, suitable for the status endpoint"""
+        now = time.time()
+        info = {'queue_depth': self.queue_depth()}
+        with self._lock:
+            if job_id in self._pending:
+                info['queue_wait'] = round(now - self._pending[job_id], 2)
+            elif job_id in self._running:
+                enqueued_at, started_at = self._running[job_id]
+                info['queue_wait'] = round(started_at - enqueued_at, 2)
+        position = self.queue_position(job_id)
+        if position is not None:
+            info['queue_position'] = position
+        return info
+
+    def queue_depth(self):
+        """Number of jobs waiting for a worker"""
+        with self._lock:
+            return len(self._pending)
+
+    def stats(self):
+        """Snapshot of pool utilisation"""
+        with self._lock:
+            waits = list(self._waits)
+            return {
+                'workers': self.max_workers,
+                'active_workers': len(self._running),
+                'queue_depth': len(self._pending),
+                'stage_active': dict(self._stage_active),
+                'stage_limits': dict(self.stage_limits),
+                'avg_queue_wait': round(sum(waits) / len(waits), 2) if waits else 0.0,
+            }
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler():
+    """Return the process-wide scheduler, creating it on first use"""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = JobScheduler()
+        return _scheduler
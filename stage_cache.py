@@ -0,0 +1,225 @@
+import os
+import logging
+import hashlib
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# Cache configuration, overridable through the environment
+CACHE_BACKEND = os.environ.get('CACHE_BACKEND', 'tiered')  # 'tiered', 'memory' or 'none'
+CACHE_DIR = os.environ.get('CACHE_DIR', 'cache')
+CACHE_MEMORY_ITEMS = int(os.environ.get('CACHE_MEMORY_ITEMS', '2048'))
+CACHE_MEMORY_BYTES = int(os.environ.get('CACHE_MEMORY_BYTES', str(64 * 1024 * 1024)))
+CACHE_DISK_BYTES = int(os.environ.get('CACHE_DISK_BYTES', str(1024 * 1024 * 1024)))
+CACHE_TTL_SECONDS = int(os.environ.get('CACHE_TTL_SECONDS', str(7 * 24 * 3600)))
+
+
+def make_key(*parts):
+    """Stable cache key from strings and bytes"""
+    digest = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, str):
+            part = part.encode('utf-8')
+        digest.update(len(part).to_bytes(8, 'big'))
+        digest.update(part)
+    return digest.hexdigest()
+
+
+class MemoryBackend:
+    """In-process LRU bounded by entry count and total bytes"""
+
+    def __init__(self, max_items=CACHE_MEMORY_ITEMS, max_bytes=CACHE_MEMORY_BYTES, ttl=CACHE_TTL_SECONDS):
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (value, expires_at)
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at < time.time():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        if len(value) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, time.time() + self.ttl)
+            self._bytes += len(value)
+            while len(self._entries) > self.max_items or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+
+    def _remove(self, key):
+        value, _ = self._entries.pop(key)
+        self._bytes -= len(value)
+
+
+class DiskBackend:
+    """Files under ``root`` with TTL expiry and LRU eviction by access time.
+
+    Writes go through a temporary file and ``os.replace`` so several
+    processes can share one cache directory.
+    """
+
+    def __init__(self, root, max_bytes=CACHE_DISK_BYTES, ttl=CACHE_TTL_SECONDS):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+        self._bytes = sum(size for _, _, size in self._scan())
+
+    def _path(self, key):
+        return os.path.join(self.root, key[:2], key)
+
+    def _scan(self):
+        for dirpath, _, filenames in os.walk(self.root):
+            for name in filenames:
+                path = os.path.join(dirpath, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                yield path, stat.st_atime, stat.st_size
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            stat = os.stat(path)
+            if stat.st_mtime + self.ttl < time.time():
+                self._delete(path, stat.st_size)
+                return None
+            with open(path, 'rb') as f:
+                value = f.read()
+            # Record the access for LRU eviction, keeping the write time for TTL
+            os.utime(path, (time.time(), stat.st_mtime))
+            return value
+        except FileNotFoundError:
+            return None
+
+    def set(self, key, value):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(value)
+        os.replace(tmp_path, path)
+        with self._lock:
+            self._bytes += len(value)
+            over_budget = self._bytes > self.max_bytes
+        if over_budget:
+            self.evict()
+
+    def _delete(self, path, size):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            return
+        with self._lock:
+            self._bytes -= size
+
+    def evict(self):
+        """Delete least recently used entries until under 90% of the budget"""
+        entries = sorted(self._scan(), key=lambda entry: entry[1])
+        with self._lock:
+            self._bytes = sum(size for _, _, size in entries)
+        target = self.max_bytes * 0.9
+        removed = 0
+        for path, _, size in entries:
+            if self._bytes <= target:
+                break
+            self._delete(path, size)
+            removed += 1
+        if removed:
+            logger.debug(f"Evicted {removed} entries from {self.root}")
+
+
+class StageCache:
+    """One cache namespace with an in-memory front and optional disk backing"""
+
+    def __init__(self, namespace, backends):
+        self.namespace = namespace
+        self.backends = backends
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        for level, backend in enumerate(self.backends):
+            try:
+                value = backend.get(key)
+            except OSError as e:
+                logger.warning(f"Cache {self.namespace} read failed: {e}")
+                value = None
+            if value is not None:
+                # Promote into the faster levels
+                for faster in self.backends[:level]:
+                    faster.set(key, value)
+                with self._lock:
+                    self.hits += 1
+                return value
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def set(self, key, value):
+        for backend in self.backends:
+            try:
+                backend.set(key, value)
+            except OSError as e:
+                logger.warning(f"Cache {self.namespace} write failed: {e}")
+
+    def get_text(self, key):
+        value = self.get(key)
+        return value.decode('utf-8') if value is not None else None
+
+    def set_text(self, key, text):
+        self.set(key, text.encode('utf-8'))
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / total, 3) if total else 0.0,
+            }
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_cache(namespace):
+    """Return the process-wide cache for a namespace ('asr', 'translation', 'tts')"""
+    with _caches_lock:
+        cache = _caches.get(namespace)
+        if cache is None:
+            if CACHE_BACKEND == 'none':
+                backends = []
+            elif CACHE_BACKEND == 'memory':
+                backends = [MemoryBackend()]
+            else:
+                backends = [MemoryBackend(), DiskBackend(os.path.join(CACHE_DIR, namespace))]
+            cache = _caches[namespace] = StageCache(namespace, backends)
+        return cache
+
+
+def cache_stats():
+    """Hit/miss counters for every namespace created so far"""
+    with _caches_lock:
+        caches = dict(_caches)
+    return {namespace: cache.stats() for namespace, cache in caches.items()}
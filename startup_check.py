@@ -0,0 +1,118 @@
+"""Measure how long the web app takes to start, and what it imports.
+
+Each run imports app.py in a fresh interpreter with ``-X importtime`` and
+serves one request, then reports the import time, the time to the first
+response, peak RSS and the slowest imports. Use it in CI to catch startup
+regressions:
+
+    python startup_check.py --runs 5 --budget 1.5
+
+Exits with status 1 if the median import time exceeds ``--budget`` seconds
+or if the web tier imported any of the pipeline modules, which should only
+load in processes that run jobs.
+"""
+import os
+import sys
+import argparse
+import json
+import statistics
+import subprocess
+import tempfile
+
+# Modules that must not be loaded just by importing the web app
+PIPELINE_MODULES = ('video_processor', 'streaming', 'audio_chunker', 'backends', 'checkpoint',
+                    'async_engine', 'numpy', 'speech_recognition', 'googletrans', 'gtts', 'pocketsphinx')
+
+# Run in the child interpreter; prints one JSON line with its measurements
+PROBE = '''
+import json, resource, sys, time
+started = time.perf_counter()
+import app
+imported = time.perf_counter()
+client = app.app.test_client()
+status = client.get('/metrics').status_code
+served = time.perf_counter()
+print(json.dumps({
+    'import_seconds': imported - started,
+    'first_request_seconds': served - imported,
+    'status': status,
+    'max_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    'pipeline_modules': sorted(name for name in %r if name in sys.modules),
+}))
+''' % (PIPELINE_MODULES,)
+
+
+def parse_importtime(stderr):
+    """(cumulative microseconds, module) for each line of -X importtime output"""
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        imports.append((int(cumulative), name.strip()))
+    return imports
+
+
+def measure_once():
+    env = dict(os.environ)
+    # Importing the app needs a database URL but not a database
+    env.setdefault('DATABASE_URL', 'sqlite://')
+    env['RESUME_INTERRUPTED_JOBS'] = '0'
+    env['JANITOR_INTERVAL'] = '0'
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [os.path.dirname(os.path.abspath(__file__)),
+                                                      env.get('PYTHONPATH')]))
+    # The app creates its upload folders on import; keep them out of the tree
+    with tempfile.TemporaryDirectory() as workdir:
+        env['STATUS_TABLE_PATH'] = os.path.join(workdir, 'status-table')
+        process = subprocess.run([sys.executable, '-X', 'importtime', '-c', PROBE],
+                                 cwd=workdir, capture_output=True, text=True, env=env)
+    if process.returncode != 0:
+        raise RuntimeError(f'Importing the app failed:\n{process.stderr[-2000:]}')
+    result = json.loads(process.stdout.strip().splitlines()[-1])
+    result['imports'] = parse_importtime(process.stderr)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure web app import and startup time')
+    parser.add_argument('--runs', type=int, default=3, help='fresh interpreters to measure')
+    parser.add_argument('--budget', type=float, default=0, help='fail if the median import exceeds this many seconds')
+    parser.add_argument('--top', type=int, default=15, help='slowest top-level imports to list')
+    parser.add_argument('--json', action='store_true', help='print the results as JSON')
+    args = parser.parse_args()
+
+    runs = [measure_once() for _ in range(max(1, args.runs))]
+    summary = {
+        'runs': len(runs),
+        'import_seconds': round(statistics.median(run['import_seconds'] for run in runs), 4),
+        'first_request_seconds': round(statistics.median(run['first_request_seconds'] for run in runs), 4),
+        'max_rss_mb': round(max(run['max_rss_kb'] for run in runs) / 1024, 1),
+        'pipeline_modules': runs[-1]['pipeline_modules'],
+        'slowest_imports': [
+            {'module': name, 'ms': round(cumulative / 1000, 1)}
+            for cumulative, name in sorted(runs[-1]['imports'], reverse=True)
+            if '.' not in name
+        ][:args.top],
+    }
+
+    if args.json:
+        print(json.dumps(summary, indent=2))
+    else:
+        print(f"import: {summary['import_seconds'] * 1000:.0f} ms, "
+              f"first request: {summary['first_request_seconds'] * 1000:.0f} ms, "
+              f"max RSS: {summary['max_rss_mb']} MB (median of {summary['runs']} runs)")
+        for entry in summary['slowest_imports']:
+            print(f"  {entry['ms']:8.1f} ms  {entry['module']}")
+
+    failed = False
+    if summary['pipeline_modules']:
+        print(f"FAIL: the web app imported pipeline modules: {', '.join(summary['pipeline_modules'])}")
+        failed = True
+    if args.budget and summary['import_seconds'] > args.budget:
+        print(f"FAIL: import took {summary['import_seconds']:.3f}s, over the {args.budget}s budget")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -7,14 +7,16 @@ document.addEventListener('DOMContentLoaded', function() {
     const statusMessage = document.getElementById('statusMessage');
     const statusPercentage = document.getElementById('statusPercentage');
     const downloadBtn = document.getElementById('downloadBtn');
+    const previewBtn = document.getElementById('previewBtn');
     const videoInput = document.getElementById('video');
     const langSelect = document.getElementById('target_language');
 
-    // Current job ID and polling interval
+    // Current job ID and status subscription
     let currentJobId = null;
-    let pollingInterval = null;
-    let pollAttempts = 0;
-    const MAX_POLL_ATTEMPTS = 150; // 5 minutes (2s interval * 150)
+    let statusSource = null;
+    let statusFinished = false;
+    let failedRequests = 0;
+    const LONG_POLL_SECONDS = 25;
 
     // Form validation with additional checks
     uploadForm.addEventListener('submit', function(event) {
@@ -147,7 +149,7 @@ document.addEventListener('DOMContentLoaded', function() {
                         
                         // Start polling for job status
                         updateProgress(20, 'Upload complete. Starting processing...');
-                        startPolling(currentJobId);
+                        watchJobStatus(currentJobId);
                     } else {
                         // Handle error from server
                         showError(data.message || 'Error uploading video');
@@ -171,35 +173,55 @@ document.addEventListener('DOMContentLoaded', function() {
         xhr.send(formData);
     }
 
-    // Function to start polling for job status
-    function startPolling(jobId) {
-        // Reset poll attempts
-        pollAttempts = 0;
-        
-        // Clear any existing interval
-        if (pollingInterval) {
-            clearInterval(pollingInterval);
+    // Function to follow job status: Server-Sent Events, with long-polling
+    // as a fallback for browsers or proxies that can't keep a stream open
+    function watchJobStatus(jobId) {
+        statusFinished = false;
+        previewBtn.style.display = 'none';
+        failedRequests = 0;
+        
+        // Close any existing stream
+        if (statusSource) {
+            statusSource.close();
+            statusSource = null;
         }
         
-        // Set polling interval (check every 2 seconds)
-        pollingInterval = setInterval(() => {
-            pollAttempts++;
-            
-            // Stop polling after MAX_POLL_ATTEMPTS
-            if (pollAttempts > MAX_POLL_ATTEMPTS) {
-                clearInterval(pollingInterval);
-                showError('Processing is taking too long. Please try again with a shorter video.');
-                resetForm();
-                return;
+        if (!window.EventSource) {
+            longPollJobStatus(jobId, 0);
+            return;
+        }
+        
+        let received = false;
+        statusSource = new EventSource(`/status/${jobId}/stream`);
+        
+        statusSource.onmessage = function(event) {
+            received = true;
+            handleJobStatus(jobId, JSON.parse(event.data));
+            if (statusFinished) {
+                statusSource.close();
+                statusSource = null;
             }
-            
-            checkJobStatus(jobId);
-        }, 2000);
+        };
+        
+        statusSource.onerror = function() {
+            // The browser reconnects on its own once a stream has worked;
+            // otherwise switch to long-polling
+            if (!received && statusSource) {
+                statusSource.close();
+                statusSource = null;
+                longPollJobStatus(jobId, 0);
+            }
+        };
     }
 
-    // Function to check job status
-    function checkJobStatus(jobId) {
-        fetch(`/status/${jobId}`)
+    // Function to long-poll job status; the server answers as soon as the
+    // job moves past the version we already have
+    function longPollJobStatus(jobId, since) {
+        if (statusFinished) {
+            return;
+        }
+        
+        fetch(`/status/${jobId}?wait=${LONG_POLL_SECONDS}&since=${since}`)
             .then(response => {
                 if (!response.ok) {
                     throw new Error('Failed to get job status');
@@ -207,54 +229,72 @@ document.addEventListener('DOMContentLoaded', function() {
                 return response.json();
             })
             .then(data => {
-                // Update progress UI
-                updateProgress(data.progress, data.message);
-                
-                // Check if job is complete or has error
-                if (data.status === 'completed') {
-                    // Stop polling
-                    clearInterval(pollingInterval);
-                    
-                    // Enable download button with animation
-                    downloadBtn.style.display = 'block';
-                    downloadBtn.href = `/download/${jobId}`;
-                    
-                    // Update progress to 100%
-                    updateProgress(100, 'Processing completed successfully!');
-                    
-                    // Reset upload button
-                    resetForm(false);
-                    
-                    // Show success message
-                    showAlert('<strong>Success!</strong> Your video has been dubbed. Click the download button to get your file.', 'success');
-                    
-                    // Scroll to download button
-                    window.scrollTo({
-                        top: downloadBtn.offsetTop - 100,
-                        behavior: 'smooth'
-                    });
-                } else if (data.status === 'error') {
-                    // Stop polling
-                    clearInterval(pollingInterval);
-                    
-                    // Show error
-                    showError(data.message || 'An error occurred during processing');
-                    
-                    // Reset form
-                    resetForm();
-                }
+                failedRequests = 0;
+                handleJobStatus(jobId, data);
+                longPollJobStatus(jobId, data.version || 0);
             })
             .catch(error => {
                 console.error('Error checking job status:', error);
-                pollAttempts++; // Count errors toward max attempts
+                failedRequests++;
                 
                 // After 5 failed attempts in a row, show a warning
-                if (pollAttempts % 5 === 0) {
+                if (failedRequests % 5 === 0) {
                     showAlert('Having trouble connecting to the server. Still trying...', 'warning', false);
                 }
+                
+                // Back off before retrying
+                setTimeout(() => longPollJobStatus(jobId, since), Math.min(2000 * failedRequests, 30000));
             });
     }
 
+    // Function to apply a job status update to the UI
+    function handleJobStatus(jobId, data) {
+        if (statusFinished) {
+            return;
+        }
+        
+        // Update progress UI
+        updateProgress(data.progress, data.message);
+        
+        // Streaming jobs can be watched before they finish
+        if (data.preview_url && previewBtn.style.display === 'none') {
+            previewBtn.href = data.preview_url;
+            previewBtn.style.display = 'block';
+        }
+        
+        // Check if job is complete or has error
+        if (data.status === 'completed') {
+            statusFinished = true;
+            
+            // Enable download button with animation
+            downloadBtn.style.display = 'block';
+            downloadBtn.href = `/download/${jobId}`;
+            
+            // Update progress to 100%
+            updateProgress(100, 'Processing completed successfully!');
+            
+            // Reset upload button
+            resetForm(false);
+            
+            // Show success message
+            showAlert('<strong>Success!</strong> Your video has been dubbed. Click the download button to get your file.', 'success');
+            
+            // Scroll to download button
+            window.scrollTo({
+                top: downloadBtn.offsetTop - 100,
+                behavior: 'smooth'
+            });
+        } else if (data.status === 'error') {
+            statusFinished = true;
+            
+            // Show error
+            showError(data.message || 'An error occurred during processing');
+            
+            // Reset form
+            resetForm();
+        }
+    }
+
     // Function to update progress UI
     function updateProgress(percent, message) {
         // Ensure percent is a number between 0 and 100
@@ -309,6 +349,7 @@ document.addEventListener('DOMContentLoaded', function() {
                 // Reset progress bar and status
                 updateProgress(0, 'Uploading video...');
                 downloadBtn.style.display = 'none';
+                previewBtn.style.display = 'none';
             }, 500);
         }
     }
@@ -0,0 +1,288 @@
+"""Job status shared by every process on a host through a memory-mapped table.
+
+Under gunicorn each worker process has its own JobRegistry, so a status
+request served by another process than the one running the job used to
+see only the database row, up to a flush interval old and without the
+live details. Every registry update is now also written to a fixed-size
+table in a memory-mapped file (STATUS_TABLE_PATH, under /dev/shm by
+default) that all processes of the deployment map. Each entry carries a
+version that increases with every update of its job, so any process can
+tell whether its own copy is stale and long-polls are numbered alike
+whichever process answers them. Versions come from one counter for the
+whole table, so they keep increasing when a job's slot is reused.
+
+Reads take no lock: a slot is guarded by a sequence number that is odd
+while the slot is being written, and readers retry until they see the
+same even number before and after copying it. Writers serialise on an
+flock of the file. Jobs hash to a slot and probe the next few slots; when
+they are all taken, the entry of a finished job (or else the oldest one)
+is overwritten, and readers of the lost job fall back to the database.
+"""
+import os
+import json
+import logging
+import mmap
+import struct
+import tempfile
+import threading
+import time
+import zlib
+
+try:
+    import fcntl
+except ImportError:  # Windows: every process keeps its own status
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# 'off' keeps status per process, as before
+STATUS_TABLE = os.environ.get('STATUS_TABLE', 'on')
+STATUS_TABLE_SLOTS = int(os.environ.get('STATUS_TABLE_SLOTS', '4096'))
+# How often processes check the table for jobs their clients are waiting on
+STATUS_WATCH_INTERVAL = float(os.environ.get('STATUS_WATCH_INTERVAL_MS', '50')) / 1000
+
+MAGIC = b'VVSTAT01'
+FILE_HEADER = struct.Struct('<8sI')
+FILE_HEADER_SIZE = 64
+# Last version handed out, in the file header after the magic and size
+COUNTER = struct.Struct('<Q')
+COUNTER_OFFSET = 16
+SLOT_SIZE = 1024
+KEY_SIZE = 48
+# seq, version, updated_at, payload length, job id
+SLOT_HEADER = struct.Struct(f'<QQdH{KEY_SIZE}s')
+SEQ = struct.Struct('<Q')
+PAYLOAD_SIZE = SLOT_SIZE - SLOT_HEADER.size
+PROBES = 16
+READ_ATTEMPTS = 100
+# Job id of a slot whose job was deleted; writers may reuse it
+TOMBSTONE = b'\x01'
+
+TERMINAL_STATUSES = ('completed', 'error')
+# Fields shared with other processes; status requests need nothing else
+SHARED_FIELDS = ('id', 'status', 'progress', 'message', 'filename', 'target_language', 'original_path',
+                 'output_path', 'file_size', 'created_at', 'duration', 'duplicate_of', 'parent_id',
+                 'children', 'preview_path', 'timings')
+# Dropped in this order when an entry does not fit in a slot
+OPTIONAL_FIELDS = ('timings', 'original_path', 'children')
+
+
+def default_path():
+    """Table file for the deployment in the current directory"""
+    directory = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+    return os.path.join(directory, f'videoverse-status-{zlib.crc32(os.getcwd().encode()):08x}')
+
+
+class StatusTable:
+    """Fixed-size table of job states in a file mapped by every process"""
+
+    def __init__(self, path=None, slots=STATUS_TABLE_SLOTS):
+        self.path = path or os.environ.get('STATUS_TABLE_PATH') or default_path()
+        self._lock = threading.Lock()
+        self._pid = None
+        self._fd = None
+        self._watcher = None
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            header = os.pread(fd, FILE_HEADER.size, 0)
+            if len(header) == FILE_HEADER.size and header[:len(MAGIC)] == MAGIC:
+                # The first process sized the table; later ones adopt it
+                slots = FILE_HEADER.unpack(header)[1]
+            else:
+                os.ftruncate(fd, FILE_HEADER_SIZE + slots * SLOT_SIZE)
+                os.pwrite(fd, FILE_HEADER.pack(MAGIC, slots), 0)
+            self.slots = slots
+            self.map = mmap.mmap(fd, FILE_HEADER_SIZE + slots * SLOT_SIZE)
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+
+    def _lock_fd(self):
+        # flock locks belong to an open file, which forked children would
+        # share with their parent, so each process opens its own
+        if self._pid != os.getpid():
+            self._fd = os.open(self.path, os.O_RDWR)
+            self._pid = os.getpid()
+        return self._fd
+
+    def _offset(self, index):
+        return FILE_HEADER_SIZE + index * SLOT_SIZE
+
+    def _probe(self, key):
+        start = zlib.crc32(key) % self.slots
+        for i in range(min(PROBES, self.slots)):
+            yield (start + i) % self.slots
+
+    def _read(self, index, with_payload=True):
+        """(version, updated_at, job id, payload) of a consistent copy of a slot"""
+        offset = self._offset(index)
+        for _ in range(READ_ATTEMPTS):
+            seq, version, updated_at, length, key = SLOT_HEADER.unpack_from(self.map, offset)
+            if seq & 1:
+                continue
+            payload = (self.map[offset + SLOT_HEADER.size:offset + SLOT_HEADER.size + length]
+                       if with_payload else None)
+            if SEQ.unpack_from(self.map, offset)[0] == seq:
+                return version, updated_at, key.rstrip(b'\0'), payload
+        return None
+
+    def _find(self, key, with_payload=True):
+        for index in self._probe(key):
+            slot = self._read(index, with_payload)
+            if slot is None or not slot[2]:
+                # A slot being written, or the end of the probe chain
+                return None
+            if slot[2] == key:
+                return slot
+        return None
+
+    def version(self, job_id):
+        """Version of a job's shared state, 0 if it isn't in the table"""
+        slot = self._find(job_id.encode(), with_payload=False)
+        return slot[0] if slot else 0
+
+    def get(self, job_id, newer_than=0):
+        """(version, state) of a job if its shared version exceeds ``newer_than``"""
+        slot = self._find(job_id.encode())
+        if slot is None or slot[0] <= newer_than:
+            return None
+        try:
+            return slot[0], json.loads(slot[3])
+        except ValueError:
+            return None
+
+    def put(self, job_id, data):
+        """Publish a job's state to every process; returns its new version"""
+        key = job_id.encode()
+        if len(key) > KEY_SIZE:
+            return None
+        payload = self._encode(data)
+        with self._lock:
+            fd = self._lock_fd()
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                index, current = self._claim(key)
+                version = self._next_version(current)
+                self._write(index, version, key, payload)
+                return version
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+
+    def discard(self, job_id):
+        """Remove a deleted job, keeping the probe chain of its slot intact"""
+        key = job_id.encode()
+        with self._lock:
+            fd = self._lock_fd()
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                for index in self._probe(key):
+                    slot = self._read(index, with_payload=False)
+                    if slot and slot[2] == key:
+                        self._write(index, self._next_version(slot[0]), TOMBSTONE, b'')
+                        return
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+
+    def _next_version(self, current):
+        """Advance the table's version counter; the caller holds the file lock"""
+        # Never below a slot's version, e.g. in a table written before the
+        # counter existed
+        version = max(COUNTER.unpack_from(self.map, COUNTER_OFFSET)[0], current) + 1
+        COUNTER.pack_into(self.map, COUNTER_OFFSET, version)
+        return version
+
+    def _claim(self, key):
+        """(slot index, version currently in it) for a job's next write"""
+        # Caller holds the file lock, so slots only change under our feet
+        # if another process ignores it
+        victim = free = None
+        for index in self._probe(key):
+            version, updated_at, slot_key, payload = self._read(index)
+            if slot_key == key:
+                return index, version
+            if not slot_key:
+                # Nothing was ever stored past an empty slot
+                return (index if free is None else free), 0
+            if slot_key == TOMBSTONE:
+                if free is None:
+                    free = (index, version)
+                continue
+            try:
+                finished = json.loads(payload).get('status') in TERMINAL_STATUSES
+            except ValueError:
+                finished = True
+            rank = (not finished, updated_at)
+            if victim is None or rank < victim[0]:
+                victim = (rank, index, version)
+        if free is not None:
+            return free
+        logger.debug(f"Status table is crowded; overwriting slot {victim[1]}")
+        return victim[1], victim[2]
+
+    def _write(self, index, version, key, payload):
+        offset = self._offset(index)
+        seq = SEQ.unpack_from(self.map, offset)[0]
+        SEQ.pack_into(self.map, offset, seq + 1)
+        self.map[offset + SLOT_HEADER.size:offset + SLOT_HEADER.size + len(payload)] = payload
+        SLOT_HEADER.pack_into(self.map, offset, seq + 1, version, time.time(), len(payload), key)
+        SEQ.pack_into(self.map, offset, seq + 2)
+
+    def _encode(self, data):
+        shared = {name: data[name] for name in SHARED_FIELDS if data.get(name) is not None}
+        payload = json.dumps(shared, default=str).encode('utf-8')
+        for name in OPTIONAL_FIELDS:
+            if len(payload) <= PAYLOAD_SIZE:
+                break
+            shared.pop(name, None)
+            payload = json.dumps(shared, default=str).encode('utf-8')
+        if len(payload) > PAYLOAD_SIZE:
+            shared['message'] = (shared.get('message') or '')[:255]
+            shared['filename'] = (shared.get('filename') or '')[:255]
+            payload = json.dumps(shared, default=str).encode('utf-8')
+        return payload[:PAYLOAD_SIZE]
+
+    def watch(self, hub, interval=STATUS_WATCH_INTERVAL):
+        """Wake this process's status subscribers when other processes update
+        the jobs they wait on (idempotent)"""
+        with self._lock:
+            if self._watcher is not None and self._watcher.is_alive():
+                return
+            self._watcher = threading.Thread(target=self._watch_loop, args=(hub, interval),
+                                             name='status-table-watcher')
+            self._watcher.daemon = True
+            self._watcher.start()
+
+    def _watch_loop(self, hub, interval):
+        while True:
+            time.sleep(interval)
+            try:
+                for job_id, version in hub.watched().items():
+                    shared = self.get(job_id, newer_than=version)
+                    if shared is not None:
+                        hub.publish(job_id, shared[1], version=shared[0])
+            except Exception as e:
+                logger.error(f"Status table watcher failed: {e}")
+
+
+_table = None
+_table_lock = threading.Lock()
+_table_failed = False
+
+
+def get_status_table():
+    """Return the host-wide status table, or None if it is disabled or unavailable"""
+    global _table, _table_failed
+    if _table is not None or _table_failed:
+        return _table
+    with _table_lock:
+        if _table is None and not _table_failed:
+            if STATUS_TABLE == 'off' or fcntl is None:
+                _table_failed = True
+            else:
+                try:
+                    _table = StatusTable()
+                except OSError as e:
+                    logger.warning(f"Shared status table unavailable, status stays per process: {e}")
+                    _table_failed = True
+        return _table
@@ -0,0 +1,261 @@
+"""Progressive dubbing that publishes an HLS preview while the job runs.
+
+Silence-delimited audio segments flow through speech recognition,
+translation, speech synthesis and muxing as a chain of background stages,
+so different segments are in different stages at the same time. Each
+finished segment is appended to processed/<job_id>/hls/index.m3u8, which
+players can start on as soon as the first segment is listed. When every
+segment is done, the per-segment speech is joined and merged with the
+original video as in the batch pipeline, so the download is unchanged.
+"""
+import os
+import logging
+import math
+import queue
+import shutil
+import subprocess
+import threading
+import time
+import wave
+from collections import namedtuple
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from audio_chunker import MAX_SEGMENT_SECONDS
+from backends import silence_wav
+from video_processor import TRANSCRIBE_FANOUT
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Segments translated, synthesized and encoded at once per job
+STREAM_STAGE_WORKERS = int(os.environ.get('STREAM_STAGE_WORKERS', '2'))
+# Finished items a stage may hold before it waits for the next one
+STREAM_QUEUE_DEPTH = int(os.environ.get('STREAM_QUEUE_DEPTH', '4'))
+
+PLAYLIST_NAME = 'index.m3u8'
+# Sample rate of the per-segment speech tracks
+SPEECH_SAMPLE_RATE = 24000
+
+# A segment's way through the pipeline; fields are filled in stage by stage
+StreamItem = namedtuple('StreamItem', 'segment text translation audio_path media_path')
+
+
+def pipeline_stage(func, items, workers=1, depth=STREAM_QUEUE_DEPTH, name='stage'):
+    """Yield ``func(item)`` for each of ``items``, in order, computed in the background.
+
+    A feeder thread pulls ``items`` and submits them to ``workers`` threads
+    while the caller consumes earlier results, so chained stages overlap.
+    At most ``depth`` results wait to be consumed; the feeder blocks beyond
+    that. The first error is raised to the caller in item order.
+    """
+    results = queue.Queue(maxsize=max(1, depth))
+    executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix=name)
+    stop = threading.Event()
+
+    def feed():
+        try:
+            for item in items:
+                if stop.is_set():
+                    break
+                results.put(executor.submit(func, item))
+        except BaseException as e:
+            # Includes JobAbandoned, which must reach the caller too
+            failed = Future()
+            failed.set_exception(e)
+            results.put(failed)
+        finally:
+            # Stop the upstream stage too when this one is abandoned
+            close = getattr(items, 'close', None)
+            if close is not None and stop.is_set():
+                close()
+            results.put(None)
+
+    threading.Thread(target=feed, name=f'{name}-feed', daemon=True).start()
+    finished = False
+    try:
+        while True:
+            future = results.get()
+            if future is None:
+                finished = True
+                return
+            yield future.result()
+    finally:
+        if not finished:
+            stop.set()
+            # Unblock the feeder and let it finish its current item
+            while results.get() is not None:
+                pass
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+class HLSPlaylist:
+    """An EVENT playlist that only ever grows, rewritten atomically"""
+
+    def __init__(self, directory, target_duration=MAX_SEGMENT_SECONDS):
+        self.directory = directory
+        self.path = os.path.join(directory, PLAYLIST_NAME)
+        self.target_duration = math.ceil(target_duration)
+        self.entries = []  # (duration, filename)
+        self.ended = False
+        os.makedirs(directory, exist_ok=True)
+        self.write()
+
+    def append(self, duration, filename):
+        self.entries.append((duration, filename))
+        self.write()
+
+    def end(self):
+        self.ended = True
+        self.write()
+
+    def write(self):
+        lines = ['#EXTM3U', '#EXT-X-VERSION:3', '#EXT-X-PLAYLIST-TYPE:EVENT',
+                 f'#EXT-X-TARGETDURATION:{self.target_duration}', '#EXT-X-MEDIA-SEQUENCE:0']
+        for duration, filename in self.entries:
+            lines += [f'#EXTINF:{duration:.3f},', filename]
+        if self.ended:
+            lines.append('#EXT-X-ENDLIST')
+        partial = self.path + '.part'
+        with open(partial, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        # Players polling the playlist never see a half-written file
+        os.replace(partial, self.path)
+
+
+class StreamingDubber:
+    """Runs a VideoProcessor's stages segment by segment"""
+
+    def __init__(self, processor, workers=STREAM_STAGE_WORKERS):
+        self.processor = processor
+        self.workers = workers
+        self.job_dir = os.path.dirname(processor.audio_path)
+        self.hls_dir = os.path.join(self.job_dir, 'hls')
+        self.segment_dir = os.path.join(self.job_dir, 'segments')
+        self.playlist = None
+
+    def observe(self, stage, started):
+        metrics.STAGE_SECONDS.observe(time.perf_counter() - started, stage=stage)
+
+    def transcribe(self, item):
+        started = time.perf_counter()
+        text = self.processor.transcribe_segment(item.segment, self.source_lang).strip()
+        self.observe('stream_transcribe', started)
+        return item._replace(text=text)
+
+    def translate(self, item):
+        if not item.text:
+            return item._replace(translation='')
+        started = time.perf_counter()
+        translation = self.processor.translate_pieces([item.text])[0] or ''
+        self.observe('stream_translate', started)
+        return item._replace(translation=translation)
+
+    def synthesize(self, item):
+        """Speech for a segment, padded or cut to the segment's length"""
+        segment = item.segment
+        duration = segment.end - segment.start
+        audio_path = os.path.join(self.segment_dir, f'speech_{segment.index:05d}.wav')
+        started = time.perf_counter()
+        if not item.translation:
+            with open(audio_path, 'wb') as f:
+                f.write(silence_wav(duration, SPEECH_SAMPLE_RATE))
+            return item._replace(audio_path=audio_path)
+
+        clip = self.processor.synthesize(item.translation)
+        clip_path = os.path.join(self.segment_dir, f'speech_{segment.index:05d}.clip')
+        with open(clip_path, 'wb') as f:
+            f.write(clip)
+        command = [
+            'ffmpeg', '-nostdin', '-loglevel', 'error', '-i', clip_path,
+            '-af', 'apad', '-t', f'{duration:.3f}',
+            '-ar', str(SPEECH_SAMPLE_RATE), '-ac', '1', '-acodec', 'pcm_s16le',
+            audio_path, '-y'
+        ]
+        with self.processor.stage_slot('ffmpeg'), self.processor.span('ffmpeg', 'subprocess'):
+            subprocess.run(command, check=True, capture_output=True)
+        os.remove(clip_path)
+        self.observe('stream_synthesize', started)
+        return item._replace(audio_path=audio_path)
+
+    def mux(self, item):
+        """Encode the segment's slice of the video with its speech as an MPEG-TS file"""
+        segment = item.segment
+        media_name = f'segment_{segment.index:05d}.ts'
+        media_path = os.path.join(self.hls_dir, media_name)
+        started = time.perf_counter()
+        # Cuts fall between keyframes, so the slice is re-encoded; timestamps
+        # keep their place in the source so segments play back to back
+        command = [
+            'ffmpeg', '-nostdin', '-loglevel', 'error',
+            '-ss', f'{segment.start:.3f}', '-i', self.processor.video_path,
+            '-i', item.audio_path,
+            '-map', '0:v:0', '-map', '1:a:0', '-t', f'{segment.end - segment.start:.3f}',
+            '-c:v', 'libx264', '-preset', 'veryfast', '-c:a', 'aac',
+            '-output_ts_offset', f'{segment.start:.3f}', '-f', 'mpegts',
+            media_path, '-y'
+        ]
+        with self.processor.stage_slot('ffmpeg'), self.processor.span('ffmpeg', 'subprocess'):
+            subprocess.run(command, check=True, capture_output=True)
+        self.processor.count_bytes('stream_mux', 'out', os.path.getsize(media_path))
+        self.observe('stream_mux', started)
+        return item._replace(media_path=media_name)
+
+    def join_speech(self, items):
+        """Concatenate the per-segment speech tracks into the job's translated audio"""
+        with wave.open(self.processor.translated_audio_path, 'wb') as out:
+            out.setnchannels(1)
+            out.setsampwidth(2)
+            out.setframerate(SPEECH_SAMPLE_RATE)
+            for item in items:
+                with wave.open(item.audio_path, 'rb') as clip:
+                    out.writeframes(clip.readframes(clip.getnframes()))
+
+    def run(self):
+        """Dub the whole video, publishing each segment as soon as it is muxed"""
+        processor = self.processor
+        started = time.perf_counter()
+        os.makedirs(self.segment_dir, exist_ok=True)
+        self.playlist = HLSPlaylist(self.hls_dir)
+        self.source_lang = processor.source_language()
+        processor.processing_jobs.update(processor.job_id, persist=False,
+                                         preview_path=self.playlist.path)
+
+        # The WAV is extracted up front: holding an ffmpeg slot for a decode
+        # pipe while later stages wait for ffmpeg slots could deadlock
+        processor.audio_mode = 'file'
+        if not processor.extract_audio():
+            return False
+
+        processor.update_status('streaming', 30, 'Dubbing the first segment...')
+        items = (StreamItem(segment, None, None, None, None) for segment in processor.audio_segments())
+        chain = pipeline_stage(self.transcribe, items, workers=TRANSCRIBE_FANOUT, name='stream-asr')
+        chain = pipeline_stage(self.translate, chain, workers=self.workers, name='stream-translate')
+        chain = pipeline_stage(self.synthesize, chain, workers=self.workers, name='stream-tts')
+        chain = pipeline_stage(self.mux, chain, workers=self.workers, name='stream-mux')
+
+        done = []
+        try:
+            for item in chain:
+                self.playlist.append(item.segment.end - item.segment.start, item.media_path)
+                done.append(item)
+                if len(done) == 1:
+                    processor.record_timing('first_playable', time.perf_counter() - started)
+                processor.audio_seconds = item.segment.end
+                processor.update_status('streaming', min(85, 30 + len(done) * 2),
+                                        f'Dubbed {len(done)} segments ({item.segment.end:.0f}s), '
+                                        f'preview available')
+        except Exception as e:
+            processor.update_status('error', 0, f'Error dubbing segments: {str(e)}'[:255])
+            logger.error(f"Job {processor.job_id}: streaming pipeline failed: {e}")
+            return False
+        finally:
+            self.playlist.end()
+        processor.record_timing('stream_segments', time.perf_counter() - started)
+        processor.transcript_segments = [(item.segment.start, item.segment.end, item.text) for item in done]
+
+        if not done:
+            processor.update_status('error', 0, 'No audio segments to dub')
+            return False
+        self.join_speech(done)
+        shutil.rmtree(self.segment_dir, ignore_errors=True)
+        return processor.merge_audio_video()
@@ -0,0 +1,48 @@
+"""Fixtures shared by the tests: the Flask app on a throwaway SQLite database.
+
+None of the tests need ffmpeg, the speech services or network access.
+"""
+import os
+import tempfile
+
+import pytest
+
+# The modules read these when first imported, so they are set before any
+# test imports them. DATABASE_URL is overridden, never defaulted: the
+# fixtures drop every table.
+WORKDIR = tempfile.mkdtemp(prefix='videoverse-tests-')
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(WORKDIR, 'test.sqlite')
+os.environ['STATUS_TABLE'] = 'off'
+
+
+@pytest.fixture(scope='session')
+def app_module():
+    """The app module, imported from a scratch directory so its uploads/ and
+    processed/ folders land there"""
+    cwd = os.getcwd()
+    os.chdir(WORKDIR)
+    try:
+        import app
+    finally:
+        os.chdir(cwd)
+    return app
+
+
+@pytest.fixture
+def db(app_module):
+    """Empty tables inside an app context"""
+    from models import db
+    with app_module.app.app_context():
+        db.create_all()
+        yield db
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture
+def client(app_module, db):
+    """Test client whose requests belong to the session 'owner-1'"""
+    client = app_module.app.test_client()
+    with client.session_transaction() as session:
+        session['user_session_id'] = 'owner-1'
+    return client
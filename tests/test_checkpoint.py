@@ -0,0 +1,89 @@
+import pytest
+
+from checkpoint import JobCheckpoint, MANIFEST_NAME, call_with_retries
+
+
+@pytest.fixture
+def job_dir(tmp_path):
+    (tmp_path / 'audio.wav').write_bytes(b'audio')
+    return str(tmp_path)
+
+
+def test_finished_stage_is_skipped_on_resume(job_dir):
+    checkpoint = JobCheckpoint(job_dir, 'fr')
+    assert not checkpoint.resumed
+    checkpoint.stage_done('extract_audio', 1.25, [f'{job_dir}/audio.wav'], data={'duration': 12.0},
+                          inputs={'video': 'abc'})
+
+    resumed = JobCheckpoint(job_dir, 'fr')
+    assert resumed.resumed
+    assert resumed.completed('extract_audio', inputs={'video': 'abc'}) == {'duration': 12.0}
+    assert resumed.summary()['extract_audio']['seconds'] == 1.25
+
+
+def test_stage_runs_again_when_inputs_or_artifacts_change(job_dir, tmp_path):
+    checkpoint = JobCheckpoint(job_dir, 'fr')
+    checkpoint.stage_done('extract_audio', 1.0, [f'{job_dir}/audio.wav'], inputs={'video': 'abc'})
+
+    assert checkpoint.completed('extract_audio', inputs={'video': 'other'}) is None
+    (tmp_path / 'audio.wav').write_bytes(b'truncated')
+    assert checkpoint.completed('extract_audio', inputs={'video': 'abc'}) is None
+    (tmp_path / 'audio.wav').unlink()
+    assert checkpoint.completed('extract_audio', inputs={'video': 'abc'}) is None
+
+
+def test_manifest_of_another_job_identity_is_ignored(job_dir):
+    JobCheckpoint(job_dir, 'fr').stage_done('extract_audio', 1.0)
+
+    assert JobCheckpoint(job_dir, 'de').completed('extract_audio') is None
+    assert JobCheckpoint(job_dir, 'fr', version='old').completed('extract_audio') is None
+
+
+def test_multi_language_parent_resumes_under_one_identity(job_dir):
+    # The parent's languages can change between runs (a retry only redoes
+    # the failed ones); its shared stages must still be reused
+    JobCheckpoint(job_dir, 'multi').stage_done('transcribe', 3.0)
+    assert JobCheckpoint(job_dir, 'multi').completed('transcribe') == {}
+
+
+def test_segments_and_unreadable_manifests(job_dir, tmp_path):
+    checkpoint = JobCheckpoint(job_dir, 'fr')
+    checkpoint.segment_done(0, 0.0, 4.5, 'hello there')
+    assert JobCheckpoint(job_dir, 'fr').segment_text(0, 0.0, 4.5) == 'hello there'
+    assert JobCheckpoint(job_dir, 'fr').segment_text(1, 4.5, 9.0) is None
+
+    (tmp_path / MANIFEST_NAME).write_text('{not json')
+    assert not JobCheckpoint(job_dir, 'fr').resumed
+
+
+def test_call_with_retries_backs_off_on_transient_errors():
+    calls = []
+    delays = []
+
+    def flaky():
+        calls.append(1)
+        if len(calls) < 3:
+            raise ConnectionError('reset')
+        return 'ok'
+
+    assert call_with_retries(flaky, attempts=3, sleep=delays.append) == 'ok'
+    assert len(calls) == 3
+    assert len(delays) == 2
+
+
+def test_call_with_retries_gives_up():
+    delays = []
+
+    def down():
+        raise TimeoutError('slow')
+
+    with pytest.raises(TimeoutError):
+        call_with_retries(down, attempts=2, sleep=delays.append)
+    assert len(delays) == 2
+
+    def broken():
+        raise ValueError('bad input')
+
+    with pytest.raises(ValueError):
+        call_with_retries(broken, sleep=delays.append)
+    assert len(delays) == 2
@@ -0,0 +1,80 @@
+import wave
+
+import numpy as np
+import pytest
+
+from audio_chunker import SAMPLE_RATE, SilenceChunker, iter_wav_segments
+
+
+def tone(seconds):
+    t = np.arange(int(SAMPLE_RATE * seconds)) / SAMPLE_RATE
+    return (np.sin(2 * np.pi * 440 * t) * 16000).astype('<i2').tobytes()
+
+
+def silence(seconds):
+    return bytes(int(SAMPLE_RATE * seconds) * 2)
+
+
+def chunk(pcm, piece=None, **options):
+    chunker = SilenceChunker(**options)
+    piece = piece or len(pcm)
+    segments = []
+    for offset in range(0, len(pcm), piece):
+        segments += chunker.feed(pcm[offset:offset + piece])
+    return segments + chunker.flush()
+
+
+def test_cuts_in_silence_gaps():
+    pcm = tone(4) + silence(1) + tone(4) + silence(1) + tone(4)
+    segments = chunk(pcm, min_segment=2)
+
+    assert len(segments) == 3
+    assert 4 <= segments[0].end <= 5
+    assert 9 <= segments[1].end <= 10
+    assert b''.join(segment.pcm for segment in segments) == pcm
+    for previous, segment in zip(segments, segments[1:]):
+        assert segment.start == previous.end
+        assert segment.index == previous.index + 1
+    assert segments[-1].end == 14.0
+
+
+def test_long_speech_is_cut_at_max_segment():
+    segments = chunk(tone(60), min_segment=3, max_segment=25)
+
+    assert all(segment.end - segment.start <= 25 for segment in segments)
+    assert segments[-1].end == 60.0
+    assert all(segment.voiced > 0.9 for segment in segments)
+
+
+def test_feeding_in_pieces_gives_the_same_segments():
+    pcm = tone(3) + silence(0.5) + tone(5) + silence(2) + tone(1)
+    whole = chunk(pcm, min_segment=2)
+    pieces = chunk(pcm, piece=777, min_segment=2)
+
+    assert [(s.start, s.end, s.pcm) for s in pieces] == [(s.start, s.end, s.pcm) for s in whole]
+
+
+def test_last_segment_ends_at_the_end_of_the_audio():
+    # Not a whole number of 30 ms frames
+    pcm = tone(10) + silence(0.00625)
+    segments = chunk(pcm, min_segment=2)
+
+    assert segments[-1].end == round(len(pcm) / 2 / SAMPLE_RATE, 3) == 10.006
+
+
+def test_iter_wav_segments_checks_the_format(tmp_path):
+    path = str(tmp_path / 'audio.wav')
+    with wave.open(path, 'wb') as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(SAMPLE_RATE)
+        wav.writeframes(tone(2) + silence(1) + tone(2))
+    assert [segment.end for segment in iter_wav_segments(path, SilenceChunker(min_segment=1))][-1] == 5.0
+
+    with wave.open(path, 'wb') as wav:
+        wav.setnchannels(2)
+        wav.setsampwidth(2)
+        wav.setframerate(44100)
+        wav.writeframes(bytes(4410 * 4))
+    with pytest.raises(ValueError):
+        list(iter_wav_segments(path))
@@ -0,0 +1,88 @@
+import os
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy.exc import IntegrityError
+
+from content_store import ContentStore
+from models import TranslationJob
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    # Followers' outputs go to processed/<job_id>/ under the working directory
+    monkeypatch.chdir(tmp_path)
+    return ContentStore(root=str(tmp_path / 'store'), upload_root=str(tmp_path / 'upload-store'), version='9')
+
+
+def add_job(db, job_id, filename='talk.mp4', status='processing', created_at=None, **fields):
+    job = TranslationJob(id=job_id, filename=filename, original_path=f'uploads/{job_id}/{filename}',
+                         target_language='fr', content_hash='abc', pipeline_version='9', status=status,
+                         created_at=created_at or datetime.utcnow(), **fields)
+    db.session.add(job)
+    db.session.commit()
+    return job
+
+
+def test_one_leader_per_content(db):
+    add_job(db, 'leader')
+    add_job(db, 'follower', status=TranslationJob.WAITING_DUPLICATE, duplicate_of='leader')
+    add_job(db, 'earlier', status='completed')
+    with pytest.raises(IntegrityError):
+        add_job(db, 'second-leader')
+    db.session.rollback()
+
+
+def test_followers_get_the_leaders_output(db, store, tmp_path):
+    output = tmp_path / 'dubbed.mkv'
+    output.write_bytes(b'dubbed video')
+    add_job(db, 'leader', filename='talk.mkv')
+    add_job(db, 'follower', filename='copy.mov', status=TranslationJob.WAITING_DUPLICATE, duplicate_of='leader')
+
+    settled = store.resolve_duplicates('leader', {'status': 'completed', 'output_path': str(output)})
+
+    assert settled == 1
+    assert store.has_output('abc', 'fr', 'talk.mkv')
+    follower = db.session.get(TranslationJob, 'follower')
+    assert follower.status == 'completed'
+    assert follower.output_path == os.path.join('processed', 'follower', 'dubbed_copy.mkv')
+    with open(follower.output_path, 'rb') as f:
+        assert f.read() == b'dubbed video'
+
+
+def test_failed_leader_fails_its_followers(db, store):
+    add_job(db, 'leader')
+    add_job(db, 'follower', status=TranslationJob.WAITING_DUPLICATE, duplicate_of='leader')
+
+    store.resolve_duplicates('leader', {'status': 'error', 'message': 'ffmpeg failed'})
+
+    follower = db.session.get(TranslationJob, 'follower')
+    assert (follower.status, follower.message) == ('error', 'Original job failed: ffmpeg failed')
+
+
+def test_settle_orphans_promotes_the_oldest_follower(db, store):
+    now = datetime.utcnow()
+    for i in range(3):
+        add_job(db, f'follower-{i}', status=TranslationJob.WAITING_DUPLICATE, duplicate_of='gone',
+                created_at=now - timedelta(minutes=3 - i))
+
+    promoted = store.settle_orphans()
+
+    assert [job.id for job in promoted] == ['follower-0']
+    db.session.expire_all()
+    jobs = {job.id: (job.status, job.duplicate_of) for job in TranslationJob.query}
+    assert jobs == {'follower-0': ('queued', None),
+                    'follower-1': (TranslationJob.WAITING_DUPLICATE, 'follower-0'),
+                    'follower-2': (TranslationJob.WAITING_DUPLICATE, 'follower-0')}
+
+
+def test_settle_orphans_times_out_followers_of_a_stuck_leader(db, store):
+    add_job(db, 'leader')
+    add_job(db, 'old', status=TranslationJob.WAITING_DUPLICATE, duplicate_of='leader',
+            created_at=datetime.utcnow() - timedelta(hours=2))
+    add_job(db, 'recent', status=TranslationJob.WAITING_DUPLICATE, duplicate_of='leader')
+
+    assert store.settle_orphans(wait_seconds=3600) == []
+    db.session.expire_all()
+    assert db.session.get(TranslationJob, 'old').status == 'error'
+    assert db.session.get(TranslationJob, 'recent').status == TranslationJob.WAITING_DUPLICATE
@@ -0,0 +1,66 @@
+import pytest
+
+from models import TranslationJob
+
+CONTENT = bytes(range(256)) * 40
+
+
+@pytest.fixture
+def output(db, tmp_path):
+    path = tmp_path / 'processed' / 'job' / 'dubbed_talk.mp4'
+    path.parent.mkdir(parents=True)
+    path.write_bytes(CONTENT)
+    db.session.add(TranslationJob(id='job', filename='talk.mp4', original_path='uploads/talk.mp4',
+                                  target_language='fr', status='completed', output_path=str(path),
+                                  owner='owner-1'))
+    db.session.commit()
+    return path
+
+
+def test_full_download(client, output, db):
+    response = client.get('/download/job')
+
+    assert response.status_code == 200
+    assert response.data == CONTENT
+    assert response.headers['Accept-Ranges'] == 'bytes'
+    assert 'attachment; filename=dubbed_talk.mp4' in response.headers['Content-Disposition']
+    assert 'private' in response.headers['Cache-Control']
+    assert 'public' not in response.headers['Cache-Control']
+    db.session.expire_all()
+    assert db.session.get(TranslationJob, 'job').last_accessed_at is not None
+
+
+def test_range_request(client, output, db):
+    response = client.get('/download/job', headers={'Range': 'bytes=100-199'})
+
+    assert response.status_code == 206
+    assert response.data == CONTENT[100:200]
+    assert response.headers['Content-Range'] == f'bytes 100-199/{len(CONTENT)}'
+    # Seeking doesn't count as a download
+    db.session.expire_all()
+    assert db.session.get(TranslationJob, 'job').last_accessed_at is None
+
+
+def test_conditional_request(client, output):
+    etag = client.get('/download/job').headers['ETag']
+
+    response = client.get('/download/job', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.data == b''
+
+
+def test_x_accel_offload(client, output, app_module, monkeypatch):
+    monkeypatch.setattr(app_module, 'DOWNLOAD_OFFLOAD', 'x-accel')
+    monkeypatch.setattr(app_module, 'PROCESSED_FOLDER', str(output.parent.parent))
+
+    response = client.get('/download/job')
+    assert response.data == b''
+    assert response.headers['X-Accel-Redirect'] == '/protected-downloads/job/dubbed_talk.mp4'
+    assert response.headers['Content-Type'] == 'video/mp4'
+
+
+def test_unfinished_job_is_not_served(client, output, db):
+    TranslationJob.query.filter_by(id='job').update({'status': 'processing'})
+    db.session.commit()
+
+    assert client.get('/download/job').status_code == 302
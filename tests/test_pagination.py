@@ -0,0 +1,70 @@
+from datetime import datetime, timedelta
+
+from models import TranslationJob, UserPreference
+
+
+def add_jobs(db, owner, count, start=None, **fields):
+    start = start or datetime(2026, 1, 1)
+    for i in range(count):
+        db.session.add(TranslationJob(id=f'{owner}-{i:03d}', filename=f'video{i}.mp4',
+                                      original_path=f'uploads/video{i}.mp4', owner=owner,
+                                      created_at=start + timedelta(seconds=i), **fields))
+    db.session.commit()
+
+
+def test_history_pages_with_keyset_cursor(db):
+    add_jobs(db, 'owner-1', 25, target_language='fr', status='completed')
+    add_jobs(db, 'owner-2', 5, target_language='fr', status='completed')
+
+    seen = []
+    before = None
+    while True:
+        page = TranslationJob.history('owner-1', limit=10, before=before)
+        seen += [row.id for row in page]
+        if len(page) < 10:
+            break
+        before = (page[-1].created_at, page[-1].id)
+    assert seen == [f'owner-1-{i:03d}' for i in reversed(range(25))]
+
+
+def test_history_breaks_created_at_ties_by_id(db):
+    same_time = datetime(2026, 1, 1)
+    for job_id in ('b', 'a', 'c'):
+        db.session.add(TranslationJob(id=job_id, filename='v.mp4', original_path='uploads/v.mp4',
+                                      target_language='fr', owner='owner-1', created_at=same_time))
+    db.session.commit()
+
+    first = TranslationJob.history('owner-1', limit=2)
+    rest = TranslationJob.history('owner-1', limit=2, before=(first[-1].created_at, first[-1].id))
+    assert [row.id for row in first + rest] == ['c', 'b', 'a']
+
+
+def test_history_filters(db):
+    add_jobs(db, 'owner-1', 3, target_language='fr', status='completed')
+    add_jobs(db, 'other', 2, target_language='de', status='error')
+    TranslationJob.query.filter(TranslationJob.owner == 'other').update({'owner': 'owner-1'})
+    db.session.commit()
+
+    assert len(TranslationJob.history('owner-1', limit=10, statuses=['error'])) == 2
+    assert len(TranslationJob.history('owner-1', limit=10, language='fr')) == 3
+    assert TranslationJob.history('owner-1', limit=10, statuses=['error'], language='fr') == []
+
+
+def test_cursor_round_trip(db, app_module):
+    add_jobs(db, 'owner-1', 1, target_language='fr')
+    job = TranslationJob.history('owner-1')[0]
+    assert app_module.decode_cursor(app_module.encode_cursor(job)) == (job.created_at, job.id)
+
+
+def test_jobs_endpoint_lists_only_the_sessions_jobs(db, client):
+    db.session.add(UserPreference(session_id='owner-1'))
+    add_jobs(db, 'owner-1', 3, target_language='fr', status='completed')
+    add_jobs(db, 'owner-2', 2, target_language='fr', status='completed')
+
+    first = client.get('/jobs?limit=2').get_json()
+    assert [job['id'] for job in first['jobs']] == ['owner-1-002', 'owner-1-001']
+    second = client.get(f"/jobs?limit=2&cursor={first['next_cursor']}").get_json()
+    assert [job['id'] for job in second['jobs']] == ['owner-1-000']
+    assert second['next_cursor'] is None
+
+    assert client.get('/jobs?cursor=not-a-cursor').status_code == 400
@@ -0,0 +1,80 @@
+from datetime import datetime, timedelta
+
+from models import TranslationJob
+
+
+def add_job(db, job_id, status='queued', created_at=None, **fields):
+    job = TranslationJob(id=job_id, filename=f'{job_id}.mp4', original_path=f'uploads/{job_id}.mp4',
+                         target_language=fields.pop('target_language', 'fr'), status=status,
+                         created_at=created_at or datetime.utcnow(), **fields)
+    db.session.add(job)
+    db.session.commit()
+    return job
+
+
+def expire(db, job_id, worker_id='worker-1', attempts=1):
+    (TranslationJob.query.filter_by(id=job_id)
+     .update({'worker_id': worker_id, 'attempts': attempts,
+              'lease_expires_at': datetime.utcnow() - timedelta(seconds=5)}))
+    db.session.commit()
+
+
+def test_claim_next_takes_oldest_queued_job(db):
+    now = datetime.utcnow()
+    add_job(db, 'newer', created_at=now)
+    add_job(db, 'older', created_at=now - timedelta(minutes=1))
+    add_job(db, 'done', status='completed', created_at=now - timedelta(minutes=2))
+
+    job = TranslationJob.claim_next('worker-1', lease_seconds=30)
+    assert job.id == 'older'
+    assert (job.status, job.worker_id, job.attempts) == ('claimed', 'worker-1', 1)
+    assert job.lease_expires_at > datetime.utcnow()
+
+    assert TranslationJob.claim_next('worker-2').id == 'newer'
+    assert TranslationJob.claim_next('worker-3') is None
+
+
+def test_heartbeat_and_release_need_the_lease(db):
+    add_job(db, 'job')
+    TranslationJob.claim_next('worker-1')
+
+    assert TranslationJob.heartbeat('job', 'worker-1')
+    assert not TranslationJob.heartbeat('job', 'worker-2')
+    assert not TranslationJob.release('job', 'worker-2', status='completed')
+    assert TranslationJob.release('job', 'worker-1', status='completed', progress=100)
+
+    job = db.session.get(TranslationJob, 'job')
+    db.session.refresh(job)
+    assert (job.status, job.worker_id, job.lease_expires_at) == ('completed', None, None)
+
+
+def test_requeue_expired_requeues_parent_and_children(db):
+    add_job(db, 'parent', status='processing', target_language='multi')
+    add_job(db, 'child-fr', status='processing', parent_id='parent')
+    add_job(db, 'child-de', status='completed', parent_id='parent', target_language='de')
+    add_job(db, 'live', status='processing')
+    expire(db, 'parent')
+    TranslationJob.query.filter_by(id='live').update(
+        {'worker_id': 'worker-2', 'lease_expires_at': datetime.utcnow() + timedelta(minutes=1)})
+    db.session.commit()
+
+    assert TranslationJob.requeue_expired(max_attempts=3) == (1, 0)
+    db.session.expire_all()
+    statuses = {job.id: job.status for job in TranslationJob.query}
+    assert statuses == {'parent': 'queued', 'child-fr': 'waiting_parent', 'child-de': 'completed',
+                        'live': 'processing'}
+    assert db.session.get(TranslationJob, 'parent').worker_id is None
+
+
+def test_requeue_expired_fails_jobs_out_of_attempts(db):
+    add_job(db, 'parent', status='processing', target_language='multi')
+    add_job(db, 'child-fr', status='waiting_parent', parent_id='parent')
+    add_job(db, 'follower', status=TranslationJob.WAITING_DUPLICATE, parent_id='parent',
+            target_language='de', duplicate_of='leader')
+    expire(db, 'parent', attempts=3)
+
+    assert TranslationJob.requeue_expired(max_attempts=3) == (0, 1)
+    db.session.expire_all()
+    statuses = {job.id: job.status for job in TranslationJob.query}
+    assert statuses == {'parent': 'error', 'child-fr': 'error',
+                        'follower': TranslationJob.WAITING_DUPLICATE}
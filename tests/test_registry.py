@@ -0,0 +1,83 @@
+import time
+
+import pytest
+
+from job_registry import JobAbandoned, JobRegistry
+from models import TranslationJob
+
+
+@pytest.fixture
+def registry(app_module):
+    return JobRegistry(app_module.app, publish=False)
+
+
+def add_job(db, job_id, **fields):
+    db.session.add(TranslationJob(id=job_id, filename='talk.mp4', original_path='uploads/talk.mp4',
+                                  target_language='fr', status='queued', **fields))
+    db.session.commit()
+
+
+def stored(db, job_id):
+    db.session.expire_all()
+    return db.session.get(TranslationJob, job_id)
+
+
+def test_updates_are_written_behind_in_one_flush(db, registry):
+    add_job(db, 'a')
+    add_job(db, 'b')
+    registry.create('a', {'status': 'processing'}, persist=True)
+    registry.update('a', progress=40, message='Transcribing...')
+    registry.update('b', status='completed', progress=100, output_path='processed/b/out.mp4')
+    assert stored(db, 'a').status == 'queued'
+
+    assert registry.flush() == 2
+    a, b = stored(db, 'a'), stored(db, 'b')
+    assert (a.status, a.progress, a.message) == ('processing', 40, 'Transcribing...')
+    assert (b.status, b.output_path) == ('completed', 'processed/b/out.mp4')
+    assert b.completed_at is not None
+    assert registry.flush() == 0
+
+
+def test_flush_merges_extra_data(db, registry):
+    add_job(db, 'a', extra_data={'admission': {'eta_seconds': 30}})
+    registry.update('a', status='completed', timings={'transcribe': 1.5})
+    registry.flush()
+
+    assert stored(db, 'a').extra_data == {'admission': {'eta_seconds': 30}, 'timings': {'transcribe': 1.5}}
+
+
+def test_lease_owner_only_writes_leased_rows(db, app_module):
+    add_job(db, 'mine', worker_id='worker-1')
+    add_job(db, 'child', parent_id='mine')
+    add_job(db, 'theirs', worker_id='worker-2')
+    registry = JobRegistry(app_module.app, publish=False, lease_owner='worker-1')
+    for job_id in ('mine', 'child', 'theirs'):
+        registry.update(job_id, status='processing')
+    registry.flush()
+
+    assert [stored(db, job_id).status for job_id in ('mine', 'child', 'theirs')] == \
+        ['processing', 'processing', 'queued']
+
+
+def test_abandoned_jobs_stop_updating(registry):
+    registry.create('a', {'status': 'processing'})
+    registry.abandon('a')
+    assert registry.abandoned('a')
+    with pytest.raises(JobAbandoned):
+        registry.update('a', progress=50)
+
+
+def test_evict_drops_finished_and_stale_records():
+    registry = JobRegistry(publish=False, finished_ttl=60, stale_ttl=60)
+    registry.create('finished', {'status': 'completed'})
+    registry.create('running', {'status': 'processing'})
+    # A copy read from the database, which this process won't update
+    registry.load('loaded', {'status': 'processing'})
+    registry.create('waiting', {'status': TranslationJob.WAITING_DUPLICATE})
+    registry.create('fresh', {'status': 'completed'})
+    for job_id in ('finished', 'running', 'loaded', 'waiting'):
+        registry._shard(job_id).records[job_id].updated_at = time.time() - 120
+
+    assert registry.evict() == 3
+    assert 'running' in registry and 'fresh' in registry
+    assert all(job_id not in registry for job_id in ('finished', 'loaded', 'waiting'))
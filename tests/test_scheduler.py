@@ -0,0 +1,78 @@
+import threading
+import time
+
+from scheduler import JobScheduler
+
+
+def wait_until(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline, 'timed out'
+        time.sleep(0.01)
+
+
+def test_runs_by_priority_then_fifo():
+    scheduler = JobScheduler(max_workers=1)
+    gate = threading.Event()
+    order = []
+    scheduler.submit('blocker', gate.wait)
+    wait_until(lambda: scheduler.stats()['active_workers'] == 1)
+
+    scheduler.submit('low-1', lambda: order.append('low-1'), priority=5)
+    scheduler.submit('high', lambda: order.append('high'), priority=0)
+    scheduler.submit('low-2', lambda: order.append('low-2'), priority=5)
+    assert scheduler.queue_position('high') == 1
+    assert scheduler.queue_position('low-2') == 3
+    assert scheduler.queue_depth() == 3
+
+    gate.set()
+    wait_until(lambda: len(order) == 3)
+    assert order == ['high', 'low-1', 'low-2']
+    assert scheduler.queue_position('low-2') is None
+
+
+def test_stage_limit_caps_concurrency():
+    scheduler = JobScheduler(max_workers=4, stage_limits={'ffmpeg': 2})
+    active = []
+    peak = []
+    lock = threading.Lock()
+    done = threading.Semaphore(0)
+
+    def job():
+        with scheduler.stage('ffmpeg'):
+            with lock:
+                active.append(1)
+                peak.append(len(active))
+            time.sleep(0.05)
+            with lock:
+                active.pop()
+        done.release()
+
+    for i in range(6):
+        scheduler.submit(f'job-{i}', job)
+    for _ in range(6):
+        assert done.acquire(timeout=5)
+    assert max(peak) == 2
+    assert scheduler.stats()['stage_active']['ffmpeg'] == 0
+
+
+def test_failing_job_keeps_worker_alive():
+    scheduler = JobScheduler(max_workers=1)
+    ran = threading.Event()
+    scheduler.submit('broken', lambda: 1 / 0)
+    scheduler.submit('next', ran.set)
+    assert ran.wait(5)
+
+
+def test_job_info_reports_queue_wait():
+    scheduler = JobScheduler(max_workers=1)
+    gate = threading.Event()
+    scheduler.submit('blocker', gate.wait)
+    wait_until(lambda: scheduler.stats()['active_workers'] == 1)
+    scheduler.submit('waiting', lambda: None)
+
+    info = scheduler.job_info('waiting')
+    assert info['queue_position'] == 1
+    assert info['queue_depth'] == 1
+    assert info['queue_wait'] >= 0
+    gate.set()
@@ -0,0 +1,94 @@
+import json
+
+import pytest
+
+from events import StatusHub
+from status_table import PAYLOAD_SIZE, StatusTable
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / 'status')
+
+
+def test_put_and_get(path):
+    table = StatusTable(path, slots=8)
+    version = table.put('job', {'id': 'job', 'status': 'processing', 'progress': 10, 'unshared': 'x'})
+
+    assert table.version('job') == version
+    assert table.get('job') == (version, {'id': 'job', 'status': 'processing', 'progress': 10})
+    assert table.get('job', newer_than=version) is None
+    assert table.get('missing') is None
+    assert table.version('missing') == 0
+
+
+def test_processes_share_one_table(path):
+    writer = StatusTable(path, slots=8)
+    # Later processes adopt the size chosen by the first
+    reader = StatusTable(path, slots=64)
+    assert reader.slots == 8
+
+    writer.put('job', {'status': 'processing', 'progress': 10})
+    version = writer.put('job', {'status': 'processing', 'progress': 20})
+    assert reader.get('job', newer_than=version - 1) == (version, {'status': 'processing', 'progress': 20})
+
+
+def test_versions_keep_increasing_when_slots_are_reused(path):
+    table = StatusTable(path, slots=1)
+    seen = table.put('a', {'status': 'completed'})
+    for _ in range(3):
+        seen = table.put('a', {'status': 'completed'})
+
+    # 'b' takes over the only slot, then 'a' comes back
+    assert table.put('b', {'status': 'processing'}) > seen
+    assert table.get('a') is None
+    version = table.put('a', {'status': 'processing'})
+    assert version > seen
+    assert table.get('a', newer_than=seen) == (version, {'status': 'processing'})
+
+
+def test_full_table_overwrites_finished_jobs_first(path):
+    table = StatusTable(path, slots=2)
+    table.put('done', {'status': 'completed'})
+    table.put('running', {'status': 'processing'})
+    table.put('new', {'status': 'queued'})
+
+    assert table.get('done') is None
+    assert table.get('running') is not None
+    assert table.get('new') is not None
+
+
+def test_discard_keeps_the_probe_chain(path):
+    table = StatusTable(path, slots=2)
+    first, second = 'job-1', 'job-2'
+    table.put(first, {'status': 'processing'})
+    table.put(second, {'status': 'processing'})
+
+    table.discard(first)
+    assert table.get(first) is None
+    assert table.get(second) is not None
+    # The discarded job's slot is free again
+    table.put('job-3', {'status': 'processing'})
+    assert table.get(second) is not None
+
+
+def test_large_states_are_trimmed_to_a_slot(path):
+    table = StatusTable(path, slots=4)
+    table.put('job', {'status': 'processing', 'message': 'm' * 2000, 'timings': {'x': 1.0},
+                      'children': ['child'] * 200})
+
+    version, state = table.get('job')
+    assert state['status'] == 'processing'
+    assert 'timings' not in state and 'children' not in state
+    assert len(json.dumps(state)) <= PAYLOAD_SIZE
+
+
+def test_watcher_wakes_subscribers(path):
+    writer = StatusTable(path, slots=8)
+    reader = StatusTable(path, slots=8)
+    hub = StatusHub()
+    reader.watch(hub, interval=0.01)
+
+    version = writer.put('job', {'status': 'completed', 'progress': 100})
+    # The watcher only looks at jobs someone is waiting on
+    assert hub.wait('job', since=0, timeout=5) == (version, {'status': 'completed', 'progress': 100})
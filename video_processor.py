@@ -1,23 +1,60 @@
 import os
+import asyncio
 import logging
 import tempfile
 import subprocess
 import time
-# Using SpeechRecognition instead of whisper due to size constraints
-import speech_recognition as sr
-from googletrans import Translator
-from gtts import gTTS
+from concurrent.futures import ThreadPoolExecutor, CancelledError, wait, FIRST_COMPLETED
+from contextlib import contextmanager, nullcontext
+# Speech, translation and TTS engines are chosen in backends.py
+from backends import get_backend, get_translation_batcher, BackendError
+from audio_chunker import iter_wav_segments, iter_pipe_segments, SAMPLE_RATE, SAMPLE_WIDTH
+from stage_cache import get_cache, make_key
+from events import get_hub
+from job_registry import JobAbandoned
+from admission import get_eta_model
+from checkpoint import JobCheckpoint, call_with_retries, file_sha256
+from async_engine import STAGE_EXECUTOR, ASYNC_JOB_FANOUT, get_engine, cancel_job
+from profiling import JobProfiler, should_profile, profile_dir
+import metrics
 
 # Configure logging
 logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
+# Number of audio segments transcribed concurrently per job
+TRANSCRIBE_FANOUT = int(os.environ.get('TRANSCRIBE_FANOUT', '4'))
+# 'file' extracts a WAV before transcribing; 'pipe' streams PCM from ffmpeg
+# straight into transcription and falls back to 'file' if the pipe fails
+AUDIO_EXTRACTION_MODE = os.environ.get('AUDIO_EXTRACTION_MODE', 'file')
+# Segments with less speech than this are not sent for recognition
+MIN_VOICED_FRACTION = 0.05
+# 'batch' runs each stage over the whole video; 'streaming' dubs segment by
+# segment and publishes an HLS preview as it goes (see streaming.py).
+# Multi-language jobs always run in 'batch' mode.
+PIPELINE_MODE = os.environ.get('PIPELINE_MODE', 'batch')
+# Number of target languages dubbed concurrently for multi-language jobs
+LANGUAGE_FANOUT = int(os.environ.get('LANGUAGE_FANOUT', '3'))
+
+# Containers whose index (moov atom) ffmpeg can move to the front of the file
+FASTSTART_EXTENSIONS = ('.mp4', '.mov', '.m4v')
+
+class AudioExtractionError(RuntimeError):
+    """Raised when no audio could be decoded from the uploaded video"""
+
 class VideoProcessor:
-    def __init__(self, job_id, video_path, target_language, processing_jobs):
+    def __init__(self, job_id, video_path, target_language, processing_jobs, scheduler=None, child_jobs=None):
         self.job_id = job_id
         self.video_path = video_path
         self.target_language = target_language
         self.processing_jobs = processing_jobs
+        self.scheduler = scheduler
+        # child_jobs maps target language -> child job id for multi-language
+        # jobs, which extract and transcribe once and then branch per language
+        self.child_jobs = child_jobs or {}
+        self.parent_job_id = None
+        self.profiler = None  # set by process_video when the job is profiled
+        self.target_languages = list(self.child_jobs) or [target_language]
         self.processed_dir = 'processed'
         os.makedirs(self.processed_dir, exist_ok=True)
         
@@ -30,51 +67,157 @@ class VideoProcessor:
         self.translated_audio_path = os.path.join(job_dir, 'translated_audio.wav')
         self.output_video_path = os.path.join(job_dir, f'dubbed_{os.path.basename(video_path)}')
         
-        # Initialize speech recognition
+        # Stages finished by an earlier, interrupted run are not repeated. A
+        # parent's shared stages don't depend on which languages are left
+        self.checkpoint = JobCheckpoint(job_dir, 'multi' if self.child_jobs else target_language)
+        
+        # Initialize speech recognition; engines are shared by all jobs
         self.update_status('loading_model', 10, 'Initializing speech recognition...')
-        self.recognizer = sr.Recognizer()
-        self.translator = Translator()
+        self.speech = get_backend('speech')
+        self.translation = get_backend('translation')
+        self.tts = get_backend('tts')
+        self.translation_batcher = get_translation_batcher()
+        # Service calls wait on the shared event loop instead of a thread each
+        self.engine = get_engine() if STAGE_EXECUTOR == 'asyncio' else None
+        self.transcript_segments = []  # (start, end, text) per audio segment
+        self.audio_mode = AUDIO_EXTRACTION_MODE
+        self.timings = {}  # seconds spent in each stage
+        self.audio_seconds = None  # length of the decoded audio track
+        
+        # Shared result caches for the network-bound stages
+        self.asr_cache = get_cache('asr')
+        self.translation_cache = get_cache('translation')
+        self.tts_cache = get_cache('tts')
+        
+        # One processor per language runs translation, TTS and merge
+        self.branches = {
+            language: VideoProcessor(child_id, video_path, language, processing_jobs, scheduler=scheduler)
+            for language, child_id in self.child_jobs.items()
+        }
+        for branch in self.branches.values():
+            branch.parent_job_id = job_id
+    
+    def stage_slot(self, stage_class):
+        """Concurrency slot for a stage class ('ffmpeg' or 'network')"""
+        if self.scheduler is None:
+            return nullcontext()
+        return self.scheduler.stage(stage_class)
+    
+    def record_timing(self, name, seconds):
+        """Remember how long a stage took and expose it with the job status"""
+        self.timings[name] = round(seconds, 3)
+        self.processing_jobs.update(self.job_id, persist=False, timings=dict(self.timings))
+        metrics.STAGE_SECONDS.observe(seconds, stage=name)
+    
+    def span(self, name, category, **args):
+        """Profile span around a block; does nothing unless the job is profiled"""
+        if self.profiler is None:
+            return nullcontext()
+        return self.profiler.span(name, category, **args)
+    
+    @contextmanager
+    def timed(self, stage):
+        """Time a pipeline stage, counting it as failed if it raises"""
+        started = time.perf_counter()
+        try:
+            with self.span(stage, 'stage', job_id=self.job_id):
+                yield
+        except Exception:
+            metrics.STAGE_ERRORS.inc(stage=stage)
+            raise
+        finally:
+            self.record_timing(stage, time.perf_counter() - started)
+    
+    def count_bytes(self, stage, direction, amount):
+        """Count bytes a stage read ('in') or wrote ('out')"""
+        metrics.STAGE_BYTES.inc(amount, stage=stage, direction=direction)
+    
+    def call_service(self, service, func, *args, **kwargs):
+        """Call an external service, retrying transient failures and counting outcomes"""
+        def retried(attempt, error):
+            metrics.EXTERNAL_CALLS.inc(service=service, outcome='retry')
+        
+        try:
+            with self.span(service, 'external'):
+                result = call_with_retries(lambda: func(*args, **kwargs), on_retry=retried)
+        except Exception:
+            metrics.EXTERNAL_CALLS.inc(service=service, outcome='error')
+            raise
+        metrics.EXTERNAL_CALLS.inc(service=service, outcome='ok')
+        return result
+    
+    def service_future(self, service, make_call):
+        """Run a service call on the stage engine, counting outcomes like call_service.
+        
+        ``make_call()`` returns a new awaitable for each attempt. Returns a
+        concurrent Future for the result.
+        """
+        def retried(attempt, error):
+            metrics.EXTERNAL_CALLS.inc(service=service, outcome='retry')
+        
+        submitted = time.perf_counter()
+        profiler = self.profiler
+        
+        def finished(future):
+            failed = future.cancelled() or future.exception() is not None
+            metrics.EXTERNAL_CALLS.inc(service=service, outcome='error' if failed else 'ok')
+            if profiler is not None:
+                profiler.record(service, 'external', submitted, time.perf_counter(), {'failed': failed})
+        
+        future = self.engine.submit(self.job_id, service, make_call, on_retry=retried)
+        future.add_done_callback(finished)
+        return future
+    
+    def save_metrics(self, started):
+        """Record job-level metrics and persist them with the job's stage timings"""
+        status = self.processing_jobs.get(self.job_id, {}).get('status')
+        outcome = 'completed' if status == 'completed' else 'error'
+        elapsed = time.time() - started
+        metrics.JOB_SECONDS.observe(elapsed, outcome=outcome)
+        metrics.JOBS_FINISHED.inc(outcome=outcome)
+        fields = {'timings': dict(self.timings)}
+        if self.audio_seconds:
+            fields['audio_seconds'] = round(self.audio_seconds, 2)
+            fields['realtime_factor'] = round(elapsed / self.audio_seconds, 3)
+            metrics.VIDEO_SECONDS.observe(self.audio_seconds)
+            metrics.REALTIME_FACTOR.observe(elapsed / self.audio_seconds)
+            if outcome == 'completed':
+                # Completion estimates for new uploads learn from finished jobs
+                get_eta_model().observe(self.timings, self.audio_seconds)
+        with self.span('save_metrics', 'db'):
+            self.processing_jobs.update(self.job_id, **fields)
+    
+    def save_checkpoint(self, stage, artifacts=(), data=None, inputs=None):
+        """Record a finished stage so a restarted job can skip it"""
+        with self.span(f'checkpoint {stage}', 'io'):
+            self.checkpoint.stage_done(stage, self.timings.get(stage, 0), artifacts, data, inputs)
+        self.processing_jobs.update(self.job_id, persist=False, checkpoint=self.checkpoint.summary())
     
     def update_status(self, status, progress, message):
-        """Update the status of the processing job"""
-        # Update in-memory cache
-        self.processing_jobs[self.job_id].update({
-            'status': status,
-            'progress': progress,
-            'message': message
-        })
+        """Update the status of the processing job.
+        
+        Only the in-memory registry is touched here; it pushes the change to
+        status subscribers and persists it with the next write-behind flush.
+        """
+        with self.span('update_status', 'db', status=status):
+            self.processing_jobs.update(self.job_id, status=status, progress=progress, message=message)
         
         # Log the status update
         logger.debug(f"Job {self.job_id}: {status} - {progress}% - {message}")
         
-        # Update database if available (in app context)
-        try:
-            from flask import current_app
-            from models import db, TranslationJob
-            
-            if current_app:  # Check if we're in Flask app context
-                with current_app.app_context():
-                    job = TranslationJob.query.get(self.job_id)
-                    if job:
-                        job.status = status
-                        job.progress = progress
-                        job.message = message
-                        
-                        # If completed, record completion time
-                        if status == 'completed':
-                            from datetime import datetime
-                            job.completed_at = datetime.utcnow()
-                            
-                        db.session.commit()
-        except (ImportError, RuntimeError):
-            # Not in Flask context or db not available
-            pass
+        if self.parent_job_id:
+            # A parent's status includes its children's progress
+            get_hub().publish(self.parent_job_id, self.processing_jobs.get(self.parent_job_id))
     
     def extract_audio(self):
         """Extract audio from video file"""
         try:
             self.update_status('extracting_audio', 20, 'Extracting audio from video...')
             
+            if self.checkpoint.completed('extract_audio') is not None:
+                logger.info(f"Job {self.job_id}: reusing audio extracted before the restart")
+                return True
+            
             # Use ffmpeg to extract audio
             command = [
                 'ffmpeg', '-i', self.video_path, 
@@ -83,7 +226,11 @@ class VideoProcessor:
                 self.audio_path, '-y'
             ]
             
-            subprocess.run(command, check=True)
+            with self.timed('extract_audio'), self.stage_slot('ffmpeg'), self.span('ffmpeg', 'subprocess'):
+                subprocess.run(command, check=True)
+            self.count_bytes('extract_audio', 'in', os.path.getsize(self.video_path))
+            self.count_bytes('extract_audio', 'out', os.path.getsize(self.audio_path))
+            self.save_checkpoint('extract_audio', [self.audio_path])
             logger.debug(f"Audio extracted successfully to {self.audio_path}")
             return True
         except Exception as e:
@@ -91,69 +238,296 @@ class VideoProcessor:
             logger.error(f"Error extracting audio: {e}")
             return False
     
+    def audio_segments(self):
+        """Yield transcription segments from the pipe or from the extracted WAV"""
+        started = time.perf_counter()
+        if self.audio_mode == 'pipe':
+            yielded = False
+            try:
+                with self.stage_slot('ffmpeg'):
+                    for segment in iter_pipe_segments(self.video_path):
+                        if not yielded:
+                            self.record_timing('first_segment', time.perf_counter() - started)
+                            yielded = True
+                        self.count_bytes('extract_audio', 'out', len(segment.pcm))
+                        yield segment
+                self.count_bytes('extract_audio', 'in', os.path.getsize(self.video_path))
+                return
+            except (OSError, subprocess.CalledProcessError) as e:
+                if yielded:
+                    raise
+                logger.warning(f"Job {self.job_id}: audio pipe failed ({e}), falling back to WAV extraction")
+            if not self.extract_audio():
+                raise AudioExtractionError(self.job_id)
+        
+        for segment in iter_wav_segments(self.audio_path):
+            if 'first_segment' not in self.timings:
+                self.record_timing('first_segment', time.perf_counter() - started)
+            yield segment
+    
+    def known_transcript(self, segment, source_lang):
+        """(text, cache key) of a segment; text is None if it must be recognised"""
+        if segment.voiced < MIN_VOICED_FRACTION:
+            return '', None
+        
+        # Segments finished before an interruption are not sent again
+        text = self.checkpoint.segment_text(segment.index, segment.start, segment.end)
+        if text is not None:
+            return text, None
+        
+        # Identical audio (intros, outros, re-uploads) is only recognised once
+        key = make_key(segment.pcm, source_lang, self.speech.name)
+        cached = self.asr_cache.get_text(key)
+        if cached is not None:
+            self.checkpoint.segment_done(segment.index, segment.start, segment.end, cached)
+        return cached, key
+    
+    def transcript_done(self, segment, key, text):
+        self.asr_cache.set_text(key, text)
+        self.checkpoint.segment_done(segment.index, segment.start, segment.end, text)
+    
+    def segment_failed(self, segment, error):
+        logger.warning(f"Job {self.job_id}: segment {segment.index} "
+                       f"({segment.start}-{segment.end}s) failed: {error}")
+    
+    def recognition_request(self, segment, source_lang):
+        """Send a segment for recognition on the stage engine; returns a Future"""
+        self.count_bytes('transcribe_audio', 'in', len(segment.pcm))
+        return self.service_future('speech', lambda: self.speech.transcribe_async(
+            segment.pcm, SAMPLE_RATE, SAMPLE_WIDTH, source_lang))
+    
+    def transcribe_segment(self, segment, source_lang):
+        """Transcribe one chunk of audio, returning '' when it holds no speech"""
+        text, key = self.known_transcript(segment, source_lang)
+        if text is not None:
+            return text
+        
+        try:
+            if self.engine is not None:
+                text = self.recognition_request(segment, source_lang).result()
+            else:
+                self.count_bytes('transcribe_audio', 'in', len(segment.pcm))
+                with self.stage_slot('network'):
+                    text = self.call_service('speech', self.speech.transcribe,
+                                             segment.pcm, SAMPLE_RATE, SAMPLE_WIDTH, source_lang)
+        except BackendError as e:
+            self.segment_failed(segment, e)
+            return ''
+        except CancelledError:
+            # Only a lost lease cancels calls a stage still waits on
+            raise JobAbandoned(self.job_id)
+        self.transcript_done(segment, key, text)
+        return text
+    
+    def source_language(self):
+        """Language hint for speech recognition"""
+        # For Arabic videos, use 'ar-AR' as language hint
+        return 'ar-AR' if 'ar' not in self.target_languages else 'en-US'
+    
+    def transcribe_segments(self, segments, source_lang, fanout=TRANSCRIBE_FANOUT):
+        """Transcribe segments concurrently and return them in source order.
+        
+        At most ``fanout`` segments are in flight at once, so memory stays
+        bounded by the segment size however long the audio is.
+        """
+        if self.engine is not None:
+            return self.request_segments(segments, source_lang)
+        results = {}
+        in_flight = {}
+        with ThreadPoolExecutor(max_workers=fanout) as executor:
+            for segment in segments:
+                future = executor.submit(self.transcribe_segment, segment, source_lang)
+                in_flight[future] = (segment.index, segment.start, segment.end)
+                if len(in_flight) >= fanout:
+                    done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        results[in_flight.pop(future)] = future.result()
+                    self.update_status('transcribing', 30 + min(len(results), 19),
+                                       f'Transcribing audio ({len(results)} segments done)...')
+            for future in in_flight:
+                results[in_flight[future]] = future.result()
+        
+        return [(start, end, results[(index, start, end)].strip())
+                for index, start, end in sorted(results)]
+    
+    def request_segments(self, segments, source_lang, fanout=ASYNC_JOB_FANOUT):
+        """transcribe_segments() for the stage engine.
+        
+        Segments are decoded on this thread while up to ``fanout`` of their
+        recognition requests wait on the event loop, none of them holding a
+        thread.
+        """
+        results = {}
+        in_flight = {}
+        
+        def collect(future):
+            segment, key = in_flight.pop(future)
+            try:
+                text = future.result()
+            except BackendError as e:
+                self.segment_failed(segment, e)
+                text = ''
+            except CancelledError:
+                raise JobAbandoned(self.job_id)
+            else:
+                self.transcript_done(segment, key, text)
+            results[(segment.index, segment.start, segment.end)] = text
+        
+        for segment in segments:
+            text, key = self.known_transcript(segment, source_lang)
+            if text is not None:
+                results[(segment.index, segment.start, segment.end)] = text
+                continue
+            in_flight[self.recognition_request(segment, source_lang)] = (segment, key)
+            if len(in_flight) >= fanout:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    collect(future)
+                self.update_status('transcribing', 30 + min(len(results), 19),
+                                   f'Transcribing audio ({len(results)} segments done)...')
+        for future in list(in_flight):
+            collect(future)
+        
+        return [(start, end, results[(index, start, end)].strip())
+                for index, start, end in sorted(results)]
+    
     def transcribe_audio(self):
-        """Transcribe audio using SpeechRecognition"""
+        """Transcribe audio using SpeechRecognition, one silence-delimited segment at a time"""
         try:
             self.update_status('transcribing', 30, 'Transcribing audio...')
             
-            # Use SpeechRecognition to transcribe
-            with sr.AudioFile(self.audio_path) as source:
-                # Adjust for noise
-                self.recognizer.adjust_for_ambient_noise(source, duration=0.5)
-                audio_data = self.recognizer.record(source)
-                
-                # Detect language and use Google Speech Recognition with language hint
-                # For Arabic videos, use 'ar-AR' as language hint
-                source_lang = 'ar-AR' if self.target_language != 'ar' else 'en-US'
-                try:
-                    transcription = self.recognizer.recognize_google(audio_data, language=source_lang)
-                except sr.UnknownValueError:
-                    # If failed with specific language, try without language hint
-                    transcription = self.recognizer.recognize_google(audio_data)
-            
-            logger.debug(f"Transcription completed: {transcription[:100] if transcription else ''}...")
+            source_lang = self.source_language()
+            
+            done = self.checkpoint.completed('transcribe_audio')
+            if done is not None:
+                self.transcript_segments = [tuple(segment) for segment in done['segments']]
+                self.audio_seconds = done['audio_seconds']
+                self.update_status('transcribed', 50, 'Transcription restored after restart')
+                return done['transcription']
+            
+            # Split at silence and transcribe the pieces in parallel
+            with self.timed('transcribe_audio'):
+                self.transcript_segments = self.transcribe_segments(self.audio_segments(), source_lang)
+            if self.transcript_segments:
+                self.audio_seconds = self.transcript_segments[-1][1]
+            transcription = ' '.join(text for _, _, text in self.transcript_segments if text)
+            
+            logger.debug(f"Transcription completed from {len(self.transcript_segments)} segments: "
+                         f"{transcription[:100] if transcription else ''}...")
             
             # If transcription is empty or failed, use a placeholder for testing
             if not transcription or len(transcription.strip()) == 0:
                 logger.warning("Transcription was empty, using fallback text")
                 transcription = "هذا نص توضيحي للترجمة" if source_lang == 'ar-AR' else "This is a sample text for translation"
             
+            self.save_checkpoint('transcribe_audio', data={
+                'segments': self.transcript_segments,
+                'audio_seconds': self.audio_seconds,
+                'transcription': transcription,
+            })
             self.update_status('transcribed', 50, 'Transcription completed')
             return transcription
+        except AudioExtractionError:
+            # extract_audio has already reported the error
+            return None
         except Exception as e:
             self.update_status('error', 0, f'Error transcribing audio: {str(e)}')
             logger.error(f"Error transcribing audio: {e}")
             # Return a fallback text to continue the pipeline for demo purposes
-            fallback_text = "هذا نص توضيحي للترجمة" if self.target_language != 'ar' else "This is a sample text for translation"
+            fallback_text = "هذا نص توضيحي للترجمة" if 'ar' not in self.target_languages else "This is a sample text for translation"
             logger.warning(f"Using fallback text for demonstration: {fallback_text}")
             self.update_status('transcribed', 50, 'Using sample text (transcription failed)')
             return fallback_text
     
+    def translate_pieces(self, pieces):
+        """Translate texts through translation memory and the shared batcher"""
+        translated = [None] * len(pieces)
+        futures = {}
+        batch_key = (self.translation.name, 'auto', self.target_language)
+        for i, piece in enumerate(pieces):
+            key = make_key(' '.join(piece.split()), 'auto', self.target_language, self.translation.name)
+            translated[i] = self.translation_cache.get_text(key)
+            if translated[i] is None:
+                # Concurrent jobs' segments are coalesced into batch requests
+                futures[i] = (key, self.translation_batcher.submit(batch_key, piece))
+        if futures:
+            # The stage engine applies its own per-service limits
+            with self.stage_slot('network') if self.engine is None else nullcontext():
+                for i, (key, future) in futures.items():
+                    translated[i] = self.translation_result(future, batch_key, pieces[i])
+                    self.translation_cache.set_text(key, translated[i])
+        return translated
+    
+    def translation_result(self, future, batch_key, piece):
+        """Result of a batched translation; retries resubmit just this text"""
+        pending = [future]
+        
+        def attempt():
+            return pending.pop() if pending else self.translation_batcher.submit(batch_key, piece)
+        
+        if self.engine is not None:
+            return self.service_future('translate', lambda: asyncio.wrap_future(attempt())).result()
+        return self.call_service('translate', lambda: attempt().result())
+    
     def translate_text(self, text):
-        """Translate text using Google Translate"""
+        """Translate text segment by segment with the configured translation backend"""
         try:
             self.update_status('translating', 60, 'Translating text...')
             
-            # Use Google Translate
-            translated = self.translator.translate(text, dest=self.target_language)
+            done = self.checkpoint.completed('translate_text', inputs=text)
+            if done is not None:
+                self.update_status('translated', 70, 'Translation restored after restart')
+                return done['text']
+            
+            with self.timed('translate_text'):
+                pieces = [piece for _, _, piece in self.transcript_segments if piece]
+                if ' '.join(pieces) != text:
+                    # Fallback text that did not come from the segments
+                    pieces = [text]
+                translated_text = ' '.join(piece for piece in self.translate_pieces(pieces) if piece)
+            self.count_bytes('translate_text', 'in', len(text.encode('utf-8')))
+            self.count_bytes('translate_text', 'out', len(translated_text.encode('utf-8')))
             
+            self.save_checkpoint('translate_text', data={'text': translated_text}, inputs=text)
             logger.debug(f"Translation completed to {self.target_language}")
             self.update_status('translated', 70, 'Translation completed')
-            return translated.text
+            return translated_text
         except Exception as e:
             self.update_status('error', 0, f'Error translating text: {str(e)}')
             logger.error(f"Error translating text: {e}")
             return None
     
+    def synthesize(self, text):
+        """Speech audio for text, reusing a clip synthesized earlier for the same text and voice"""
+        key = make_key(text, self.target_language, self.tts.voice)
+        clip = self.tts_cache.get(key)
+        if clip is None:
+            if self.engine is not None:
+                clip = self.service_future('tts', lambda: self.tts.synthesize_async(
+                    text, self.target_language)).result()
+            else:
+                with self.stage_slot('network'):
+                    clip = self.call_service('tts', self.tts.synthesize, text, self.target_language)
+            self.tts_cache.set(key, clip)
+        return clip
+    
     def text_to_speech(self, text):
-        """Convert text to speech using gTTS"""
+        """Convert text to speech with the configured TTS backend"""
         try:
             self.update_status('generating_speech', 80, 'Converting text to speech...')
             
-            # Use gTTS to convert text to speech
-            tts = gTTS(text=text, lang=self.target_language, slow=False)
-            tts.save(self.translated_audio_path)
+            if self.checkpoint.completed('text_to_speech', inputs=text) is not None:
+                self.update_status('speech_generated', 85, 'Speech restored after restart')
+                return True
+            
+            with self.timed('text_to_speech'):
+                clip = self.synthesize(text)
+                with open(self.translated_audio_path, 'wb') as f:
+                    f.write(clip)
+            self.count_bytes('text_to_speech', 'in', len(text.encode('utf-8')))
+            self.count_bytes('text_to_speech', 'out', len(clip))
             
+            self.save_checkpoint('text_to_speech', [self.translated_audio_path], inputs=text)
             logger.debug(f"Text-to-speech completed to {self.translated_audio_path}")
             self.update_status('speech_generated', 85, 'Speech generated')
             return True
@@ -167,6 +541,12 @@ class VideoProcessor:
         try:
             self.update_status('merging', 90, 'Merging audio with video...')
             
+            speech_hash = file_sha256(self.translated_audio_path)
+            if self.checkpoint.completed('merge_audio_video', inputs=speech_hash) is not None:
+                self.processing_jobs.update(self.job_id, output_path=self.output_video_path)
+                self.update_status('completed', 100, 'Processing completed')
+                return True
+            
             # Use ffmpeg to merge audio with video
             command = [
                 'ffmpeg', '-i', self.video_path, 
@@ -175,25 +555,117 @@ class VideoProcessor:
                 '-c:v', 'copy', '-shortest',
                 self.output_video_path, '-y'
             ]
+            if os.path.splitext(self.output_video_path)[1].lower() in FASTSTART_EXTENSIONS:
+                # Put the moov atom first so players can start and seek before the download ends
+                command[-2:-2] = ['-movflags', '+faststart']
             
-            subprocess.run(command, check=True)
+            with self.timed('merge_audio_video'), self.stage_slot('ffmpeg'), self.span('ffmpeg', 'subprocess'):
+                subprocess.run(command, check=True)
+            self.count_bytes('merge_audio_video', 'in',
+                             os.path.getsize(self.video_path) + os.path.getsize(self.translated_audio_path))
+            self.count_bytes('merge_audio_video', 'out', os.path.getsize(self.output_video_path))
             
+            self.save_checkpoint('merge_audio_video', [self.output_video_path], inputs=speech_hash)
             logger.debug(f"Merged audio and video to {self.output_video_path}")
-            self.update_status('completed', 100, 'Processing completed')
             
-            # Update the output path in the job status
-            self.processing_jobs[self.job_id]['output_path'] = self.output_video_path
+            # Update the output path before announcing completion
+            self.processing_jobs.update(self.job_id, output_path=self.output_video_path)
+            self.update_status('completed', 100, 'Processing completed')
             return True
         except Exception as e:
             self.update_status('error', 0, f'Error merging audio and video: {str(e)}')
             logger.error(f"Error merging audio and video: {e}")
             return False
     
+    def dub(self, transcription):
+        """Translate, synthesize and merge for this processor's target language"""
+        # 3. Translate text
+        translated_text = self.translate_text(transcription)
+        if not translated_text:
+            return False
+        
+        # 4. Convert text to speech
+        if not self.text_to_speech(translated_text):
+            return False
+        
+        # 5. Merge audio with video
+        return self.merge_audio_video()
+    
+    def dub_languages(self, transcription):
+        """Run the per-language stages of every child job in parallel"""
+        try:
+            from flask import current_app
+            app = current_app._get_current_object()
+        except (ImportError, RuntimeError):
+            app = None
+        
+        def run_branch(branch):
+            branch.transcript_segments = self.transcript_segments
+            branch.update_status('transcribed', 50, 'Transcription completed')
+            if app is None:
+                return branch.dub(transcription)
+            with app.app_context():
+                return branch.dub(transcription)
+        
+        self.update_status('dubbing', 60, f'Dubbing into {len(self.branches)} languages...')
+        with ThreadPoolExecutor(max_workers=min(LANGUAGE_FANOUT, len(self.branches))) as executor:
+            results = dict(zip(self.branches, executor.map(run_branch, self.branches.values())))
+        
+        succeeded = [language for language, ok in results.items() if ok]
+        if not succeeded:
+            self.update_status('error', 0, 'Dubbing failed for every language')
+        elif len(succeeded) < len(results):
+            self.update_status('completed', 100, f'Completed {len(succeeded)} of {len(results)} languages')
+        else:
+            self.update_status('completed', 100, 'Processing completed')
+        return bool(succeeded)
+    
+    def fail_unfinished_branches(self):
+        """Mark child jobs as failed when the shared stages did not finish"""
+        # Records may already be evicted from the registry
+        reason = (self.processing_jobs.get(self.job_id) or {}).get('message') or 'unknown error'
+        for branch in self.branches.values():
+            if (self.processing_jobs.get(branch.job_id) or {}).get('status') not in ('completed', 'error'):
+                branch.update_status('error', 0, f'Shared processing failed: {reason}'[:255])
+    
+    def start_profiling(self):
+        """Profile this job if its upload asked for it or it was sampled"""
+        if not should_profile(self.processing_jobs.get(self.job_id, {}).get('profile')):
+            return
+        self.profiler = JobProfiler(self.job_id, profile_dir(os.path.join(self.processed_dir, self.job_id)))
+        self.profiler.add_owner(self)
+        for branch in self.branches.values():
+            branch.profiler = self.profiler
+            self.profiler.add_owner(branch)
+        self.profiler.start()
+        logger.info(f"Job {self.job_id}: profiling")
+    
+    def finish_profiling(self):
+        """Write the job's profile to processed/<job_id>/profile/"""
+        try:
+            self.profiler.finish()
+        except OSError as e:
+            logger.error(f"Job {self.job_id}: could not write profile: {e}")
+        for processor in [self] + list(self.branches.values()):
+            processor.profiler = None
+    
     def process_video(self):
         """Process the video through the entire pipeline"""
+        started = time.time()
+        self.start_profiling()
         try:
-            # 1. Extract audio
-            if not self.extract_audio():
+            if PIPELINE_MODE == 'streaming' and not self.branches:
+                # Segments flow through all stages at once, extraction included
+                from streaming import StreamingDubber
+                dubber = StreamingDubber(self)
+                if self.profiler is not None:
+                    self.profiler.add_owner(dubber)
+                if dubber.run():
+                    logger.info(f"Video processing completed for job {self.job_id}")
+                return
+            
+            # 1. Extract audio (pipe mode decodes during transcription instead)
+            if self.audio_mode != 'pipe' and not self.extract_audio():
                 return
             
             # 2. Transcribe audio
@@ -201,21 +673,31 @@ class VideoProcessor:
             if not transcription:
                 return
             
-            # 3. Translate text
-            translated_text = self.translate_text(transcription)
-            if not translated_text:
-                return
-            
-            # 4. Convert text to speech
-            if not self.text_to_speech(translated_text):
-                return
-            
-            # 5. Merge audio with video
-            if not self.merge_audio_video():
+            # 3-5. Translate, convert to speech and merge, once per target language
+            if self.branches:
+                self.dub_languages(transcription)
+            elif not self.dub(transcription):
                 return
             
             logger.info(f"Video processing completed for job {self.job_id}")
             
+        except JobAbandoned:
+            # Another worker runs the job now; it owns the job's status
+            logger.warning(f"Job {self.job_id}: stopped, the job was taken over")
         except Exception as e:
             self.update_status('error', 0, f'Unexpected error: {str(e)}')
             logger.error(f"Unexpected error: {e}")
+        finally:
+            if self.engine is not None:
+                # Nothing waits for service calls left behind by a failed stage
+                for job_id in [self.job_id] + [branch.job_id for branch in self.branches.values()]:
+                    cancel_job(job_id)
+            if not self.processing_jobs.abandoned(self.job_id):
+                if self.branches:
+                    self.fail_unfinished_branches()
+                self.save_metrics(started)
+                for branch in self.branches.values():
+                    branch.audio_seconds = self.audio_seconds
+                    branch.save_metrics(started)
+            if self.profiler is not None:
+                self.finish_profiling()
@@ -0,0 +1,205 @@
+"""Standalone worker that processes jobs from the database queue.
+
+Run one or more of these next to the web tier (on the same machine or on
+others sharing DATABASE_URL) with JOB_QUEUE_BACKEND=database set for the
+web app:
+
+    python worker.py --concurrency 2
+"""
+import os
+import argparse
+import logging
+import socket
+import threading
+import uuid
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from app import app
+from models import TranslationJob
+from job_registry import JobRegistry, JobAbandoned
+from video_processor import VideoProcessor
+from scheduler import get_scheduler
+from content_store import get_content_store
+from async_engine import cancel_job
+import metrics
+
+logger = logging.getLogger(__name__)
+
+LEASE_SECONDS = int(os.environ.get('JOB_LEASE_SECONDS', '60'))
+POLL_INTERVAL = float(os.environ.get('JOB_POLL_INTERVAL', '2'))
+MAX_ATTEMPTS = int(os.environ.get('JOB_MAX_ATTEMPTS', '3'))
+# Port for this worker's Prometheus metrics; 0 disables the endpoint
+METRICS_PORT = int(os.environ.get('WORKER_METRICS_PORT', '0'))
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """Serves this worker's metrics at /metrics"""
+
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = metrics.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', metrics.CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+
+def serve_metrics(port):
+    """Serve metrics from a background thread"""
+    server = ThreadingHTTPServer(('0.0.0.0', port), MetricsHandler)
+    thread = threading.Thread(target=server.serve_forever, name='metrics-server')
+    thread.daemon = True
+    thread.start()
+    logger.info(f"Serving worker metrics on port {port}")
+    return server
+
+
+class Worker:
+    """Claims queued jobs, keeps their leases alive and runs the pipeline"""
+
+    def __init__(self, concurrency=1, lease_seconds=LEASE_SECONDS, poll_interval=POLL_INTERVAL):
+        self.worker_id = f'{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}'
+        self.concurrency = max(1, concurrency)
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self.scheduler = get_scheduler()
+        # Progress is written to the database by the registry's flusher, only
+        # while this worker holds the job's lease
+        self.jobs = JobRegistry(app, lease_owner=self.worker_id)
+        self._stop = threading.Event()
+
+    def run(self):
+        """Run ``concurrency`` job loops until stopped"""
+        logger.info(f"Worker {self.worker_id} starting with concurrency {self.concurrency}")
+        threads = []
+        for i in range(self.concurrency):
+            thread = threading.Thread(target=self._job_loop, name=f'queue-worker-{i}')
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+        try:
+            while not self._stop.is_set():
+                self._stop.wait(self.lease_seconds / 2)
+                with app.app_context():
+                    requeued, failed = TranslationJob.requeue_expired(max_attempts=MAX_ATTEMPTS)
+                if requeued or failed:
+                    logger.warning(f"Recovered abandoned jobs: {requeued} requeued, {failed} failed")
+        except KeyboardInterrupt:
+            logger.info(f"Worker {self.worker_id} shutting down")
+            self.stop()
+        for thread in threads:
+            thread.join()
+
+    def stop(self):
+        self._stop.set()
+
+    def _job_loop(self):
+        while not self._stop.is_set():
+            with app.app_context():
+                job = TranslationJob.claim_next(self.worker_id, self.lease_seconds)
+                if job is None:
+                    claimed = None
+                else:
+                    metrics.QUEUE_WAIT_SECONDS.observe((datetime.utcnow() - job.created_at).total_seconds())
+                    # Multi-language jobs carry their per-language children; after a
+                    # lost lease some may be mid-way and resume from their checkpoints
+                    children = (TranslationJob.query.filter_by(parent_id=job.id)
+                                .filter(TranslationJob.status.notin_(TranslationJob.TERMINAL_STATUSES + ('waiting_duplicate',)))
+                                .all())
+                    claimed = (job.id, job.original_path, job.target_language, job.filename,
+                               {child.target_language: child.id for child in children},
+                               bool((job.extra_data or {}).get('profile')))
+            if claimed is None:
+                self._stop.wait(self.poll_interval)
+                continue
+            self.process(*claimed)
+
+    def process(self, job_id, video_path, target_language, filename, child_jobs=None, profile=False):
+        """Run one claimed job to completion while heartbeating its lease"""
+        logger.info(f"Worker {self.worker_id} processing job {job_id}")
+        for language, entry_id in [(target_language, job_id)] + list((child_jobs or {}).items()):
+            self.jobs.create(entry_id, {
+                'status': 'claimed',
+                'progress': 0,
+                'message': '',
+                'filename': filename,
+                'target_language': language,
+                'original_path': video_path,
+                'output_path': None,
+            })
+        if profile:
+            self.jobs.update(job_id, persist=False, profile=True)
+
+        done = threading.Event()
+        lost = threading.Event()
+        heartbeat = threading.Thread(target=self._heartbeat_loop, args=(job_id, done, lost, child_jobs))
+        heartbeat.daemon = True
+        heartbeat.start()
+
+        try:
+            with app.app_context():
+                processor = VideoProcessor(job_id, video_path, target_language, self.jobs,
+                                           scheduler=self.scheduler, child_jobs=child_jobs)
+                processor.process_video()
+        except JobAbandoned:
+            pass  # the lease was lost while the pipeline was reporting an error
+        finally:
+            done.set()
+            heartbeat.join()
+
+        if lost.is_set():
+            # The job's state belongs to the worker that took it over
+            logger.warning(f"Abandoned job {job_id} after losing its lease")
+            for entry_id in [job_id] + list((child_jobs or {}).values()):
+                self.jobs.forget(entry_id)
+            return
+
+        # Persist the final states and give up the lease
+        self.jobs.flush()
+        with app.app_context():
+            if not TranslationJob.release(job_id, self.worker_id):
+                logger.warning(f"Lease on job {job_id} was lost before it finished")
+                return
+            # Share the results with identical uploads that joined these jobs
+            for finished_id in (child_jobs or {job_id: job_id}).values():
+                get_content_store().resolve_duplicates(finished_id, self.jobs.get(finished_id))
+
+    def _heartbeat_loop(self, job_id, done, lost, child_jobs=None):
+        while not done.wait(self.lease_seconds / 3):
+            with app.app_context():
+                if not TranslationJob.heartbeat(job_id, self.worker_id, self.lease_seconds):
+                    logger.warning(f"Worker {self.worker_id} lost the lease on job {job_id}")
+                    lost.set()
+                    # Another worker will run the job; stop writing its state and
+                    # spending quota on it here
+                    for entry_id in [job_id] + list((child_jobs or {}).values()):
+                        self.jobs.abandon(entry_id)
+                        cancel_job(entry_id)
+                    return
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Process queued video translation jobs')
+    parser.add_argument('--concurrency', type=int, default=int(os.environ.get('WORKER_POOL_SIZE', '2')),
+                        help='number of jobs to process at the same time')
+    parser.add_argument('--lease-seconds', type=int, default=LEASE_SECONDS)
+    parser.add_argument('--poll-interval', type=float, default=POLL_INTERVAL)
+    parser.add_argument('--metrics-port', type=int, default=METRICS_PORT,
+                        help='serve Prometheus metrics on this port (0 to disable)')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if args.metrics_port:
+        serve_metrics(args.metrics_port)
+    Worker(args.concurrency, args.lease_seconds, args.poll_interval).run()
+
+
+if __name__ == '__main__':
+    main()